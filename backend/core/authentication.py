@@ -0,0 +1,73 @@
+import time
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
+from rest_framework_simplejwt.settings import api_settings
+
+from .instrumentation import note_auth
+
+# Users resolved from tokens, in the shared cache so that deactivating a user
+# or changing their password, which evicts them (core/signals.py), takes
+# effect on every worker at once. The timeout bounds staleness from bulk
+# updates, and from other workers when the cache is the in-process one.
+AUTH_USER_CACHE_TTL = getattr(settings, 'AUTH_USER_CACHE_TTL', 60)
+
+
+def user_cache_key(user_id):
+    return f'auth:user:{user_id}'
+
+
+def forget_cached_user(user_id):
+    key = user_cache_key(user_id)
+    cache.delete(key)
+    # Again once committed, in case a concurrent request cached the old row meanwhile
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def token_user_id(validated_token):
+    try:
+        return validated_token[api_settings.USER_ID_CLAIM]
+    except KeyError:
+        raise InvalidToken('Token contained no recognizable user identification')
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that resolves the token's user from the cache.
+    Signatures and expiry are checked without touching the database; only a
+    cache miss loads the user. Each cache read unpickles a fresh copy, so
+    nothing a request changes leaks into the cache.
+    """
+
+    def authenticate(self, request):
+        started = time.perf_counter()
+        try:
+            return super().authenticate(request)
+        finally:
+            note_auth(time.perf_counter() - started)
+
+    def get_user(self, validated_token):
+        key = user_cache_key(token_user_id(validated_token))
+        user = cache.get(key)
+        if user is None:
+            user = super().get_user(validated_token)
+            cache.set(key, user, AUTH_USER_CACHE_TTL)
+        return user
+
+
+async def get_user_for_token(raw_token):
+    """Resolve an access token to its user from async code; ``None`` if it is not valid."""
+    authentication = CachedJWTAuthentication()
+    try:
+        validated_token = authentication.get_validated_token(raw_token)
+        user = await cache.aget(user_cache_key(token_user_id(validated_token)))
+        if user is None:
+            user = await database_sync_to_async(authentication.get_user)(validated_token)
+    except (InvalidToken, TokenError, AuthenticationFailed):
+        return None
+    return user
@@ -0,0 +1,67 @@
+from datetime import timedelta
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.db.models import DurationField, ExpressionWrapper, F, Max
+
+from .models import Trip
+
+MAX_DURATION_KEY = 'trips:max_duration_days'
+MAX_DURATION_TIMEOUT = 3600
+
+
+def bound_is_shared():
+    """
+    Whether every worker sees the same max_trip_duration. An in-process cache
+    is only raised in the worker that saved the longer trip, so the others
+    would leave that trip out of their windows.
+    """
+    return not isinstance(caches['default'], (LocMemCache, DummyCache))
+
+
+def max_trip_duration():
+    """Longest end_date - start_date of any trip, in days."""
+    days = cache.get(MAX_DURATION_KEY)
+    if days is None:
+        longest = Trip.objects.using(DEFAULT_DB_ALIAS).aggregate(longest=Max(
+            ExpressionWrapper(F('end_date') - F('start_date'), output_field=DurationField()),
+        ))['longest']
+        days = longest.days if longest is not None else 0
+        # Saves that exceed it drop it (note_trip_duration); the timeout covers
+        # writes that bypass signals
+        cache.set(MAX_DURATION_KEY, days, MAX_DURATION_TIMEOUT)
+    return days
+
+
+def note_trip_duration(start_date, end_date):
+    # Only a trip longer than the bound forces a recount. The bound is dropped
+    # rather than raised in place, which concurrent savers could undo, and
+    # again after commit in case a recount ran before the trip was visible.
+    days = (end_date - start_date).days
+    current = cache.get(MAX_DURATION_KEY)
+    if current is not None and days > current:
+        forget_max_trip_duration()
+        transaction.on_commit(forget_max_trip_duration)
+
+
+def forget_max_trip_duration():
+    cache.delete(MAX_DURATION_KEY)
+
+
+def overlapping(queryset, start=None, end=None):
+    """
+    Trips running at some point between ``start`` and ``end`` (either may be
+    open): start_date <= end and end_date >= start. No trip starts more than
+    the longest trip's duration before ``start``, which turns the open-ended
+    end_date test into a bounded range scan on the (start_date, end_date)
+    index. That bound is only used when it lives in a shared cache.
+    """
+    if end is not None:
+        queryset = queryset.filter(start_date__lte=end)
+    if start is not None:
+        queryset = queryset.filter(end_date__gte=start)
+        if bound_is_shared():
+            queryset = queryset.filter(start_date__gte=start - timedelta(days=max_trip_duration()))
+    return queryset
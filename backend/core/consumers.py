@@ -1,17 +1,65 @@
-import json
+import time
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from django.contrib.auth import get_user_model
-from rest_framework_simplejwt.tokens import UntypedToken
-from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
 from django.conf import settings
-from .models import Trip, TripMember, Message
+from django.core.cache import cache
+from django.utils import timezone
+from . import fastjson
+from .authentication import get_user_for_token
+from .instrumentation import InstrumentedConsumerMixin
+from .membership import ais_approved_member, membership_key
+from .models import Message
+from .ratelimit import (
+    CHAT_MAX_FRAME_BYTES, CHAT_MAX_MESSAGE_LENGTH, CHAT_SLOW_CONSUMER_LAG, CHAT_SLOW_CONSUMER_MAX_DROPS,
+    CHAT_SLOW_CONSUMER_POLICY, chat_metrics, chat_rate_limiter,
+)
+from .presence import presence_index, room_event, typing_batcher
+from .notifications import chat_notifications, get_unread_count, notification_group
+from .writebehind import CHAT_WRITE_BEHIND, message_buffer
 from urllib.parse import parse_qs
-import jwt
 
-User = get_user_model()
+# Number of recent messages replayed on connect when the client asks for none
+CHAT_HISTORY_REPLAY = getattr(settings, 'CHAT_HISTORY_REPLAY', 0)
+CHAT_HISTORY_REPLAY_MAX = getattr(settings, 'CHAT_HISTORY_REPLAY_MAX', 100)
 
-class TripChatConsumer(AsyncWebsocketConsumer):
+
+class TokenAuthMixin:
+    """Resolves the connecting user from a JWT access token."""
+    accepted_subprotocol = None
+
+    def get_query_param(self, name, default=None):
+        query_string = self.scope.get('query_string', b'').decode()
+        values = parse_qs(query_string).get(name)
+        return values[0] if values else default
+
+    async def get_user_from_jwt(self):
+        token = self.get_token()
+        if not token:
+            return None
+        return await get_user_for_token(token)
+
+    def get_token(self):
+        # Browsers can't set headers on a WebSocket, so clients pass the token in
+        # the query string or as the last offered subprotocol
+        # ("Sec-WebSocket-Protocol: access_token, <jwt>").
+        token = self.get_query_param('token') or self.get_query_param('access')
+        if token:
+            return token
+
+        subprotocols = self.scope.get('subprotocols') or []
+        if subprotocols:
+            # The handshake must echo one of the offered subprotocols back
+            self.accepted_subprotocol = subprotocols[0]
+            return subprotocols[-1]
+
+        headers = dict(self.scope.get('headers', []))
+        auth_header = headers.get(b'authorization')
+        if auth_header:
+            return auth_header.decode().split()[-1]
+        return None
+
+
+class TripChatConsumer(InstrumentedConsumerMixin, TokenAuthMixin, AsyncWebsocketConsumer):
     async def connect(self):
         self.trip_id = self.scope['url_route']['kwargs']['trip_id']
         self.room_group_name = f'trip_{self.trip_id}'
@@ -23,91 +71,209 @@ class TripChatConsumer(AsyncWebsocketConsumer):
             self.room_group_name,
             self.channel_name
         )
-        await self.accept()
+        self.rate_bucket = chat_rate_limiter.connection_bucket()
+        self.lagging = 0
+        # ?presence=1 subscribes the socket to presence and typing frames
+        self.wants_presence = self.get_query_param('presence') == '1'
+        await self.accept(subprotocol=self.accepted_subprotocol)
+        await self.replay_history()
+        if presence_index.join(self.trip_id, self.user.id, self.user.username, self.channel_name):
+            await self.announce_presence(self.user.username, 'online')
+        if self.wants_presence:
+            await self.send_presence()
 
     async def disconnect(self, close_code):
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
+        if getattr(self, 'user', None) and presence_index.leave(self.trip_id, self.user.id, self.channel_name):
+            await self.announce_presence(self.user.username, 'offline')
+        if CHAT_WRITE_BEHIND:
+            await message_buffer.flush()
 
-    async def receive(self, text_data):
-        data = json.loads(text_data)
+    async def receive(self, text_data=None, bytes_data=None):
+        frame = text_data.encode() if text_data is not None else bytes_data or b''
+        if len(frame) > CHAT_MAX_FRAME_BYTES:
+            chat_metrics['frames_oversized'] += 1
+            await self.close(code=1009)
+            return
+        if not self.user:
+            return
+        data = self.parse_frame(text_data)
+        if data is None:
+            chat_metrics['frames_invalid'] += 1
+            await self.send_error('invalid_frame')
+            return
+        # Any frame counts as a heartbeat
+        if presence_index.touch(self.trip_id, self.user.id, self.user.username, self.channel_name):
+            await self.announce_presence(self.user.username, 'online')
+        frame_type = data.get('type')
+        if frame_type == 'typing':
+            typing_batcher.queue(self.room_group_name, self.user.username)
+            return
+        if frame_type == 'presence':
+            await self.send_presence()
+            return
         message = data.get('message')
-        if not message or not self.user:
+        if not message:
+            return
+        if not isinstance(message, str):
+            chat_metrics['frames_invalid'] += 1
+            await self.send_error('invalid_frame')
             return
-        # Save message to DB
-        await self.save_message(message)
-        # Notify other members
-        await self.notify_other_members()
-        # Broadcast to group
+        if len(message) > CHAT_MAX_MESSAGE_LENGTH:
+            chat_metrics['messages_too_long'] += 1
+            await self.send_error('message_too_long', max_length=CHAT_MAX_MESSAGE_LENGTH)
+            return
+        scope, retry_after = chat_rate_limiter.acquire(self.rate_bucket, self.user.id, self.trip_id)
+        if scope:
+            await self.send_error('rate_limited', scope=scope, retry_after=round(retry_after, 3))
+            return
+        chat_metrics['frames_accepted'] += 1
+        # Save message to DB, or hand it to the write-behind buffer
+        if CHAT_WRITE_BEHIND:
+            sent_at = timezone.now()
+            message_buffer.add(self.trip_id, self.user.id, message, sent_at)
+        else:
+            sent_at = (await self.save_message(message)).timestamp
+        # Broadcast to group, encoded once and sent as-is to every member
         await self.channel_layer.group_send(
             self.room_group_name,
             {
                 'type': 'chat_message',
-                'message': message,
-                'sender': self.user.username,
-                'timestamp': self.get_timestamp(),
+                'frame': fastjson.dumps_text({
+                    'message': message,
+                    'sender': self.user.username,
+                    'timestamp': self.format_timestamp(sent_at),
+                }),
+                'sent_at': time.time(),
             }
         )
+        # Notify other members once the message is out
+        self.notify_other_members()
 
     async def chat_message(self, event):
-        await self.send(text_data=json.dumps({
-            'message': event['message'],
-            'sender': event['sender'],
-            'timestamp': event['timestamp'],
+        # A broadcast that waited this long sat behind others in this socket's
+        # queue: the client isn't keeping up, so skip it rather than pile on
+        if time.time() - event.get('sent_at', time.time()) > CHAT_SLOW_CONSUMER_LAG:
+            self.lagging += 1
+            chat_metrics['frames_dropped_slow'] += 1
+            if CHAT_SLOW_CONSUMER_POLICY == 'disconnect' or self.lagging >= CHAT_SLOW_CONSUMER_MAX_DROPS:
+                chat_metrics['slow_consumers_disconnected'] += 1
+                await self.close(code=4008)
+            return
+        self.lagging = 0
+        await self.send(text_data=event['frame'])
+
+    async def room_event(self, event):
+        # Presence and typing frames, encoded once by the sender
+        if self.wants_presence:
+            await self.send(text_data=event['frame'])
+
+    async def announce_presence(self, username, status):
+        await self.channel_layer.group_send(
+            self.room_group_name, room_event({'type': 'presence', 'user': username, 'status': status}),
+        )
+
+    async def send_presence(self):
+        # Sockets that stopped sending heartbeats without closing go offline here
+        for username in presence_index.expire(self.trip_id):
+            await self.announce_presence(username, 'offline')
+        await self.send(text_data=fastjson.dumps_text({
+            'type': 'presence',
+            'online': [user['username'] for user in presence_index.online(self.trip_id)],
         }))
 
+    def parse_frame(self, text_data):
+        # A JSON object sent as a text frame, else None
+        if text_data is None:
+            return None
+        try:
+            data = fastjson.loads(text_data)
+        except ValueError:
+            return None
+        return data if isinstance(data, dict) else None
+
+    async def send_error(self, error, **details):
+        await self.send(text_data=fastjson.dumps_text({'error': error, **details}))
+
+    async def replay_history(self):
+        # ?history=N sends the last N messages, oldest first, as regular chat frames
+        try:
+            count = int(self.get_query_param('history', CHAT_HISTORY_REPLAY))
+        except ValueError:
+            count = CHAT_HISTORY_REPLAY
+        count = max(0, min(count, CHAT_HISTORY_REPLAY_MAX))
+        if not count:
+            return
+        for message in await self.get_recent_messages(count):
+            await self.chat_message({
+                'frame': fastjson.dumps_text({
+                    'message': message.content,
+                    'sender': message.sender.username,
+                    'timestamp': self.format_timestamp(message.timestamp),
+                }),
+            })
+
     @database_sync_to_async
-    def is_approved_member(self):
-        return TripMember.objects.filter(trip_id=self.trip_id, user=self.user, status='approved').exists()
+    def get_recent_messages(self, count):
+        # Newest-first range scan on the (trip, timestamp, id) index
+        recent = Message.objects.filter(trip_id=self.trip_id).select_related('sender').order_by('-timestamp', '-id')[:count]
+        return list(recent)[::-1]
+
+    async def membership_changed(self, event):
+        # Sent when a member is removed, rejected or demoted to pending
+        if event['user_id'] != self.user.id:
+            return
+        await cache.adelete(membership_key(self.trip_id))
+        if not await self.is_approved_member():
+            await self.close()
+
+    async def is_approved_member(self):
+        return await ais_approved_member(self.trip_id, self.user.id)
 
     @database_sync_to_async
     def save_message(self, content):
         return Message.objects.create(trip_id=self.trip_id, sender=self.user, content=content)
 
-    @database_sync_to_async
     def notify_other_members(self):
-        from .models import Notification, TripMember, Trip
-        trip = Trip.objects.get(id=self.trip_id)
-        approved_members = TripMember.objects.filter(trip=trip, status='approved').exclude(user=self.user)
-        for member in approved_members:
-            Notification.objects.create(
-                user=member.user,
-                content=f'💬 New message in "{trip.title}"'
-            )
-
-    def get_timestamp(self):
-        from datetime import datetime
-        return datetime.utcnow().isoformat() + 'Z'
+        # Queued and written in bulk by the batcher, off the send path
+        chat_notifications.queue(self.trip_id, self.user.id)
 
-    async def get_user_from_jwt(self):
-            from rest_framework_simplejwt.authentication import JWTAuthentication
-            from jwt.exceptions import InvalidTokenError
-
-            token = None
-
-            # Check query string for token
-            query_string = self.scope.get('query_string', b'').decode()
-            if query_string:
-                params = parse_qs(query_string)
-                token_list = params.get('token') or params.get('access')
-                if token_list:
-                    token = token_list[0]
-
-            # Check headers for token
-            if not token:
-                headers = dict(self.scope.get('headers', []))
-                auth_header = headers.get(b'sec-websocket-protocol') or headers.get(b'authorization')
-                if auth_header:
-                    token = auth_header.decode().split()[-1]
-
-            if not token:
-                return None
-
-            try:
-                validated_token = UntypedToken(token)  # Token structure and expiry check
-                user = JWTAuthentication().get_user(validated_token)
-                return user
-            except (InvalidToken, TokenError, User.DoesNotExist):
-                return None
+    def format_timestamp(self, value):
+        from datetime import timezone as tz
+        return value.astimezone(tz.utc).replace(tzinfo=None).isoformat() + 'Z'
+
+
+class NotificationConsumer(InstrumentedConsumerMixin, TokenAuthMixin, AsyncWebsocketConsumer):
+    """Pushes the user's new notifications and unread count as they change."""
+
+    async def connect(self):
+        self.user = await self.get_user_from_jwt()
+        if not self.user:
+            await self.close()
+            return
+        self.group_name = notification_group(self.user.id)
+        await self.channel_layer.group_add(self.group_name, self.channel_name)
+        await self.accept(subprotocol=self.accepted_subprotocol)
+        await self.unread_count_changed({
+            'unread_count': await database_sync_to_async(get_unread_count)(self.user.id),
+        })
+
+    async def disconnect(self, close_code):
+        if getattr(self, 'group_name', None):
+            await self.channel_layer.group_discard(self.group_name, self.channel_name)
+
+    async def notification_created(self, event):
+        await self.send(text_data=fastjson.dumps_text({
+            'type': 'notification',
+            'notification': event['notification'],
+            'unread_count': event['unread_count'],
+        }))
+
+    async def unread_count_changed(self, event):
+        await self.send(text_data=fastjson.dumps_text({
+            'type': 'unread_count',
+            'unread_count': event['unread_count'],
+        }))
@@ -0,0 +1,42 @@
+"""
+JSON encoding shared by the REST API and the WebSocket consumers: orjson
+when it is installed, the standard library otherwise. Both produce compact
+UTF-8 JSON, so either backend sends the same bytes to clients.
+"""
+import json
+
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - the stdlib fallback
+    orjson = None
+
+# Decimals, lazy translations, querysets... as DRF's encoder renders them
+_drf_encoder = JSONEncoder()
+
+
+def dumps(obj):
+    """Encode ``obj`` as UTF-8 JSON bytes."""
+    if orjson is not None:
+        return orjson.dumps(obj, default=_drf_encoder.default)
+    return json.dumps(
+        obj, cls=JSONEncoder, ensure_ascii=False, separators=(',', ':'), allow_nan=False,
+    ).encode()
+
+
+def dumps_text(obj):
+    """``dumps`` for WebSocket text frames, which take str."""
+    return dumps(obj).decode()
+
+
+def loads(data):
+    """Decode JSON from str or bytes; raises ValueError on malformed input."""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data, parse_constant=_reject_constant)
+
+
+def _reject_constant(name):
+    # orjson refuses NaN and Infinity; keep the fallback equally strict
+    raise ValueError(f'{name} is not valid JSON')
@@ -1,19 +1,44 @@
 import django_filters
 from .models import Trip
 from django.db.models import Q
+from .availability import overlapping
+from .tags import filter_by_tags as apply_tag_filters, parse_tags
 
 class TripFilter(django_filters.FilterSet):
     destination = django_filters.CharFilter(field_name='destination', lookup_expr='icontains')
     start_date = django_filters.DateFilter(field_name='start_date', lookup_expr='gte')
     end_date = django_filters.DateFilter(field_name='end_date', lookup_expr='lte')
     tags = django_filters.CharFilter(method='filter_by_tags')
+    tags_any = django_filters.CharFilter(method='filter_by_any_tags')
+    tags_exclude = django_filters.CharFilter(method='filter_by_excluded_tags')
+    min_rating = django_filters.NumberFilter(field_name='rating_avg', lookup_expr='gte')
+    # Trips overlapping the window, not only the ones inside it
+    available_from = django_filters.DateFilter(method='filter_available')
+    available_to = django_filters.DateFilter(method='filter_available')
+    min_budget = django_filters.NumberFilter(field_name='budget', lookup_expr='gte')
+    max_budget = django_filters.NumberFilter(field_name='budget', lookup_expr='lte')
 
     class Meta:
         model = Trip
-        fields = ['destination', 'start_date', 'end_date', 'tags']
+        fields = [
+            'destination', 'start_date', 'end_date', 'tags', 'tags_any', 'tags_exclude', 'min_rating',
+            'available_from', 'available_to', 'min_budget', 'max_budget',
+        ]
+
+    def filter_available(self, queryset, name, value):
+        # Both ends of the window are applied together, on the first of them
+        if name == 'available_to' and self.form.cleaned_data.get('available_from'):
+            return queryset
+        return overlapping(
+            queryset, self.form.cleaned_data.get('available_from'), self.form.cleaned_data.get('available_to'),
+        )
 
     def filter_by_tags(self, queryset, name, value):
-        tag_list = value.split(',')
-        for tag in tag_list:
-            queryset = queryset.filter(tags__name__in=[tag])
-        return queryset.distinct()
+        # Trips carrying every listed tag
+        return apply_tag_filters(queryset, all_tags=parse_tags(value))
+
+    def filter_by_any_tags(self, queryset, name, value):
+        return apply_tag_filters(queryset, any_tags=parse_tags(value))
+
+    def filter_by_excluded_tags(self, queryset, name, value):
+        return apply_tag_filters(queryset, exclude_tags=parse_tags(value))
@@ -0,0 +1,114 @@
+import hashlib
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+from PIL import Image, ImageOps
+
+from .models import User
+
+logger = logging.getLogger(__name__)
+
+# Longest side, in pixels, of each generated profile photo variant
+PROFILE_PHOTO_SIZES = getattr(settings, 'PROFILE_PHOTO_SIZES', (128, 512))
+# {format: Pillow save options}; the first is the one clients should prefer
+PROFILE_PHOTO_FORMATS = getattr(settings, 'PROFILE_PHOTO_FORMATS', {
+    'webp': {'format': 'WEBP', 'quality': 80, 'method': 4},
+    'jpeg': {'format': 'JPEG', 'quality': 82, 'optimize': True, 'progressive': True},
+})
+PROFILE_PHOTO_VARIANT_DIR = getattr(settings, 'PROFILE_PHOTO_VARIANT_DIR', 'profiles/variants')
+PROFILE_PHOTO_MAX_BYTES = getattr(settings, 'PROFILE_PHOTO_MAX_BYTES', 10 * 1024 * 1024)
+
+# Encoding runs in Pillow's C code, which releases the GIL, so threads are enough
+image_pool = ThreadPoolExecutor(
+    max_workers=getattr(settings, 'IMAGE_PROCESSING_WORKERS', 2), thread_name_prefix='images',
+)
+
+
+def render_variants(source):
+    """
+    Encode ``source`` (a file object) at every size and format. Returns
+    {format: {size: bytes}}. Only pixels are written out, so EXIF (GPS
+    position, camera serial...), ICC and XMP metadata are dropped; the EXIF
+    orientation is applied first so nothing shows up rotated.
+    """
+    with Image.open(source) as image:
+        largest = max(PROFILE_PHOTO_SIZES)
+        # JPEG sources are decoded straight at a reduced scale where possible
+        image.draft('RGB', (largest, largest))
+        image = ImageOps.exif_transpose(image)
+        if image.mode != 'RGB':
+            # Flatten transparency onto white: JPEG has no alpha channel
+            rgba = image.convert('RGBA')
+            image = Image.new('RGB', rgba.size, 'white')
+            image.paste(rgba, mask=rgba.getchannel('A'))
+        variants = {fmt: {} for fmt in PROFILE_PHOTO_FORMATS}
+        for size in sorted(PROFILE_PHOTO_SIZES, reverse=True):
+            image.thumbnail((size, size), Image.Resampling.LANCZOS)
+            for fmt, options in PROFILE_PHOTO_FORMATS.items():
+                buffer = BytesIO()
+                image.save(buffer, **options)
+                variants[fmt][size] = buffer.getvalue()
+    return variants
+
+
+def store_variant(content, size, fmt):
+    """Save under a name derived from the bytes, so an identical variant is stored once."""
+    digest = hashlib.sha256(content).hexdigest()[:20]
+    name = f'{PROFILE_PHOTO_VARIANT_DIR}/{digest}-{size}.{fmt}'
+    if not default_storage.exists(name):
+        name = default_storage.save(name, ContentFile(content))
+    return name
+
+
+def process_profile_photo(user_id, photo_name):
+    """Generate and record the variants of ``photo_name`` for the user, unless it was replaced meanwhile."""
+    from .authentication import forget_cached_user
+    from .responsecache import invalidate
+
+    with default_storage.open(photo_name, 'rb') as source:
+        rendered = render_variants(source)
+    variants = {
+        fmt: {str(size): store_variant(content, size, fmt) for size, content in sizes.items()}
+        for fmt, sizes in rendered.items()
+    }
+    # update() skips post_save, so evict what the signal would have
+    if User.objects.filter(pk=user_id, profile_photo=photo_name).update(profile_photo_variants=variants):
+        forget_cached_user(user_id)
+        invalidate(f'user:{user_id}')
+    return variants
+
+
+def _process_in_background(user_id, photo_name):
+    # Pool threads outlive requests, so apply CONN_MAX_AGE and the health
+    # checks around every job as request_started/finished do for requests
+    close_old_connections()
+    try:
+        process_profile_photo(user_id, photo_name)
+    except Exception:
+        logger.exception('Processing profile photo %s of user %s failed', photo_name, user_id)
+    finally:
+        close_old_connections()
+
+
+def schedule_profile_photo(user):
+    """Queue variant generation for the user's photo once the upload is committed."""
+    if not user.profile_photo:
+        return
+    user_id, photo_name = user.pk, user.profile_photo.name
+    transaction.on_commit(lambda: image_pool.submit(_process_in_background, user_id, photo_name))
+
+
+def variant_urls(user, request=None):
+    """{format: {size: url}} of the user's processed photo; empty until processing finishes."""
+    urls = {}
+    for fmt, sizes in (user.profile_photo_variants or {}).items():
+        urls[fmt] = {}
+        for size, name in sizes.items():
+            url = default_storage.url(name)
+            urls[fmt][size] = request.build_absolute_uri(url) if request is not None else url
+    return urls
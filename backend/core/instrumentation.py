@@ -0,0 +1,212 @@
+import logging
+import time
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+
+from .metrics import QUERY_BUCKETS, SIZE_BUCKETS, Counter, registry
+from .ratelimit import chat_metrics
+
+logger = logging.getLogger('core.slow_requests')
+
+# Requests and socket events slower than this are logged with their SQL; None turns the log off
+SLOW_REQUEST_SECONDS = getattr(settings, 'SLOW_REQUEST_SECONDS', None)
+SLOW_REQUEST_MAX_QUERIES = getattr(settings, 'SLOW_REQUEST_MAX_QUERIES', 50)
+
+http_duration = registry.histogram(
+    'http_request_duration_seconds', 'Time to produce the response.', ('view', 'method', 'status'),
+)
+http_queries = registry.histogram(
+    'http_request_db_queries', 'Database queries per request.', ('view', 'method'), QUERY_BUCKETS,
+)
+http_db_time = registry.histogram('http_request_db_seconds', 'Time spent in database queries.', ('view', 'method'))
+http_auth_time = registry.histogram(
+    'http_request_auth_seconds', 'Time spent authenticating the request.', ('view', 'method'),
+)
+http_serializer_time = registry.histogram(
+    'http_request_serializer_seconds',
+    'Time spent in serializers turning objects into primitives, lazy relation queries included.',
+    ('view', 'method'),
+)
+http_render_time = registry.histogram(
+    'http_request_render_seconds', 'Time spent encoding the response body.', ('view', 'method'),
+)
+http_size = registry.histogram(
+    'http_response_size_bytes', 'Response body size.', ('view', 'method'), SIZE_BUCKETS,
+)
+ws_duration = registry.histogram(
+    'websocket_event_duration_seconds', 'Time to handle a WebSocket event.', ('consumer', 'event'),
+)
+ws_queries = registry.histogram(
+    'websocket_event_db_queries', 'Database queries per WebSocket event.', ('consumer', 'event'), QUERY_BUCKETS,
+)
+ws_db_time = registry.histogram(
+    'websocket_event_db_seconds', 'Time spent in database queries per WebSocket event.', ('consumer', 'event'),
+)
+ws_sent = registry.histogram(
+    'websocket_event_sent_size', 'Characters (text frames) or bytes sent to the client per WebSocket event.',
+    ('consumer', 'event'), SIZE_BUCKETS,
+)
+slow_total = registry.counter('slow_requests_total', 'Requests and WebSocket events over SLOW_REQUEST_SECONDS.', ('view',))
+
+
+def collect_chat_metrics():
+    frames = Counter('chat_frames_total', 'Chat frames by what the limits did with them.', ('outcome',))
+    for outcome, count in chat_metrics.items():
+        frames.inc(outcome, amount=count)
+    return [frames]
+
+
+registry.add_collector(collect_chat_metrics)
+
+
+class Stats:
+    """What one request or socket event spent; shared with the threads it hops to."""
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.auth_time = 0.0
+        self.serializer_time = 0.0
+        self.serializer_depth = 0
+        self.render_time = 0.0
+        self.sent_size = 0
+        self.sql = [] if SLOW_REQUEST_SECONDS is not None else None
+
+
+current_stats = ContextVar('current_stats', default=None)
+
+
+def record_query(execute, sql, params, many, context):
+    stats = current_stats.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        elapsed = time.perf_counter() - started
+        stats.queries += 1
+        stats.db_time += elapsed
+        if stats.sql is not None and len(stats.sql) < SLOW_REQUEST_MAX_QUERIES:
+            stats.sql.append((elapsed, sql))
+
+
+@receiver(connection_created)
+def instrument_connection(sender, connection, **kwargs):
+    # Every connection, in every thread, reports to the Stats of the
+    # request or event it runs for (asgiref carries the context over)
+    if record_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(record_query)
+
+
+def note_auth(seconds):
+    stats = current_stats.get()
+    if stats is not None:
+        stats.auth_time += seconds
+
+
+def note_render(seconds):
+    stats = current_stats.get()
+    if stats is not None:
+        stats.render_time += seconds
+
+
+class InstrumentedSerializerMixin:
+    """
+    Adds the time spent in ``to_representation`` (what ``serializer.data``
+    runs, and where an N+1 shows up) to the request's Stats. Nested
+    serializers are counted once, as part of the outermost one.
+    """
+
+    def to_representation(self, instance):
+        stats = current_stats.get()
+        if stats is None:
+            return super().to_representation(instance)
+        stats.serializer_depth += 1
+        started = time.perf_counter()
+        try:
+            return super().to_representation(instance)
+        finally:
+            stats.serializer_depth -= 1
+            if not stats.serializer_depth:
+                stats.serializer_time += time.perf_counter() - started
+
+
+def log_if_slow(label, elapsed, stats):
+    if SLOW_REQUEST_SECONDS is None or elapsed < SLOW_REQUEST_SECONDS:
+        return
+    slow_total.inc(label)
+    statements = '\n'.join(f'  {seconds * 1000:8.2f} ms  {sql}' for seconds, sql in stats.sql)
+    logger.warning(
+        'Slow %s: %.0f ms, %d queries in %.0f ms, auth %.0f ms, serializers %.0f ms, rendering %.0f ms\n%s',
+        label, elapsed * 1000, stats.queries, stats.db_time * 1000, stats.auth_time * 1000,
+        stats.serializer_time * 1000, stats.render_time * 1000, statements,
+    )
+
+
+class InstrumentationMiddleware:
+    """
+    Records latency, query count and time, authentication, serializer and
+    body encoding time and response size per view (URL name) and method.
+    Goes first in MIDDLEWARE so the other middleware is measured too.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = Stats()
+        token = current_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            current_stats.reset(token)
+        elapsed = time.perf_counter() - started
+
+        match = request.resolver_match
+        view = (match.view_name or match.route) if match is not None else 'unmatched'
+        method = request.method
+        http_duration.observe(elapsed, view, method, response.status_code)
+        http_queries.observe(stats.queries, view, method)
+        http_db_time.observe(stats.db_time, view, method)
+        http_auth_time.observe(stats.auth_time, view, method)
+        http_serializer_time.observe(stats.serializer_time, view, method)
+        http_render_time.observe(stats.render_time, view, method)
+        if not response.streaming:
+            http_size.observe(len(response.content), view, method)
+        log_if_slow(f'{method} {request.path} ({view})', elapsed, stats)
+        return response
+
+
+class InstrumentedConsumerMixin:
+    """
+    Consumer counterpart of InstrumentationMiddleware, per consumer class
+    and event type (websocket.connect, websocket.receive, chat_message...).
+    """
+
+    async def dispatch(self, message):
+        stats = Stats()
+        token = current_stats.set(stats)
+        started = time.perf_counter()
+        try:
+            await super().dispatch(message)
+        finally:
+            current_stats.reset(token)
+            elapsed = time.perf_counter() - started
+            consumer, event = type(self).__name__, message['type']
+            ws_duration.observe(elapsed, consumer, event)
+            ws_queries.observe(stats.queries, consumer, event)
+            ws_db_time.observe(stats.db_time, consumer, event)
+            ws_sent.observe(stats.sent_size, consumer, event)
+            log_if_slow(f'{consumer} {event}', elapsed, stats)
+
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        stats = current_stats.get()
+        if stats is not None:
+            # len() of the str, not of its encoding: broadcasts are not re-encoded per socket
+            stats.sent_size += len(text_data) if text_data is not None else len(bytes_data or b'')
+        await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
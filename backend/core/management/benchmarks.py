@@ -0,0 +1,10 @@
+def percentile(values, fraction):
+    if not values:
+        return None
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def int_list(value):
+    # argparse type for comma separated sizes, e.g. --trips 1000,10000
+    return [int(item) for item in value.split(',') if item]
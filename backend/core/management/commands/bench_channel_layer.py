@@ -0,0 +1,110 @@
+import asyncio
+import json
+import time
+
+from channels.layers import InMemoryChannelLayer, channel_layers
+from django.core.management.base import BaseCommand
+
+from core.management.benchmarks import int_list, percentile
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure chat broadcast throughput and latency through the configured channel "
+        "layer for each room size and worker count."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--alias', default='default', help='CHANNEL_LAYERS alias to benchmark.')
+        parser.add_argument('--room-sizes', type=int_list, default=[10, 100, 500])
+        parser.add_argument('--workers', type=int_list, default=[1, 2, 4])
+        parser.add_argument('--messages', type=int, default=100, help='Broadcasts per run.')
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds to wait for deliveries.')
+        parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+
+    def handle(self, *args, **options):
+        worker_counts = options['workers']
+        if isinstance(channel_layers[options['alias']], InMemoryChannelLayer) and max(worker_counts) > 1:
+            # Separate in-process layers never see each other, so "workers" would all share one instance
+            self.stderr.write(
+                'The in-process channel layer cannot span workers; measuring workers=1 only. '
+                'Set CHANNEL_REDIS_HOSTS to compare worker counts.'
+            )
+            worker_counts = [1]
+        results = []
+        for room_size in options['room_sizes']:
+            for workers in worker_counts:
+                results.append(asyncio.run(self.run(
+                    options['alias'], room_size, workers, options['messages'], options['timeout'],
+                )))
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'room':>6} {'workers':>7} {'delivered':>10} {'msg/s':>10} {'p50 ms':>8} {'p99 ms':>8}")
+        for row in results:
+            self.stdout.write(
+                f"{row['room_size']:>6} {row['workers']:>7} {row['delivered']:>10} "
+                f"{row['deliveries_per_second']:>10.0f} {row['p50_ms']:>8.2f} {row['p99_ms']:>8.2f}"
+            )
+
+    def make_layers(self, alias, workers):
+        # Each worker process has its own layer connection; handle() keeps
+        # the in-process layer, which can only be shared, at one worker
+        if isinstance(channel_layers[alias], InMemoryChannelLayer):
+            return [channel_layers[alias]]
+        return [channel_layers.make_backend(alias) for _ in range(workers)]
+
+    async def run(self, alias, room_size, workers, messages, timeout):
+        layers = self.make_layers(alias, workers)
+        group = f'bench_{room_size}_{workers}_{time.monotonic_ns()}'
+        members = []
+        for index in range(room_size):
+            layer = layers[index % workers]
+            channel = await layer.new_channel()
+            await layer.group_add(group, channel)
+            members.append((layer, channel))
+
+        latencies = []
+
+        async def receive(layer, channel):
+            while True:
+                event = await layer.receive(channel)
+                if event['type'] == 'bench.stop':
+                    return
+                latencies.append(time.perf_counter() - event['sent'])
+
+        receivers = [asyncio.ensure_future(receive(layer, channel)) for layer, channel in members]
+        started = time.perf_counter()
+        for index in range(messages):
+            await layers[0].group_send(group, {
+                'type': 'chat.message',
+                'message': f'benchmark message {index}',
+                'sent': time.perf_counter(),
+            })
+            # Let receivers drain so the per-channel capacity is not the bottleneck
+            await asyncio.sleep(0)
+        await layers[0].group_send(group, {'type': 'bench.stop'})
+        done, pending = await asyncio.wait(receivers, timeout=timeout)
+        elapsed = time.perf_counter() - started
+        for task in pending:
+            task.cancel()
+
+        for layer, channel in members:
+            await layer.group_discard(group, channel)
+        for layer in set(layers):
+            if hasattr(layer, 'close_pools'):
+                await layer.close_pools()
+
+        return {
+            'backend': f'{type(layers[0]).__module__}.{type(layers[0]).__name__}',
+            'room_size': room_size,
+            'workers': workers,
+            'messages': messages,
+            'delivered': len(latencies),
+            'expected': messages * room_size,
+            'seconds': round(elapsed, 4),
+            'deliveries_per_second': len(latencies) / elapsed if elapsed else 0,
+            'p50_ms': (percentile(latencies, 0.50) or 0) * 1000,
+            'p99_ms': (percentile(latencies, 0.99) or 0) * 1000,
+        }
@@ -0,0 +1,84 @@
+import json
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from core import fastjson
+from core.management.benchmarks import int_list
+from core.renderers import FastJSONRenderer
+
+
+def cpu_ms(run, repeat):
+    timings = []
+    for _ in range(repeat):
+        started = time.process_time()
+        run()
+        timings.append(time.process_time() - started)
+    return statistics.median(timings) * 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure the CPU spent encoding one chat broadcast per room size (stdlib json "
+        "per recipient, as before, vs. one shared encoding) and rendering a REST page "
+        "(DRF JSONRenderer vs. FastJSONRenderer)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--room-sizes', type=int_list, default=[10, 100, 500])
+        parser.add_argument('--page-size', type=int, default=100, help='Rows in the rendered REST page.')
+        parser.add_argument('--repeat', type=int, default=50)
+        parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+
+    def handle(self, *args, **options):
+        repeat = options['repeat']
+        event = {
+            'message': 'Meet at the Sreemangal bus stand at 7am, bring rain jackets ☔',
+            'sender': 'alice',
+            'timestamp': '2026-01-01T07:00:00.000000Z',
+        }
+        broadcasts = []
+        for room_size in options['room_sizes']:
+            per_recipient = cpu_ms(lambda: [json.dumps(event) for _ in range(room_size)], repeat)
+            shared = cpu_ms(lambda: fastjson.dumps_text(event), repeat)
+            broadcasts.append({
+                'room_size': room_size,
+                'per_recipient_ms': per_recipient,
+                'shared_ms': shared,
+                'saved_ms': per_recipient - shared,
+            })
+
+        page = {
+            'next': None,
+            'previous': None,
+            'results': [
+                {
+                    'id': index, 'title': f'Trip {index}', 'destination': 'Sylhet',
+                    'start_date': '2026-01-01', 'end_date': '2026-01-04', 'creator': index,
+                    'tags': ['hills', 'tea'], 'rating_avg': 4.25, 'rating_count': index,
+                }
+                for index in range(options['page_size'])
+            ],
+        }
+        rest = {
+            'rows': options['page_size'],
+            'drf_ms': cpu_ms(lambda: JSONRenderer().render(page), repeat),
+            'fast_ms': cpu_ms(lambda: FastJSONRenderer().render(page), repeat),
+        }
+        results = {'backend': 'orjson' if fastjson.orjson else 'stdlib', 'broadcasts': broadcasts, 'rest': rest}
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"Fast JSON backend: {results['backend']}")
+        self.stdout.write(f"{'room':>6} {'per-recipient ms':>17} {'shared ms':>10} {'saved ms':>9}")
+        for row in broadcasts:
+            self.stdout.write(
+                f"{row['room_size']:>6} {row['per_recipient_ms']:>17.3f} "
+                f"{row['shared_ms']:>10.4f} {row['saved_ms']:>9.3f}"
+            )
+        self.stdout.write(
+            f"REST page of {rest['rows']} rows: DRF {rest['drf_ms']:.3f} ms, fast {rest['fast_ms']:.3f} ms"
+        )
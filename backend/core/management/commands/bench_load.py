@@ -0,0 +1,322 @@
+import asyncio
+import json
+import platform
+import random
+import statistics
+import subprocess
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.testing import WebsocketCommunicator
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+from taggit.models import Tag, TaggedItem
+
+from core import fastjson
+from core.availability import forget_max_trip_duration
+from core.management.benchmarks import percentile
+from core.models import Message, Notification, Trip, TripMember, User
+from core.notifications import chat_notifications
+from core.ratelimit import chat_rate_limiter
+from core.writebehind import CHAT_WRITE_BEHIND, message_buffer
+
+
+def summarize(latencies, elapsed, queries=None):
+    return {
+        'count': len(latencies),
+        'per_second': len(latencies) / elapsed if elapsed else None,
+        'p50_ms': percentile(latencies, 0.5) * 1000 if latencies else None,
+        'p99_ms': percentile(latencies, 0.99) * 1000 if latencies else None,
+        'queries_per_request': statistics.mean(queries) if queries else None,
+        'queries_max': max(queries) if queries else None,
+    }
+
+
+class QueryCounter:
+    """Execute wrapper counting queries; readable from async code, unlike CaptureQueriesContext."""
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "Seed realistic volumes of users, trips, members, tags, messages and notifications, "
+        "then drive the trip and notification endpoints through the test client and the "
+        "trip chat through WebsocketCommunicator. Prints throughput, p50/p99 latency and "
+        "query counts as JSON, so runs can be diffed between commits. Everything runs in "
+        "a throwaway test database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=2000)
+        parser.add_argument('--trips', type=int, default=5000)
+        parser.add_argument('--members-per-trip', type=int, default=8)
+        parser.add_argument('--messages-per-trip', type=int, default=50)
+        parser.add_argument('--notifications-per-user', type=int, default=30)
+        parser.add_argument('--tags', type=int, default=40, help='Tag vocabulary size.')
+        parser.add_argument('--requests', type=int, default=200, help='Requests per REST scenario.')
+        parser.add_argument('--rooms', type=int, default=4, help='Chat rooms driven at once.')
+        parser.add_argument('--clients-per-room', type=int, default=5)
+        parser.add_argument('--chat-messages', type=int, default=20, help='Messages sent by each chat client.')
+        parser.add_argument('--timeout', type=float, default=60, help='Seconds to wait for chat deliveries.')
+        parser.add_argument('--rate-limits', action='store_true', help='Keep chat rate limits on.')
+        parser.add_argument('--host', default='localhost', help='Host header for REST requests.')
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--output', help='Write the JSON report here instead of stdout.')
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.queries = QueryCounter()
+        if not options['rate_limits']:
+            chat_rate_limiter.limits = {}
+
+        report = {
+            'revision': git_revision(),
+            'started': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'json_backend': 'orjson' if fastjson.orjson else 'stdlib',
+            'chat_write_behind': CHAT_WRITE_BEHIND,
+            'options': {key: options[key] for key in (
+                'users', 'trips', 'members_per_trip', 'messages_per_trip', 'notifications_per_user', 'tags',
+                'requests', 'rooms', 'clients_per_room', 'chat_messages', 'rate_limits', 'seed',
+            )},
+        }
+        # Consumers close "old" connections around every database hop, which
+        # rules out a rolled-back transaction; use a throwaway test database
+        old_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            started = time.perf_counter()
+            seeded = self.seed(options)
+            report['seed_seconds'] = time.perf_counter() - started
+            report['rest'] = self.run_rest(seeded, options)
+            # async_to_sync keeps the consumers' database hops on this thread and connection
+            with connection.execute_wrapper(self.queries):
+                report['websocket'] = async_to_sync(self.run_websocket)(seeded, options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            forget_max_trip_duration()
+            cache.clear()
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as handle:
+                handle.write(output + '\n')
+            self.stdout.write(self.style.SUCCESS(f"Wrote {options['output']}"))
+        else:
+            self.stdout.write(output)
+
+    # Seeding
+
+    def seed(self, options):
+        rng = self.rng
+        prefix = f'load-{time.monotonic_ns()}'
+        users = User.objects.bulk_create(
+            [User(username=f'{prefix}-{index}', password='!') for index in range(options['users'])],
+            batch_size=2000,
+        )
+        tags = Tag.objects.bulk_create(
+            [Tag(name=f'{prefix}-tag-{index}', slug=f'{prefix}-tag-{index}') for index in range(options['tags'])],
+        )
+
+        today = date.today()
+        trips = []
+        for index in range(options['trips']):
+            start = today + timedelta(days=rng.randrange(-180, 180))
+            trips.append(Trip(
+                title=f'Trip {index}', destination=rng.choice(['Sylhet', 'Bandarban', "Cox's Bazar", 'Sajek']),
+                description='Synthetic load trip. ' * 10, creator=rng.choice(users),
+                start_date=start, end_date=start + timedelta(days=rng.randrange(1, 10)),
+                budget=Decimal(rng.randrange(1000, 30000)),
+            ))
+        trips = Trip.objects.bulk_create(trips, batch_size=2000)
+        forget_max_trip_duration()
+
+        items = []
+        for model, objects in ((Trip, trips), (User, users)):
+            content_type = ContentType.objects.get_for_model(model)
+            for obj in objects:
+                for tag in rng.sample(tags, min(3, len(tags))):
+                    items.append(TaggedItem(content_type=content_type, object_id=obj.pk, tag=tag))
+        TaggedItem.objects.bulk_create(items, batch_size=5000)
+
+        members = {}
+        memberships = []
+        for trip in trips:
+            others = rng.sample(users, min(options['members_per_trip'], len(users)))
+            approved = [trip.creator] + [user for user in others if user != trip.creator]
+            members[trip.pk] = approved
+            memberships.append(TripMember(user=trip.creator, trip=trip, role='admin', status='approved'))
+            memberships.extend(
+                TripMember(user=user, trip=trip, role='member', status=rng.choice(['approved', 'approved', 'pending']))
+                for user in approved[1:]
+            )
+        TripMember.objects.bulk_create(memberships, batch_size=5000)
+
+        messages = []
+        for trip in trips:
+            for index in range(options['messages_per_trip']):
+                messages.append(Message(trip=trip, sender=rng.choice(members[trip.pk]), content=f'Message {index}'))
+            if len(messages) >= 10000:
+                Message.objects.bulk_create(messages)
+                messages = []
+        Message.objects.bulk_create(messages)
+
+        notifications = [
+            Notification(user=user, content=f'Notification {index}', is_read=rng.random() < 0.7)
+            for user in users for index in range(options['notifications_per_user'])
+        ]
+        Notification.objects.bulk_create(notifications, batch_size=5000)
+        if connection.vendor in ('sqlite', 'postgresql'):
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+        return {'users': users, 'trips': trips, 'members': members}
+
+    # REST
+
+    def run_rest(self, seeded, options):
+        rng = self.rng
+        users, trips = seeded['users'], seeded['trips']
+        client = APIClient(SERVER_NAME=options['host'])
+        today = date.today()
+        window = {'available_from': today.isoformat(), 'available_to': (today + timedelta(days=14)).isoformat()}
+        scenarios = [
+            ('trips.list', lambda: '/api/trips/', None),
+            ('trips.list.window', lambda: '/api/trips/', lambda: window),
+            ('trips.list.budget_by_date', lambda: '/api/trips/',
+             lambda: {'min_budget': 5000, 'max_budget': 10000, 'ordering': 'start_date'}),
+            ('trips.retrieve', lambda: f'/api/trips/{rng.choice(trips).pk}/', None),
+            ('trips.messages', lambda: f'/api/trips/{rng.choice(trips).pk}/messages/', None),
+            ('notifications.list', lambda: '/api/notifications/', None),
+            ('notifications.unread_count', lambda: '/api/notifications/unread_count/', None),
+        ]
+        results = {}
+        for name, url, params in scenarios:
+            cache.clear()
+            latencies, queries, statuses, hits = [], [], {}, 0
+            started = time.perf_counter()
+            for _ in range(options['requests']):
+                user = rng.choice(users)
+                if name == 'trips.messages':
+                    # Only members may read a trip's messages
+                    trip = rng.choice(trips)
+                    user = trip.creator
+                    path = f'/api/trips/{trip.pk}/messages/'
+                else:
+                    path = url()
+                client.force_authenticate(user)
+                with CaptureQueriesContext(connection) as captured:
+                    request_started = time.perf_counter()
+                    response = client.get(path, params() if params else None)
+                    latencies.append(time.perf_counter() - request_started)
+                queries.append(len(captured))
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+                hits += response.get('X-Cache') == 'HIT'
+            results[name] = {
+                **summarize(latencies, time.perf_counter() - started, queries),
+                'statuses': statuses,
+                'cache_hits': hits,
+            }
+        return results
+
+    # WebSocket
+
+    async def run_websocket(self, seeded, options):
+        from jaben_naki_backend.routing import application
+
+        rooms = []
+        for trip in self.rng.sample(seeded['trips'], min(options['rooms'], len(seeded['trips']))):
+            members = seeded['members'][trip.pk]
+            approved = await self.approved_members(trip.pk, members)
+            rooms.append((trip.pk, approved[:options['clients_per_room']]))
+
+        connect_latencies = []
+        clients = []
+        connect_queries = self.queries.count
+        for trip_id, users in rooms:
+            for user in users:
+                communicator = WebsocketCommunicator(
+                    application, f'/ws/trips/{trip_id}/?token={AccessToken.for_user(user)}',
+                )
+                started = time.perf_counter()
+                connected, _ = await communicator.connect()
+                connect_latencies.append(time.perf_counter() - started)
+                if connected:
+                    clients.append((trip_id, user, communicator))
+        connect_queries = self.queries.count - connect_queries
+
+        sent_at = {}
+        delivery_latencies = []
+        room_sizes = {trip_id: sum(1 for room, _, _ in clients if room == trip_id) for trip_id, _ in rooms}
+
+        async def receive(trip_id, communicator):
+            expected = room_sizes[trip_id] * options['chat_messages']
+            for _ in range(expected):
+                frame = await communicator.receive_json_from(timeout=options['timeout'])
+                if 'message' in frame:
+                    delivery_latencies.append(time.perf_counter() - sent_at[frame['message']])
+
+        async def send(user, communicator):
+            for index in range(options['chat_messages']):
+                text = f'{user.pk}:{index}'
+                sent_at[text] = time.perf_counter()
+                await communicator.send_json_to({'message': text})
+                await asyncio.sleep(0)
+
+        receivers = [asyncio.ensure_future(receive(trip_id, c)) for trip_id, _, c in clients]
+        send_queries = self.queries.count
+        started = time.perf_counter()
+        await asyncio.gather(*(send(user, c) for _, user, c in clients))
+        _, pending = await asyncio.wait(receivers, timeout=options['timeout'])
+        elapsed = time.perf_counter() - started
+        for task in pending:
+            task.cancel()
+        # Deferred work is part of the cost of the messages
+        await chat_notifications.flush()
+        if CHAT_WRITE_BEHIND:
+            await message_buffer.flush()
+        send_queries = self.queries.count - send_queries
+        for _, _, communicator in clients:
+            await communicator.disconnect()
+
+        sent = len(clients) * options['chat_messages']
+        return {
+            'rooms': len(rooms),
+            'clients': len(clients),
+            'connect': summarize(connect_latencies, sum(connect_latencies), None),
+            'connect_queries_per_client': connect_queries / len(clients) if clients else None,
+            'messages_sent': sent,
+            'messages_per_second': sent / elapsed if elapsed else None,
+            'deliveries': summarize(delivery_latencies, elapsed),
+            'deliveries_expected': sum(size * size * options['chat_messages'] for size in room_sizes.values()),
+            'queries_per_message': send_queries / sent if sent else None,
+        }
+
+    async def approved_members(self, trip_id, users):
+        approved = set(await database_sync_to_async(lambda: list(
+            TripMember.objects.filter(trip_id=trip_id, status='approved').values_list('user_id', flat=True)
+        ))())
+        return [user for user in users if user.pk in approved]
@@ -0,0 +1,93 @@
+import asyncio
+import json
+import tempfile
+import time
+from datetime import date
+
+from channels.db import database_sync_to_async
+from django.core.management.base import BaseCommand
+
+from core.models import Message, Trip, User
+from core.writebehind import MessageWriteBuffer
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare chat message persistence throughput: one INSERT per frame (immediate) "
+        "vs. the spooled write-behind buffer. The benchmark trip and its messages are "
+        "deleted afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--messages', type=int, default=2000, help='Frames per mode.')
+        parser.add_argument('--batch-size', type=int, default=100)
+        parser.add_argument('--fsync', action='store_true', help='fsync the spool after every frame.')
+        parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+
+    def handle(self, *args, **options):
+        user = User.objects.create(username=f'bench-messages-{time.monotonic_ns()}')
+        today = date.today()
+        trip = Trip.objects.create(
+            title='Message benchmark', destination='Dhaka', description='',
+            start_date=today, end_date=today, creator=user,
+        )
+        try:
+            results = [
+                asyncio.run(self.immediate(trip.id, user.id, options['messages'])),
+                asyncio.run(self.buffered(trip.id, user.id, options)),
+            ]
+        finally:
+            trip.delete()
+            user.delete()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'mode':>10} {'messages':>9} {'msg/s':>10} {'frame ms':>9} {'batches':>8}")
+        for row in results:
+            self.stdout.write(
+                f"{row['mode']:>10} {row['messages']:>9} {row['messages_per_second']:>10.0f} "
+                f"{row['frame_ms']:>9.3f} {row['batches']:>8}"
+            )
+
+    async def immediate(self, trip_id, sender_id, messages):
+        create = database_sync_to_async(Message.objects.create)
+        started = time.perf_counter()
+        for index in range(messages):
+            await create(trip_id=trip_id, sender_id=sender_id, content=f'benchmark message {index}')
+        elapsed = time.perf_counter() - started
+        return {
+            'mode': 'immediate',
+            'messages': messages,
+            'seconds': elapsed,
+            'messages_per_second': messages / elapsed,
+            # The consumer waits for the INSERT before it broadcasts
+            'frame_ms': elapsed / messages * 1000,
+            'batches': messages,
+        }
+
+    async def buffered(self, trip_id, sender_id, options):
+        messages = options['messages']
+        with tempfile.TemporaryDirectory() as spool_dir:
+            buffer = MessageWriteBuffer(
+                spool_dir, batch_size=options['batch_size'], interval=0.05, fsync=options['fsync'],
+            )
+            started = time.perf_counter()
+            for index in range(messages):
+                buffer.add(trip_id, sender_id, f'benchmark message {index}')
+                # Give the size-triggered flushes a chance to run, as a live socket would
+                await asyncio.sleep(0)
+            framed = time.perf_counter() - started
+            await asyncio.gather(*buffer._flushes)
+            await buffer.flush()
+            elapsed = time.perf_counter() - started
+        return {
+            'mode': 'buffered',
+            'messages': messages,
+            'seconds': elapsed,
+            'messages_per_second': messages / elapsed,
+            # Time a frame spends in the consumer before it is broadcast
+            'frame_ms': framed / messages * 1000,
+            'batches': buffer.stats['batches'],
+            'write_seconds': buffer.stats['write_seconds'],
+        }
@@ -0,0 +1,105 @@
+import json
+import random
+import statistics
+import time
+from datetime import date
+
+from django.contrib.contenttypes.models import ContentType
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from taggit.models import Tag, TaggedItem
+
+from core.management.benchmarks import int_list
+from core.models import Trip, User
+from core.tags import filter_by_tags
+
+
+def chained_filter(queryset, names):
+    # The filter this engine replaced: one TaggedItem join per tag plus DISTINCT
+    for name in names:
+        queryset = queryset.filter(tags__name__in=[name])
+    return queryset.distinct()
+
+
+class Command(BaseCommand):
+    help = (
+        "Time multi-tag AND filtering (grouped HAVING COUNT query vs. one join per tag) "
+        "on synthetic trips. Seeded rows are rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trips', type=int_list, default=[1000, 10000])
+        parser.add_argument('--tag-counts', type=int_list, default=[1, 2, 3, 5, 8])
+        parser.add_argument('--vocabulary', type=int, default=30, help='Distinct tags to draw from.')
+        parser.add_argument('--tags-per-trip', type=int, default=8)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+
+    def handle(self, *args, **options):
+        results = []
+        for trip_count in options['trips']:
+            with transaction.atomic():
+                names = self.seed(trip_count, options)
+                for tag_count in options['tag_counts']:
+                    results.append(self.measure(trip_count, names[:tag_count], options['repeat']))
+                transaction.set_rollback(True)
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'trips':>8} {'tags':>5} {'matches':>8} {'grouped ms':>11} {'chained ms':>11}")
+        for row in results:
+            self.stdout.write(
+                f"{row['trips']:>8} {row['tags']:>5} {row['matches']:>8} "
+                f"{row['grouped_ms']:>11.2f} {row['chained_ms']:>11.2f}"
+            )
+
+    def seed(self, trip_count, options):
+        rng = random.Random(options['seed'])
+        creator = User.objects.create(username=f'bench-tags-{time.monotonic_ns()}')
+        names = [f'bench-tag-{index}' for index in range(options['vocabulary'])]
+        tags = Tag.objects.bulk_create([Tag(name=name, slug=name) for name in names])
+        today = date.today()
+        trips = Trip.objects.bulk_create(
+            [
+                Trip(title=f'Trip {index}', destination='Dhaka', description='', start_date=today,
+                     end_date=today, creator=creator)
+                for index in range(trip_count)
+            ],
+            batch_size=2000,
+        )
+        content_type = ContentType.objects.get_for_model(Trip)
+        per_trip = min(options['tags_per_trip'], len(tags))
+        # Earlier tags are more popular, so AND queries over them keep matching rows
+        weights = [1 / (rank + 1) for rank in range(len(tags))]
+        items = []
+        for trip in trips:
+            chosen = set()
+            while len(chosen) < per_trip:
+                chosen.add(rng.choices(range(len(tags)), weights)[0])
+            items.extend(
+                TaggedItem(content_type=content_type, object_id=trip.id, tag=tags[index]) for index in chosen
+            )
+        TaggedItem.objects.bulk_create(items, batch_size=5000)
+        return names
+
+    def time_query(self, build, repeat):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            ids = list(build().values_list('id', flat=True))
+            timings.append(time.perf_counter() - started)
+        return statistics.median(timings) * 1000, len(ids)
+
+    def measure(self, trip_count, names, repeat):
+        queryset = Trip.objects.all()
+        grouped_ms, matches = self.time_query(lambda: filter_by_tags(queryset, all_tags=names), repeat)
+        chained_ms, _ = self.time_query(lambda: chained_filter(queryset, names), repeat)
+        return {
+            'trips': trip_count,
+            'tags': len(names),
+            'matches': matches,
+            'grouped_ms': grouped_ms,
+            'chained_ms': chained_ms,
+        }
@@ -0,0 +1,107 @@
+import json
+import random
+import statistics
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from rest_framework.filters import OrderingFilter
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from core.availability import forget_max_trip_duration
+from core.filters import TripFilter
+from core.management.benchmarks import int_list
+from core.models import Trip, User
+from core.pagination import TripCursorPagination
+from core.views import TripViewSet
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate synthetic trips and time the filtered trip list (date window overlap, "
+        "budget range, sort by date) as the API runs it: TripFilter, OrderingFilter and "
+        "the first TripCursorPagination page. "
+        "Seeded rows are rolled back afterwards."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--trips', type=int_list, default=[100000, 1000000])
+        parser.add_argument('--days', type=int, default=730, help='Spread of start dates around today.')
+        parser.add_argument('--max-duration', type=int, default=14, help='Longest trip, in days.')
+        parser.add_argument('--page-size', type=int, default=20)
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--json', action='store_true', help='Print results as JSON.')
+
+    def scenarios(self):
+        today = date.today()
+        window = (today + timedelta(days=30)).isoformat(), (today + timedelta(days=37)).isoformat()
+        return [
+            ('window', {'available_from': window[0], 'available_to': window[1]}),
+            ('window by date', {'available_from': window[0], 'available_to': window[1], 'ordering': 'start_date'}),
+            ('budget', {'min_budget': '5000', 'max_budget': '6000'}),
+            ('budget + window', {'min_budget': '5000', 'max_budget': '6000', 'available_from': window[0]}),
+            ('upcoming by date', {'start_date': today.isoformat(), 'ordering': 'start_date'}),
+        ]
+
+    def handle(self, *args, **options):
+        results = []
+        for trip_count in options['trips']:
+            with transaction.atomic():
+                self.seed(trip_count, options)
+                for name, params in self.scenarios():
+                    results.append(self.measure(trip_count, name, params, options))
+                transaction.set_rollback(True)
+            forget_max_trip_duration()
+
+        if options['json']:
+            self.stdout.write(json.dumps(results, indent=2))
+            return
+        self.stdout.write(f"{'trips':>9} {'query':<18} {'matches':>8} {'p50 ms':>8} {'max ms':>8}")
+        for row in results:
+            self.stdout.write(
+                f"{row['trips']:>9} {row['query']:<18} {row['matches']:>8} {row['p50_ms']:>8.2f} {row['max_ms']:>8.2f}"
+            )
+
+    def seed(self, trip_count, options):
+        rng = random.Random(options['seed'])
+        creator = User.objects.create(username=f'bench-trips-{time.monotonic_ns()}')
+        first = date.today() - timedelta(days=options['days'] // 2)
+        batch = []
+        for index in range(trip_count):
+            start = first + timedelta(days=rng.randrange(options['days']))
+            batch.append(Trip(
+                title=f'Trip {index}', destination='Dhaka', description='', creator=creator,
+                start_date=start, end_date=start + timedelta(days=rng.randrange(options['max_duration'] + 1)),
+                budget=Decimal(rng.randrange(500, 50000)),
+            ))
+            if len(batch) == 5000:
+                Trip.objects.bulk_create(batch)
+                batch = []
+        Trip.objects.bulk_create(batch)
+        # bulk_create sends no post_save
+        forget_max_trip_duration()
+        if connection.vendor in ('sqlite', 'postgresql'):
+            with connection.cursor() as cursor:
+                cursor.execute('ANALYZE')
+
+    def measure(self, trip_count, name, params, options):
+        request = Request(APIRequestFactory().get('/api/trips/', {**params, 'page_size': options['page_size']}))
+        view = TripViewSet()
+        timings = []
+        for _ in range(options['repeat']):
+            started = time.perf_counter()
+            queryset = TripFilter(request.query_params, Trip.objects.defer('description')).qs
+            queryset = OrderingFilter().filter_queryset(request, queryset, view)
+            page = TripCursorPagination().paginate_queryset(queryset, request, view)
+            timings.append(time.perf_counter() - started)
+        return {
+            'trips': trip_count,
+            'query': name,
+            'matches': len(page),
+            'p50_ms': statistics.median(timings) * 1000,
+            'max_ms': max(timings) * 1000,
+        }
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from core.writebehind import message_buffer
+
+
+class Command(BaseCommand):
+    help = (
+        "Write chat messages left in the write-behind spool by stopped or crashed "
+        "processes to the database. Servers do this on their first flush; run it "
+        "after a crash when chat write-behind is switched off."
+    )
+
+    def handle(self, *args, **options):
+        recovered = message_buffer.recover()
+        self.stdout.write(self.style.SUCCESS(
+            f'Replayed {recovered} spooled messages from {message_buffer.spool_dir}.'
+        ))
@@ -0,0 +1,54 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from core.retention import (
+    NotificationArchive, fold_chat_notifications, prune_beyond, prune_read, reset_unread_counts,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Enforce notification retention: drop old read notifications, keep the newest N per user "
+        "and fold repeated chat notifications into counted summaries. Dropped rows are archived "
+        "to gzip-compressed JSON Lines. Meant to run periodically, e.g. from cron."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--read-days', type=int, default=getattr(settings, 'NOTIFICATION_READ_RETENTION_DAYS', 30),
+            help='Drop read notifications older than this many days.',
+        )
+        parser.add_argument(
+            '--keep', type=int, default=getattr(settings, 'NOTIFICATION_KEEP_PER_USER', 500),
+            help='Notifications kept per user, newest first.',
+        )
+        parser.add_argument('--batch-size', type=int, default=1000, help='Rows per transaction.')
+        parser.add_argument(
+            '--archive-dir', default=getattr(settings, 'NOTIFICATION_ARCHIVE_DIR', settings.BASE_DIR / 'archives'),
+            help='Directory for the .jsonl.gz archives.',
+        )
+        parser.add_argument('--no-archive', action='store_true', help='Delete without archiving.')
+        parser.add_argument('--no-fold', action='store_true', help='Leave chat notifications unfolded.')
+
+    def handle(self, *args, **options):
+        if options['keep'] < 1 or options['batch_size'] < 1:
+            raise CommandError('--keep and --batch-size must be at least 1.')
+
+        archive = None
+        if not options['no_archive']:
+            name = f"notifications-{timezone.now():%Y%m%d-%H%M%S}.jsonl.gz"
+            archive = NotificationArchive(Path(options['archive_dir']) / name)
+
+        batch_size = options['batch_size']
+        touched = prune_read(options['read_days'], archive, batch_size)
+        touched |= prune_beyond(options['keep'], archive, batch_size)
+        if not options['no_fold']:
+            touched |= fold_chat_notifications(batch_size)
+        reset_unread_counts(touched)
+
+        if archive is not None and archive.rows:
+            self.stdout.write(f'Archived {archive.rows} notifications to {archive.path}')
+        self.stdout.write(self.style.SUCCESS(f'Pruned notifications of {len(touched)} users.'))
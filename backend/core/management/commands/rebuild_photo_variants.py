@@ -0,0 +1,33 @@
+from concurrent.futures import as_completed
+
+from django.core.management.base import BaseCommand
+
+from core.images import image_pool, process_profile_photo
+from core.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        "Generate the resized WebP/JPEG variants of profile photos on the image pool: "
+        "by default only for users that have a photo but no variants yet."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--all', action='store_true', help='Regenerate variants for every photo.')
+
+    def handle(self, *args, **options):
+        users = User.objects.exclude(profile_photo='').exclude(profile_photo__isnull=True)
+        if not options['all']:
+            users = users.filter(profile_photo_variants={})
+        futures = {
+            image_pool.submit(process_profile_photo, user_id, name): user_id
+            for user_id, name in users.values_list('id', 'profile_photo').iterator()
+        }
+        failed = 0
+        for future in as_completed(futures):
+            try:
+                future.result()
+            except Exception as exc:
+                failed += 1
+                self.stderr.write(f'User {futures[future]}: {exc}')
+        self.stdout.write(self.style.SUCCESS(f'Processed {len(futures) - failed} profile photos, {failed} failed.'))
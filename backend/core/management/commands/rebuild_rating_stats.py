@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Max
+
+from core.models import Trip
+from core.ratings import rebuild_rating_stats
+
+
+class Command(BaseCommand):
+    help = "Recompute every trip's rating_avg/rating_count from its reviews."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size', type=int, default=5000,
+            help='Trips updated per transaction, so no single UPDATE holds its lock for long.',
+        )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        last_id = Trip.objects.aggregate(last=Max('id'))['last'] or 0
+        updated = 0
+        for start in range(0, last_id, batch_size):
+            with transaction.atomic():
+                updated += rebuild_rating_stats(Trip.objects.filter(id__gt=start, id__lte=start + batch_size))
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt rating stats for {updated} trips.'))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.search import get_search_backend
+
+
+class Command(BaseCommand):
+    help = "Rebuild the trip search index from the trips table."
+
+    def handle(self, *args, **options):
+        backend = get_search_backend()
+        with transaction.atomic():
+            backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt trip search index ({type(backend).__name__}).'))
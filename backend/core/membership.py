@@ -0,0 +1,73 @@
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS, transaction
+
+from .models import TripMember
+
+# {user_id: (role, status)} per trip, in the shared cache so that a removed
+# member or demoted admin loses access on every worker at once. Evicted from
+# TripMember signals (core/signals.py); the timeout only bounds entries that
+# a write bypassing signals left behind.
+MEMBERSHIP_CACHE_TTL = getattr(settings, 'MEMBERSHIP_CACHE_TTL', 60)
+
+
+def membership_key(trip_id):
+    return f'trips:members:{int(trip_id)}'
+
+
+def forget_trip_members(trip_id):
+    key = membership_key(trip_id)
+    cache.delete(key)
+    # Again once committed, in case a concurrent read cached the old rows meanwhile
+    transaction.on_commit(lambda: cache.delete(key))
+
+
+def load_trip_members(trip_id):
+    # Always the primary: this map authorizes every process's requests and
+    # sockets until it is evicted, so it must not be filled from a lagging replica
+    rows = (
+        TripMember.objects.using(DEFAULT_DB_ALIAS).filter(trip_id=trip_id)
+        .values_list('user_id', 'role', 'status')
+    )
+    members = {user_id: (role, status) for user_id, role, status in rows}
+    cache.set(membership_key(trip_id), members, MEMBERSHIP_CACHE_TTL)
+    return members
+
+
+def get_trip_members(trip_id):
+    members = cache.get(membership_key(trip_id))
+    if members is None:
+        members = load_trip_members(int(trip_id))
+    return members
+
+
+def get_membership(trip_id, user_id):
+    """(role, status) of the user in the trip, or ``None`` for non-members."""
+    return get_trip_members(trip_id).get(user_id)
+
+
+def is_approved_member(trip_id, user_id):
+    membership = get_membership(trip_id, user_id)
+    return membership is not None and membership[1] == 'approved'
+
+
+def is_trip_admin(trip_id, user_id):
+    membership = get_membership(trip_id, user_id)
+    return membership is not None and membership[0] == 'admin'
+
+
+def get_admin_ids(trip_id):
+    return [
+        user_id for user_id, (role, status) in get_trip_members(trip_id).items()
+        if role == 'admin' and status == 'approved'
+    ]
+
+
+async def ais_approved_member(trip_id, user_id):
+    # Cache hits skip the DB thread pool, only misses hop to it
+    members = await cache.aget(membership_key(trip_id))
+    if members is None:
+        return await database_sync_to_async(is_approved_member)(trip_id, user_id)
+    membership = members.get(user_id)
+    return membership is not None and membership[1] == 'approved'
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:36
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_review_message_history_idx'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='notification',
+            index=models.Index(fields=['user', 'created_at'], name='core_notification_user_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='review',
+            index=models.Index(fields=['trip', 'id'], name='core_review_trip_id_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tripmember',
+            index=models.Index(fields=['trip', 'id'], name='core_tripmember_trip_id_idx'),
+        ),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:37
+
+from django.db import migrations, models
+from django.db.models import Avg, Count
+
+
+def backfill_rating_stats(apps, schema_editor):
+    Trip = apps.get_model('core', 'Trip')
+    Review = apps.get_model('core', 'Review')
+    stats = Review.objects.values('trip_id').annotate(avg=Avg('rating'), count=Count('id'))
+    for row in stats:
+        Trip.objects.filter(pk=row['trip_id']).update(rating_avg=row['avg'], rating_count=row['count'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_list_ordering_indexes'),
+        ('taggit', '0006_rename_taggeditem_content_type_object_id_taggit_tagg_content_8fc721_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='trip',
+            name='rating_avg',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='trip',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='trip',
+            index=models.Index(fields=['rating_avg', 'rating_count'], name='core_trip_rating_idx'),
+        ),
+        migrations.RunPython(backfill_rating_stats, migrations.RunPython.noop),
+    ]
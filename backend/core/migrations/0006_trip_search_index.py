@@ -0,0 +1,53 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:42
+
+from django.db import migrations
+
+# FTS5 index behind core.search.SQLiteFTSBackend; other databases use the
+# ORM fallback backend and get no table.
+CREATE_SQL = [
+    """
+    CREATE VIRTUAL TABLE core_trip_search USING fts5(
+        title, destination, description, tags,
+        tokenize = 'unicode61 remove_diacritics 2',
+        prefix = '2 3'
+    )
+    """,
+    "CREATE VIRTUAL TABLE core_trip_search_vocab USING fts5vocab(core_trip_search, row)",
+    """
+    INSERT INTO core_trip_search (rowid, title, destination, description, tags)
+    SELECT trip.id, trip.title, trip.destination, trip.description, (
+        SELECT group_concat(tag.name, ' ')
+        FROM taggit_taggeditem item
+        JOIN taggit_tag tag ON tag.id = item.tag_id
+        JOIN django_content_type ct ON ct.id = item.content_type_id
+        WHERE item.object_id = trip.id AND ct.app_label = 'core' AND ct.model = 'trip'
+    )
+    FROM core_trip trip
+    """,
+]
+
+DROP_SQL = [
+    "DROP TABLE IF EXISTS core_trip_search_vocab",
+    "DROP TABLE IF EXISTS core_trip_search",
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_trip_rating_stats'),
+        ('contenttypes', '0002_remove_content_type_name'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(CREATE_SQL), run(DROP_SQL)),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations
+
+# Distinct terms of the FTS5 index by length, for the typo lookup in
+# core.search.SQLiteFTSBackend: a range scan here reads no doclists, unlike
+# the fts5vocab table. SQLite only, like the index itself.
+CREATE_SQL = [
+    """
+    CREATE TABLE core_trip_search_term (
+        length INTEGER NOT NULL,
+        term TEXT NOT NULL,
+        PRIMARY KEY (length, term)
+    ) WITHOUT ROWID
+    """,
+    "INSERT INTO core_trip_search_term (length, term) SELECT length(term), term FROM core_trip_search_vocab",
+]
+
+DROP_SQL = [
+    "DROP TABLE IF EXISTS core_trip_search_term",
+]
+
+
+def run(statements):
+    def operation(apps, schema_editor):
+        if schema_editor.connection.vendor != 'sqlite':
+            return
+        for statement in statements:
+            schema_editor.execute(statement)
+    return operation
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_notification_trip'),
+    ]
+
+    operations = [
+        migrations.RunPython(run(CREATE_SQL), run(DROP_SQL)),
+    ]
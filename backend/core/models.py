@@ -1,11 +1,14 @@
 from django.contrib.auth.models import AbstractUser
 from django.db import models
+from django.utils import timezone
 from taggit.managers import TaggableManager
 from django.conf import settings
 
 class User(AbstractUser):
     bio = models.TextField(blank=True)
     profile_photo = models.ImageField(upload_to='profiles/', blank=True, null=True)
+    # {format: {size: storage name}}, filled in by core/images.py
+    profile_photo_variants = models.JSONField(default=dict, blank=True)
     interests = TaggableManager(blank=True)
 
     def __str__(self):
@@ -20,6 +23,18 @@ class Trip(models.Model):
     tags = TaggableManager(blank=True)
     creator = models.ForeignKey(User, on_delete=models.CASCADE, related_name='created_trips')
     created_at = models.DateTimeField(auto_now_add=True)
+    # Maintained from Review writes, see core/ratings.py
+    rating_avg = models.FloatField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['rating_avg', 'rating_count'], name='core_trip_rating_idx'),
+            # Date windows and sort-by-date (core/availability.py)
+            models.Index(fields=['start_date', 'end_date'], name='core_trip_dates_idx'),
+            models.Index(fields=['end_date', 'start_date'], name='core_trip_end_dates_idx'),
+            models.Index(fields=['budget', 'start_date'], name='core_trip_budget_idx'),
+        ]
 
     def __str__(self):
         return self.title
@@ -39,6 +54,9 @@ class TripMember(models.Model):
 
     class Meta:
         unique_together = ('user', 'trip')
+        indexes = [
+            models.Index(fields=['trip', 'id'], name='core_tripmember_trip_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.user.username} - {self.trip.title}"
@@ -48,17 +66,33 @@ class Message(models.Model):
     trip = models.ForeignKey(Trip, on_delete=models.CASCADE, related_name='messages')
     sender = models.ForeignKey(User, on_delete=models.CASCADE)
     content = models.TextField()
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # A default rather than auto_now_add, so buffered writes keep the time the message was sent
+    timestamp = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # Keyset pagination over a trip's history: (trip, timestamp, id)
+            models.Index(fields=['trip', 'timestamp', 'id'], name='core_message_history_idx'),
+        ]
 
     def __str__(self):
         return f"{self.sender.username}: {self.content[:20]}..."
 
 class Notification(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='notifications')
+    # Set on chat notifications, so trips that share a title are told apart
+    trip = models.ForeignKey(Trip, on_delete=models.CASCADE, null=True, blank=True, related_name='+')
     content = models.TextField()
     is_read = models.BooleanField(default=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'created_at'], name='core_notification_user_idx'),
+            # Unread listing and counts
+            models.Index(fields=['user', 'is_read', 'created_at'], name='core_notification_unread_idx'),
+        ]
+
     def __str__(self):
         return f"To {self.user.username}: {self.content[:30]}..."
 
@@ -71,6 +105,9 @@ class Review(models.Model):
 
     class Meta:
         unique_together = ('trip', 'reviewer')
+        indexes = [
+            models.Index(fields=['trip', 'id'], name='core_review_trip_id_idx'),
+        ]
 
     def __str__(self):
         return f"{self.reviewer.username} reviewed {self.trip.title} ({self.rating}/5)"
\ No newline at end of file
@@ -0,0 +1,197 @@
+import asyncio
+import logging
+import re
+from collections import Counter
+from datetime import timedelta
+
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import Notification, Trip, TripMember
+
+logger = logging.getLogger(__name__)
+
+# Unread "New message in X" notifications younger than this are not repeated
+CHAT_NOTIFICATION_WINDOW = getattr(settings, 'CHAT_NOTIFICATION_WINDOW', 60)
+# How long chat frames are collected before one fan-out pass runs
+CHAT_NOTIFICATION_DELAY = getattr(settings, 'CHAT_NOTIFICATION_DELAY', 0.5)
+# Unread counters are recounted this often. With a shared cache every worker
+# adjusts the same counter; with the in-process one a worker never sees the
+# others' changes, and this bounds how long its count can be off.
+UNREAD_COUNT_TTL = getattr(settings, 'UNREAD_COUNT_TTL', 60)
+
+
+def notification_group(user_id):
+    return f'notifications_{user_id}'
+
+
+def unread_count_key(user_id):
+    return f'notifications:unread:{user_id}'
+
+
+def get_unread_count(user_id):
+    count = cache.get(unread_count_key(user_id))
+    if count is None:
+        count = Notification.objects.filter(user_id=user_id, is_read=False).count()
+        cache.add(unread_count_key(user_id), count, UNREAD_COUNT_TTL)
+    return count
+
+
+def get_unread_counts(user_ids):
+    """{user_id: unread count} for ``user_ids``, recounting the missing counters in one query."""
+    keys = {unread_count_key(user_id): user_id for user_id in set(user_ids)}
+    counts = {keys[key]: count for key, count in cache.get_many(keys).items()}
+    missing = [user_id for user_id in keys.values() if user_id not in counts]
+    if missing:
+        recounted = dict.fromkeys(missing, 0)
+        recounted.update(
+            Notification.objects.filter(user_id__in=missing, is_read=False)
+            .values('user_id').annotate(count=Count('id')).values_list('user_id', 'count')
+        )
+        cache.set_many({unread_count_key(user_id): count for user_id, count in recounted.items()}, UNREAD_COUNT_TTL)
+        counts.update(recounted)
+    return counts
+
+
+def adjust_unread_count(user_id, delta):
+    # A missing counter is recounted on its next read
+    try:
+        cache.incr(unread_count_key(user_id), delta)
+    except ValueError:
+        pass
+
+
+def reset_unread_count(user_id):
+    cache.delete(unread_count_key(user_id))
+
+
+def push_notifications(notifications):
+    """
+    Count new notifications as unread and push them to their users'
+    notification sockets once the transaction that created them commits.
+    """
+    from .serializers import NotificationSerializer
+
+    notifications = list(notifications)
+
+    def send():
+        for user_id, count in Counter(n.user_id for n in notifications if not n.is_read).items():
+            adjust_unread_count(user_id, count)
+        channel_layer = get_channel_layer()
+        if channel_layer is None:
+            return
+        group_send = async_to_sync(channel_layer.group_send)
+        unread_counts = get_unread_counts(n.user_id for n in notifications)
+        for notification in notifications:
+            group_send(notification_group(notification.user_id), {
+                'type': 'notification_created',
+                'notification': NotificationSerializer(notification).data,
+                'unread_count': unread_counts[notification.user_id],
+            })
+
+    transaction.on_commit(send)
+
+
+def push_unread_count(user_id):
+    def send():
+        channel_layer = get_channel_layer()
+        if channel_layer is not None:
+            async_to_sync(channel_layer.group_send)(notification_group(user_id), {
+                'type': 'unread_count_changed',
+                'unread_count': get_unread_count(user_id),
+            })
+
+    transaction.on_commit(send)
+
+
+CHAT_NOTIFICATION_RE = re.compile(r'^💬 (?:New message|(?P<count>\d+) new messages) in "(?P<title>.*)"$', re.S)
+
+
+def chat_notification_content(title, count=1):
+    if count == 1:
+        return f'💬 New message in "{title}"'
+    return f'💬 {count} new messages in "{title}"'
+
+
+def parse_chat_notification(content):
+    """(trip title, message count) of a chat notification, ``None`` for other notifications."""
+    match = CHAT_NOTIFICATION_RE.match(content)
+    if match is None:
+        return None
+    return match['title'], int(match['count'] or 1)
+
+
+def create_chat_notifications(pending):
+    """
+    Create the chat notifications for ``pending`` ({trip_id: {sender_id, ...}})
+    with a fixed number of queries, whatever the number of trips and members.
+    """
+    titles = dict(Trip.objects.filter(id__in=pending).values_list('id', 'title'))
+    members = TripMember.objects.filter(
+        trip_id__in=titles, status='approved'
+    ).values_list('trip_id', 'user_id')
+
+    wanted = set()
+    for trip_id, user_id in members:
+        # Senders are only notified when someone else wrote in the same batch
+        if pending[trip_id] - {user_id}:
+            wanted.add((user_id, trip_id))
+    if not wanted:
+        return []
+
+    cutoff = timezone.now() - timedelta(seconds=CHAT_NOTIFICATION_WINDOW)
+    recent = set(Notification.objects.filter(
+        user_id__in={user_id for user_id, _ in wanted},
+        trip_id__in=titles,
+        is_read=False,
+        created_at__gte=cutoff,
+    ).values_list('user_id', 'trip_id'))
+
+    # bulk_create sends no post_save, so push the batch here
+    created = Notification.objects.bulk_create([
+        Notification(user_id=user_id, trip_id=trip_id, content=chat_notification_content(titles[trip_id]))
+        for user_id, trip_id in sorted(wanted - recent)
+    ])
+    push_notifications(created)
+    return created
+
+
+class ChatNotificationBatcher:
+    """
+    Collects chat frames per trip and fans the notifications out in one
+    background pass, so members are notified after the broadcast instead of
+    before it.
+    """
+
+    def __init__(self, delay=CHAT_NOTIFICATION_DELAY):
+        self.delay = delay
+        self.pending = {}
+        self._task = None
+
+    def queue(self, trip_id, sender_id):
+        self.pending.setdefault(int(trip_id), set()).add(sender_id)
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.delay)
+        await self.flush()
+
+    async def flush(self):
+        pending, self.pending = self.pending, {}
+        if not pending:
+            return
+        try:
+            await database_sync_to_async(create_chat_notifications)(pending)
+        except Exception:
+            logger.exception('Chat notification fan-out failed for trips %s', sorted(pending))
+
+
+chat_notifications = ChatNotificationBatcher()
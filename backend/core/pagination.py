@@ -0,0 +1,163 @@
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.db.models import F, Q
+from rest_framework.exceptions import NotFound
+from rest_framework.filters import OrderingFilter
+from rest_framework.pagination import BasePagination, CursorPagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class DefaultCursorPagination(CursorPagination):
+    """
+    Newest-first cursor pagination on the primary key, which is unique and
+    always indexed, so pages stay stable while rows are inserted.
+    """
+    ordering = '-id'
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+
+
+class NotificationCursorPagination(DefaultCursorPagination):
+    ordering = '-created_at'
+
+
+class KeysetCursorPagination(BasePagination):
+    """
+    Keyset pagination: the cursor holds the ordering values of the last row
+    on the page and the next page continues strictly after them, so every
+    page is a range scan on the ordering's index however deep it goes. The
+    ordering must end with a unique field; NULLs sort last either way.
+    """
+    ordering = ('-id',)
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    invalid_cursor_message = 'Invalid cursor'
+
+    def get_ordering(self, request, queryset, view):
+        return self.ordering
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.page_size = self.get_page_size(request)
+        self.fields = [
+            (queryset.model._meta.get_field(name.lstrip('-')), name.startswith('-'))
+            for name in self.get_ordering(request, queryset, view)
+        ]
+        cursor = self.decode_cursor(request)
+        if cursor:
+            queryset = queryset.filter(self.after(cursor))
+
+        page = list(queryset.order_by(*self.order_by())[:self.page_size + 1])
+        self.has_next = len(page) > self.page_size
+        page = page[:self.page_size]
+        self.last = page[-1] if page else None
+        return page
+
+    def order_by(self):
+        for field, descending in self.fields:
+            if not field.null:
+                yield f'-{field.attname}' if descending else field.attname
+            elif descending:
+                yield F(field.attname).desc(nulls_last=True)
+            else:
+                yield F(field.attname).asc(nulls_last=True)
+
+    def after(self, cursor):
+        """Rows ordered strictly after ``cursor``, the values of the last row shown."""
+        condition = Q(pk__in=[])
+        ties = Q()
+        for (field, descending), value in zip(self.fields, cursor):
+            name = field.attname
+            if value is not None:
+                beyond = Q(**{f'{name}__{"lt" if descending else "gt"}': value})
+                if field.null:
+                    beyond |= Q(**{f'{name}__isnull': True})
+                condition |= ties & beyond
+                ties &= Q(**{name: value})
+            else:
+                # Nothing sorts after NULL but the rows tied on it
+                ties &= Q(**{f'{name}__isnull': True})
+        return condition
+
+    def get_page_size(self, request):
+        try:
+            size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(size, self.max_page_size))
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(encoded.encode()))
+            if not isinstance(values, list) or len(values) != len(self.fields):
+                raise ValueError(encoded)
+            return [
+                None if value is None else field.to_python(value)
+                for (field, _), value in zip(self.fields, values)
+            ]
+        except (TypeError, ValueError, ValidationError):
+            raise NotFound(self.invalid_cursor_message)
+
+    def encode_cursor(self, instance):
+        # value_to_string keeps microseconds, which DjangoJSONEncoder would round away
+        values = [
+            None if getattr(instance, field.attname) is None else field.value_to_string(instance)
+            for field, _ in self.fields
+        ]
+        return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, self.encode_cursor(self.last))
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+
+class MessageCursorPagination(KeysetCursorPagination):
+    """
+    A trip's messages, newest first. Pages are range scans on the
+    (trip, timestamp, id) index.
+    """
+    ordering = ('-timestamp', '-id')
+    page_size = 50
+    max_page_size = 200
+
+
+class TripCursorPagination(KeysetCursorPagination):
+    """
+    Trips in the order picked with ``?ordering=`` (newest first without one).
+    The id breaks ties in the same direction, so trips sharing a rating or a
+    date are neither repeated nor skipped between pages and a deep page is
+    still a range scan on the (field, id) index rather than an OFFSET.
+    """
+
+    def get_ordering(self, request, queryset, view):
+        ordering = OrderingFilter().get_ordering(request, queryset, view)
+        if not ordering:
+            return self.ordering
+        return (*ordering, '-id' if ordering[-1].startswith('-') else 'id')
@@ -0,0 +1,141 @@
+import asyncio
+import logging
+import threading
+import time
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from . import fastjson
+
+logger = logging.getLogger(__name__)
+
+# A connection that has sent nothing (not even a heartbeat) for this long is offline
+CHAT_PRESENCE_TTL = getattr(settings, 'CHAT_PRESENCE_TTL', 60)
+# Typing frames are collected per room and broadcast at most once per interval
+CHAT_TYPING_INTERVAL = getattr(settings, 'CHAT_TYPING_INTERVAL', 1.0)
+
+
+class PresenceIndex:
+    """
+    In-process index of who is connected to which trip chat:
+    {trip_id: {user_id: {channel_name: last seen}}}. A user is online while
+    any of their sockets has been heard from within ``ttl`` seconds, so a
+    second tab keeps them online when the first closes. Nothing here reads
+    the database. The index covers the sockets served by this process.
+    """
+
+    def __init__(self, ttl=CHAT_PRESENCE_TTL):
+        self.ttl = ttl
+        self.rooms = {}
+        self.usernames = {}
+        self._lock = threading.Lock()
+
+    def join(self, trip_id, user_id, username, channel_name):
+        """Register a socket; True when it brings the user online."""
+        with self._lock:
+            users = self.rooms.setdefault(int(trip_id), {})
+            came_online = user_id not in users
+            users.setdefault(user_id, {})[channel_name] = time.monotonic()
+            self.usernames[user_id] = username
+            return came_online
+
+    def touch(self, trip_id, user_id, username, channel_name):
+        """
+        Record a heartbeat from a connected socket. A socket ``expire`` dropped
+        while its user was only reading is registered again; True when that
+        brings the user back online.
+        """
+        return self.join(trip_id, user_id, username, channel_name)
+
+    def leave(self, trip_id, user_id, channel_name):
+        """Drop a socket; True when it was the user's last one in the room."""
+        with self._lock:
+            users = self.rooms.get(int(trip_id))
+            if not users or user_id not in users:
+                return False
+            users[user_id].pop(channel_name, None)
+            if users[user_id]:
+                return False
+            del users[user_id]
+            if not users:
+                del self.rooms[int(trip_id)]
+            return True
+
+    def expire(self, trip_id):
+        """Drop sockets silent for longer than ``ttl``; returns the users that went offline."""
+        cutoff = time.monotonic() - self.ttl
+        gone = []
+        with self._lock:
+            users = self.rooms.get(int(trip_id), {})
+            for user_id, channels in list(users.items()):
+                for channel_name, seen in list(channels.items()):
+                    if seen < cutoff:
+                        del channels[channel_name]
+                if not channels:
+                    del users[user_id]
+                    gone.append(self.usernames.get(user_id))
+        return gone
+
+    def online(self, trip_id):
+        """
+        [{'id', 'username'}] of the users online in the trip, by username.
+        Sockets silent for longer than ``ttl`` don't count even before
+        ``expire`` has dropped them.
+        """
+        cutoff = time.monotonic() - self.ttl
+        with self._lock:
+            users = [
+                user_id for user_id, channels in self.rooms.get(int(trip_id), {}).items()
+                if any(seen >= cutoff for seen in channels.values())
+            ]
+            return sorted(
+                ({'id': user_id, 'username': self.usernames.get(user_id)} for user_id in users),
+                key=lambda user: user['username'] or '',
+            )
+
+
+presence_index = PresenceIndex()
+
+
+def room_event(frame):
+    """A group event that hands the same pre-encoded frame to every socket."""
+    return {'type': 'room_event', 'frame': fastjson.dumps_text(frame)}
+
+
+class TypingBatcher:
+    """
+    Coalesces typing frames: every user typing in a room during one
+    ``interval`` is announced in a single {"type": "typing", "users": [...]}
+    broadcast, so a busy room sends at most one typing frame per interval
+    however many members type or how often their clients report it.
+    """
+
+    def __init__(self, interval=CHAT_TYPING_INTERVAL):
+        self.interval = interval
+        self.pending = {}
+        self._task = None
+
+    def queue(self, group_name, username):
+        self.pending.setdefault(group_name, set()).add(username)
+        loop = asyncio.get_running_loop()
+        if self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.interval)
+        await self.flush()
+
+    async def flush(self):
+        pending, self.pending = self.pending, {}
+        channel_layer = get_channel_layer()
+        for group_name, usernames in pending.items():
+            try:
+                await channel_layer.group_send(
+                    group_name, room_event({'type': 'typing', 'users': sorted(usernames)}),
+                )
+            except Exception:
+                logger.exception('Typing broadcast to %s failed', group_name)
+
+
+typing_batcher = TypingBatcher()
@@ -0,0 +1,115 @@
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+
+from .cache import TTLCache
+
+# {scope: (frames per second, burst)}; a scope set to None is not limited.
+# Buckets live in the worker process, so "user" and "room" limits apply per worker.
+CHAT_RATE_LIMITS = {
+    'connection': (5, 10),
+    'user': (10, 20),
+    'room': (50, 100),
+    **getattr(settings, 'CHAT_RATE_LIMITS', {}),
+}
+# Frames larger than this close the socket (1009, message too big)
+CHAT_MAX_FRAME_BYTES = getattr(settings, 'CHAT_MAX_FRAME_BYTES', 16 * 1024)
+# Longer messages are rejected with an error frame
+CHAT_MAX_MESSAGE_LENGTH = getattr(settings, 'CHAT_MAX_MESSAGE_LENGTH', 4000)
+# Broadcasts that reach a socket later than this are dropped for it...
+CHAT_SLOW_CONSUMER_LAG = getattr(settings, 'CHAT_SLOW_CONSUMER_LAG', 5.0)
+# ...and "drop" disconnects it after this many in a row; "disconnect" closes it at once
+CHAT_SLOW_CONSUMER_POLICY = getattr(settings, 'CHAT_SLOW_CONSUMER_POLICY', 'drop')
+CHAT_SLOW_CONSUMER_MAX_DROPS = getattr(settings, 'CHAT_SLOW_CONSUMER_MAX_DROPS', 50)
+
+chat_metrics = Counter()
+
+
+class TokenBucket:
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self):
+        """Seconds until a token is available, 0 if one is."""
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+
+class ChatRateLimiter:
+    """
+    Token buckets for chat frames per connection, per user and per room. A
+    frame is let through only when every bucket it draws from has a token,
+    and then takes one from each.
+    """
+
+    def __init__(self, limits, maxsize=100000, idle=600):
+        self.limits = limits
+        # Idle user and room buckets are full again long before they expire
+        self.buckets = TTLCache(maxsize=maxsize, ttl=idle)
+        self._lock = threading.Lock()
+
+    def connection_bucket(self):
+        limit = self.limits.get('connection')
+        return TokenBucket(*limit) if limit else None
+
+    def bucket(self, scope, key):
+        limit = self.limits.get(scope)
+        if not limit:
+            return None
+        bucket = self.buckets.get((scope, key))
+        if bucket is None:
+            bucket = TokenBucket(*limit)
+        self.buckets.set((scope, key), bucket)
+        return bucket
+
+    def acquire(self, connection_bucket, user_id, room_id):
+        """
+        ``(None, 0)`` when the frame may go out, otherwise the scope that
+        refused it and the seconds until it would be accepted.
+        """
+        with self._lock:
+            buckets = [
+                ('connection', connection_bucket),
+                ('user', self.bucket('user', user_id)),
+                ('room', self.bucket('room', room_id)),
+            ]
+            buckets = [(scope, bucket) for scope, bucket in buckets if bucket is not None]
+            now = time.monotonic()
+            for _, bucket in buckets:
+                bucket.refill(now)
+            waits = [(bucket.wait_time(), scope) for scope, bucket in buckets]
+            if waits:
+                wait, scope = max(waits)
+                if wait:
+                    chat_metrics[f'frames_limited_{scope}'] += 1
+                    return scope, wait
+            for _, bucket in buckets:
+                bucket.tokens -= 1
+            return None, 0
+
+
+chat_rate_limiter = ChatRateLimiter(CHAT_RATE_LIMITS)
+
+
+def chat_limit_metrics():
+    """Configured chat limits and the counters of what they refused."""
+    return {
+        'limits': {
+            'rate': {scope: {'per_second': limit[0], 'burst': limit[1]} if limit else None
+                     for scope, limit in CHAT_RATE_LIMITS.items()},
+            'max_frame_bytes': CHAT_MAX_FRAME_BYTES,
+            'max_message_length': CHAT_MAX_MESSAGE_LENGTH,
+            'slow_consumer_lag': CHAT_SLOW_CONSUMER_LAG,
+            'slow_consumer_policy': CHAT_SLOW_CONSUMER_POLICY,
+            'slow_consumer_max_drops': CHAT_SLOW_CONSUMER_MAX_DROPS,
+        },
+        'counters': dict(chat_metrics),
+    }
@@ -0,0 +1,58 @@
+from django.db.models import Avg, Case, Count, F, FloatField, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import Trip, Review
+from .responsecache import invalidate, trip_tags
+
+
+def apply_rating_change(trip_id, delta_total, delta_count):
+    """
+    Fold a review change into the trip's rating_avg/rating_count with a single
+    UPDATE, so concurrent reviews never read-modify-write stale stats.
+    ``rating_avg`` is assigned first: every backend then computes it from the
+    old count.
+    """
+    count = F('rating_count') + delta_count
+    total = F('rating_avg') * F('rating_count') + delta_total
+    Trip.objects.filter(pk=trip_id).update(
+        rating_avg=Case(
+            When(rating_count=-delta_count, then=Value(0.0)),
+            default=total / count,
+            output_field=FloatField(),
+        ),
+        rating_count=count,
+    )
+    # update() sends no post_save
+    invalidate(*trip_tags(trip_id))
+
+
+def review_added(review):
+    apply_rating_change(review.trip_id, review.rating, 1)
+
+
+def review_removed(review):
+    apply_rating_change(review.trip_id, -review.rating, -1)
+
+
+def review_changed(old_trip_id, old_rating, review):
+    if old_trip_id != review.trip_id:
+        apply_rating_change(old_trip_id, -old_rating, -1)
+        review_added(review)
+    elif old_rating != review.rating:
+        apply_rating_change(review.trip_id, review.rating - old_rating, 0)
+
+
+def rebuild_rating_stats(trips=None):
+    """Recompute the stats of ``trips`` (default: all) from their reviews in one UPDATE."""
+    if trips is None:
+        trips = Trip.objects.all()
+    reviews = Review.objects.filter(trip=OuterRef('pk')).order_by().values('trip')
+    invalidate('trips', *(f'trip:{pk}' for pk in trips.values_list('pk', flat=True)))
+    return trips.update(
+        rating_avg=Coalesce(
+            Subquery(reviews.annotate(avg=Avg('rating')).values('avg')),
+            Value(0.0),
+            output_field=FloatField(),
+        ),
+        rating_count=Coalesce(Subquery(reviews.annotate(count=Count('id')).values('count')), Value(0)),
+    )
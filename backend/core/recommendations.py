@@ -0,0 +1,160 @@
+import heapq
+import math
+import threading
+import time
+from collections import defaultdict
+from datetime import date
+
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from taggit.models import TaggedItem
+
+from .cache import TTLCache
+from .models import Trip, TripMember
+
+
+class TripTagIndex:
+    """
+    In-process sparse trip x tag matrix of upcoming trips, kept as posting
+    lists (tag -> trips) so a user is scored against only the trips sharing
+    one of their interests. Trip and tag signals patch it in place; a full
+    reload every ``ttl`` seconds picks up writes made by other processes.
+    """
+
+    def __init__(self, ttl=600):
+        self.ttl = ttl
+        self.version = 0
+        self.loaded_at = None
+        self._lock = threading.RLock()
+        self.trip_tags = {}
+        self.start_dates = {}
+        self.postings = defaultdict(set)
+
+    def invalidate(self):
+        with self._lock:
+            self.loaded_at = None
+
+    def ensure_loaded(self):
+        with self._lock:
+            if self.loaded_at is None or time.monotonic() - self.loaded_at > self.ttl:
+                self.load()
+
+    def load(self):
+        upcoming = dict(Trip.objects.filter(start_date__gte=date.today()).values_list('id', 'start_date'))
+        items = TaggedItem.objects.filter(
+            content_type=ContentType.objects.get_for_model(Trip),
+            object_id__in=list(upcoming),
+        ).values_list('object_id', 'tag_id')
+        trip_tags = defaultdict(set)
+        postings = defaultdict(set)
+        for trip_id, tag_id in items:
+            trip_tags[trip_id].add(tag_id)
+            postings[tag_id].add(trip_id)
+        with self._lock:
+            self.start_dates = upcoming
+            self.trip_tags = {trip_id: trip_tags.get(trip_id, set()) for trip_id in upcoming}
+            self.postings = postings
+            self.loaded_at = time.monotonic()
+            self.version += 1
+
+    def update_trip(self, trip_id, start_date):
+        with self._lock:
+            if self.loaded_at is None:
+                return
+            if start_date < date.today():
+                self.remove_trip(trip_id)
+                return
+            self.start_dates[trip_id] = start_date
+            if trip_id not in self.trip_tags:
+                # New, or an edited trip that moved back into the future
+                tag_ids = set(TaggedItem.objects.filter(
+                    content_type=ContentType.objects.get_for_model(Trip), object_id=trip_id,
+                ).values_list('tag_id', flat=True))
+                self.trip_tags[trip_id] = tag_ids
+                for tag_id in tag_ids:
+                    self.postings[tag_id].add(trip_id)
+            self.version += 1
+
+    def add_tags(self, trip_id, tag_ids):
+        with self._lock:
+            if self.loaded_at is None or trip_id not in self.trip_tags:
+                return
+            self.trip_tags[trip_id].update(tag_ids)
+            for tag_id in tag_ids:
+                self.postings[tag_id].add(trip_id)
+            self.version += 1
+
+    def remove_tags(self, trip_id, tag_ids=None):
+        with self._lock:
+            if self.loaded_at is None or trip_id not in self.trip_tags:
+                return
+            tags = self.trip_tags[trip_id]
+            for tag_id in list(tags if tag_ids is None else tag_ids):
+                tags.discard(tag_id)
+                self.postings[tag_id].discard(trip_id)
+            self.version += 1
+
+    def remove_trip(self, trip_id):
+        with self._lock:
+            if self.loaded_at is None or trip_id not in self.trip_tags:
+                return
+            for tag_id in self.trip_tags.pop(trip_id):
+                self.postings[tag_id].discard(trip_id)
+            self.start_dates.pop(trip_id, None)
+            self.version += 1
+
+    def idf(self, tag_id):
+        return math.log((1 + len(self.trip_tags)) / (1 + len(self.postings.get(tag_id, ())))) + 1
+
+    def rank(self, interest_ids, exclude=(), limit=20):
+        """
+        (trip_id, score) for the best ``limit`` upcoming trips, scored by the
+        cosine similarity of binary tf-idf vectors over tags.
+        """
+        with self._lock:
+            interests = {tag_id for tag_id in interest_ids if self.postings.get(tag_id)}
+            if not interests:
+                return []
+            weights = {tag_id: self.idf(tag_id) ** 2 for tag_id in interests}
+            overlap = defaultdict(float)
+            for tag_id in interests:
+                for trip_id in self.postings[tag_id]:
+                    overlap[trip_id] += weights[tag_id]
+
+            today = date.today()
+            user_norm = math.sqrt(sum(weights.values()))
+            scored = []
+            for trip_id, dot in overlap.items():
+                if trip_id in exclude or self.start_dates[trip_id] < today:
+                    continue
+                trip_norm = math.sqrt(sum(self.idf(tag_id) ** 2 for tag_id in self.trip_tags[trip_id]))
+                scored.append((dot / (user_norm * trip_norm), trip_id))
+            # Best score first, sooner trips first among equals
+            best = heapq.nlargest(limit, scored, key=lambda item: (item[0], -self.start_dates[item[1]].toordinal()))
+            return [(trip_id, round(score, 4)) for score, trip_id in best]
+
+
+trip_tag_index = TripTagIndex(ttl=getattr(settings, 'RECOMMENDATION_INDEX_TTL', 600))
+
+# {user_id: (index version, ranking)}; stale once the index version moves on
+recommendation_cache = TTLCache(
+    maxsize=getattr(settings, 'RECOMMENDATION_CACHE_SIZE', 10000),
+    ttl=getattr(settings, 'RECOMMENDATION_CACHE_TTL', 300),
+)
+
+MAX_RECOMMENDATIONS = 100
+
+
+def recommend_trips(user, limit=20):
+    """[(trip_id, score), ...] of upcoming trips matching ``user``'s interests."""
+    trip_tag_index.ensure_loaded()
+    cached = recommendation_cache.get(user.pk)
+    if cached is not None and cached[0] == trip_tag_index.version:
+        return cached[1][:limit]
+
+    version = trip_tag_index.version
+    interest_ids = list(user.interests.values_list('id', flat=True))
+    joined = set(TripMember.objects.filter(user=user).values_list('trip_id', flat=True))
+    ranking = trip_tag_index.rank(interest_ids, exclude=joined, limit=MAX_RECOMMENDATIONS)
+    recommendation_cache.set(user.pk, (version, ranking))
+    return ranking[:limit]
@@ -0,0 +1,44 @@
+import codecs
+import time
+
+from django.conf import settings
+from rest_framework.exceptions import ParseError
+from rest_framework.parsers import JSONParser
+from rest_framework.renderers import JSONRenderer
+
+from . import fastjson
+from .instrumentation import note_render
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer on top of ``core.fastjson``. Indented output, as the
+    browsable API or an ``indent`` media type parameter asks for, is left to
+    DRF's renderer.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        started = time.perf_counter()
+        if self.get_indent(accepted_media_type, renderer_context or {}):
+            content = super().render(data, accepted_media_type, renderer_context)
+        else:
+            content = fastjson.dumps(data)
+        note_render(time.perf_counter() - started)
+        return content
+
+
+class FastJSONParser(JSONParser):
+    """JSONParser on top of ``core.fastjson``."""
+
+    def parse(self, stream, media_type=None, parser_context=None):
+        parser_context = parser_context or {}
+        encoding = parser_context.get('encoding', settings.DEFAULT_CHARSET)
+        try:
+            body = stream.read() if stream is not None else b''
+            if codecs.lookup(encoding).name != 'utf-8':
+                body = body.decode(encoding)
+            return fastjson.loads(body)
+        except ValueError as exc:
+            raise ParseError('JSON parse error - %s' % str(exc))
@@ -0,0 +1,138 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from rest_framework import status
+from rest_framework.response import Response
+
+from . import fastjson
+
+# Entries also expire on their own, which bounds what a lost invalidation can leave behind
+RESPONSE_CACHE_ALIAS = getattr(settings, 'RESPONSE_CACHE_ALIAS', 'default')
+RESPONSE_CACHE_TIMEOUT = getattr(settings, 'RESPONSE_CACHE_TIMEOUT', 300)
+
+
+def response_cache():
+    return caches[RESPONSE_CACHE_ALIAS]
+
+
+def tag_key(tag):
+    return f'responses:tag:{tag}'
+
+
+def tag_versions(tags, since=None):
+    """
+    {tag: version} for ``tags``. A tag seen for the first time (or evicted)
+    starts at the current time, which is never below a version it had before,
+    or at ``since`` if given: a tag still unset can't have moved after that.
+    """
+    cache = response_cache()
+    keys = {tag_key(tag): tag for tag in tags}
+    found = cache.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        now = time.time_ns() if since is None else since
+        for key in missing:
+            cache.add(key, now, None)
+        found.update(cache.get_many(missing))
+    return {keys[key]: version for key, version in found.items()}
+
+
+def invalidate(*tags):
+    """
+    Retire every cached response carrying one of ``tags`` once the current
+    transaction commits, by moving the tags to a new version.
+    """
+    def bump():
+        version = time.time_ns()
+        response_cache().set_many({tag_key(tag): version for tag in tags}, None)
+
+    transaction.on_commit(bump)
+
+
+def trip_tags(trip_id):
+    return ('trips', f'trip:{trip_id}')
+
+
+class CachedResponseMixin:
+    """
+    Caches the serialized data of the ``cached_actions`` of a ViewSet, with
+    an ETag so clients can revalidate with If-None-Match. Entries are keyed
+    by the request (action, lookup, query string, host, renderer) and
+    carry the versions of the tags ``response_cache_tags`` gives for the
+    objects they contain; signals move a tag to a new version when one of
+    its rows changes, and entries with an outdated tag are ignored.
+    Authentication and permissions run before the cache is consulted.
+
+    Versions are read before the response is built, so a write that commits
+    while it is being built can't leave old data under a new version: the
+    tags ``response_cache_known_tags`` gives are checked against that
+    snapshot, and tags only learnt from the objects must not have moved
+    since the handler started.
+    """
+    cached_actions = ('list', 'retrieve')
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(super().retrieve, request, *args, **kwargs)
+
+    def get_serializer(self, *args, **kwargs):
+        # Remember what was serialized: the cache tags are derived from it
+        if args:
+            self.serialized_objects = args[0]
+        return super().get_serializer(*args, **kwargs)
+
+    def response_cache_tags(self, objects):
+        raise NotImplementedError
+
+    def response_cache_known_tags(self):
+        # The tags of response_cache_tags that don't depend on the objects
+        return ()
+
+    def response_cache_key(self, request):
+        fingerprint = '|'.join([
+            self.basename, self.action, str(self.kwargs.get(self.lookup_url_kwarg or self.lookup_field, '')),
+            request.accepted_renderer.format, request.scheme, request.get_host(),
+            repr(sorted(request.query_params.lists())),
+        ])
+        return 'responses:entry:' + hashlib.sha256(fingerprint.encode()).hexdigest()
+
+    def cached_response(self, handler, request, *args, **kwargs):
+        # The browsable API renders forms around the data; only JSON is cached
+        if self.action not in self.cached_actions or request.accepted_renderer.format != 'json':
+            return handler(request, *args, **kwargs)
+
+        cache = response_cache()
+        key = self.response_cache_key(request)
+        entry = cache.get(key)
+        if entry is not None and tag_versions(entry['versions']) == entry['versions']:
+            return self.conditional_response(request, entry['data'], entry['etag'], 'HIT')
+
+        before = tag_versions(self.response_cache_known_tags())
+        started = time.time_ns()
+        response = handler(request, *args, **kwargs)
+        if response.status_code != status.HTTP_200_OK:
+            return response
+        objects = self.serialized_objects
+        if not isinstance(objects, (list, tuple)):
+            objects = [objects]
+        etag = '"%s"' % hashlib.md5(fastjson.dumps(response.data)).hexdigest()
+        versions = tag_versions(self.response_cache_tags(objects), since=started)
+        moved = [
+            tag for tag, version in versions.items()
+            if (version != before[tag] if tag in before else version > started)
+        ]
+        if not moved:
+            cache.set(key, {'versions': versions, 'data': response.data, 'etag': etag}, RESPONSE_CACHE_TIMEOUT)
+        return self.conditional_response(request, response.data, etag, 'MISS')
+
+    def conditional_response(self, request, data, etag, outcome):
+        headers = {'ETag': etag, 'X-Cache': outcome}
+        if_none_match = request.headers.get('If-None-Match', '')
+        if if_none_match.strip() == '*' or etag in [tag.strip() for tag in if_none_match.split(',')]:
+            return Response(status=status.HTTP_304_NOT_MODIFIED, headers=headers)
+        return Response(data, headers=headers)
@@ -0,0 +1,119 @@
+import gzip
+import json
+from collections import defaultdict
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import Count
+from django.utils import timezone
+
+from .models import Notification
+from .notifications import chat_notification_content, parse_chat_notification, reset_unread_count
+
+
+class NotificationArchive:
+    """Appends expired notifications to a gzip-compressed JSON Lines file."""
+
+    def __init__(self, path):
+        self.path = path
+        self.rows = 0
+
+    def write(self, notifications):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with gzip.open(self.path, 'at', encoding='utf-8') as archive:
+            for notification in notifications:
+                archive.write(json.dumps({
+                    'id': notification.id,
+                    'user_id': notification.user_id,
+                    'content': notification.content,
+                    'is_read': notification.is_read,
+                    'created_at': notification.created_at.isoformat(),
+                }, ensure_ascii=False) + '\n')
+                self.rows += 1
+
+
+def delete_in_batches(queryset, archive=None, batch_size=1000):
+    """
+    Archive and delete the rows of ``queryset`` ``batch_size`` at a time, each
+    batch in its own short transaction so the table is never locked for long.
+    Returns the ids of the users whose notifications were deleted.
+    """
+    users = set()
+    while True:
+        with transaction.atomic():
+            batch = list(queryset.order_by('id')[:batch_size])
+            if not batch:
+                return users
+            if archive is not None:
+                archive.write(batch)
+            Notification.objects.filter(id__in=[n.id for n in batch]).delete()
+        users.update(n.user_id for n in batch)
+
+
+def prune_read(days, archive=None, batch_size=1000):
+    """Drop read notifications older than ``days``."""
+    cutoff = timezone.now() - timedelta(days=days)
+    return delete_in_batches(
+        Notification.objects.filter(is_read=True, created_at__lt=cutoff), archive, batch_size,
+    )
+
+
+def prune_beyond(keep, archive=None, batch_size=1000):
+    """Keep only the newest ``keep`` notifications of every user."""
+    users = set()
+    crowded = (
+        Notification.objects.values('user_id').annotate(total=Count('id'))
+        .filter(total__gt=keep).values_list('user_id', flat=True)
+    )
+    for user_id in list(crowded):
+        oldest_kept = (
+            Notification.objects.filter(user_id=user_id).order_by('-id')
+            .values_list('id', flat=True)[keep - 1]
+        )
+        users |= delete_in_batches(
+            Notification.objects.filter(user_id=user_id, id__lt=oldest_kept), archive, batch_size,
+        )
+    return users
+
+
+def fold_chat_notifications(batch_size=1000):
+    """
+    Merge each user's repeated "New message in X" notifications of a trip
+    into the newest one, which then reads "N new messages in X". Read and
+    unread rows are folded separately; rows written before notifications
+    carried their trip are grouped by title. Users are processed
+    ``batch_size`` ids at a time.
+    """
+    users = set()
+    candidates = Notification.objects.filter(content__startswith='💬 ')
+    last_user_id = 0
+    while True:
+        user_ids = list(
+            candidates.filter(user_id__gt=last_user_id).order_by('user_id')
+            .values_list('user_id', flat=True).distinct()[:batch_size]
+        )
+        if not user_ids:
+            return users
+        last_user_id = user_ids[-1]
+
+        groups = defaultdict(list)
+        rows = candidates.filter(user_id__in=user_ids).values_list('id', 'user_id', 'trip_id', 'is_read', 'content')
+        for pk, user_id, trip_id, is_read, content in rows:
+            parsed = parse_chat_notification(content)
+            if parsed is not None:
+                groups[user_id, is_read, trip_id, parsed[0]].append((pk, parsed[1]))
+
+        with transaction.atomic():
+            for (user_id, is_read, _, title), group in groups.items():
+                if len(group) < 2:
+                    continue
+                keep = max(pk for pk, _ in group)
+                total = sum(count for _, count in group)
+                Notification.objects.filter(id=keep).update(content=chat_notification_content(title, total))
+                Notification.objects.filter(id__in=[pk for pk, _ in group if pk != keep]).delete()
+                users.add(user_id)
+
+
+def reset_unread_counts(user_ids):
+    for user_id in user_ids:
+        reset_unread_count(user_id)
@@ -0,0 +1,68 @@
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import DEFAULT_DB_ALIAS
+
+# Set by ReplicaReadMixin for the requests that may read from the replica
+replica_reads = ContextVar('replica_reads', default=False)
+
+
+class ReplicaRouter:
+    """
+    Sends reads to ``DATABASE_REPLICA_ALIAS`` while ``replica_reads`` is set,
+    everything else to the primary. Writes always go to the primary, even
+    for rows that were loaded from the replica.
+    """
+
+    def db_for_read(self, model, **hints):
+        alias = getattr(settings, 'DATABASE_REPLICA_ALIAS', None)
+        if alias and replica_reads.get():
+            return alias
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # Replica rows are the primary's rows
+        return True
+
+
+def pin_key(user_id):
+    return f'db:pinned:{user_id}'
+
+
+class ReplicaReadMixin:
+    """
+    Lets the ``list`` and ``retrieve`` actions of a ViewSet read from the
+    replica. Other actions, unsafe methods, users who wrote within
+    DATABASE_REPLICA_PIN_SECONDS and responses that are about to be cached
+    (which must not capture replication lag) stay on the primary. Lookups
+    that fill process-wide caches, such as trip memberships, always read the
+    primary themselves.
+    """
+    replica_actions = ('list', 'retrieve')
+
+    def dispatch(self, request, *args, **kwargs):
+        token = replica_reads.set(False)
+        try:
+            return super().dispatch(request, *args, **kwargs)
+        finally:
+            replica_reads.reset(token)
+
+    def initial(self, request, *args, **kwargs):
+        # Runs once authentication and permission checks have passed
+        super().initial(request, *args, **kwargs)
+        user_id = request.user.pk
+        if request.method not in ('GET', 'HEAD', 'OPTIONS'):
+            if user_id is not None:
+                cache.set(pin_key(user_id), True, settings.DATABASE_REPLICA_PIN_SECONDS)
+            return
+        replica_reads.set(self.reads_from_replica(request))
+
+    def reads_from_replica(self, request):
+        if self.action not in self.replica_actions or self.action in getattr(self, 'cached_actions', ()):
+            return False
+        user_id = request.user.pk
+        return user_id is None or not cache.get(pin_key(user_id))
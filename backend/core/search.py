@@ -0,0 +1,196 @@
+import re
+import unicodedata
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Q
+from django.utils.module_loading import import_string
+
+from .models import Trip
+
+TERM_RE = re.compile(r'\w+')
+# unicode61 splits on everything but letters and digits, underscores included
+INDEX_TERM_RE = re.compile(r'[^\W_]+')
+
+
+def query_terms(query):
+    return TERM_RE.findall(query.lower())[:10]
+
+
+def index_terms(*texts):
+    """
+    The terms FTS5's unicode61 tokenizer (remove_diacritics 2) makes of
+    ``texts``, near enough for typo candidates; rebuilds take the exact
+    terms from the index.
+    """
+    text = unicodedata.normalize('NFKD', ' '.join(texts).lower())
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return set(INDEX_TERM_RE.findall(text))
+
+
+def edit_distance(a, b, limit):
+    """Levenshtein distance between ``a`` and ``b``, or ``limit + 1`` once it exceeds ``limit``."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(
+                previous[j] + 1,
+                current[j - 1] + 1,
+                previous[j - 1] + (char_a != char_b),
+            ))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class SearchBackend:
+    """
+    Text index over trips. ``search`` returns trip ids, best match first;
+    ``index_trip``/``remove_trip`` keep the index in step with Trip writes.
+    """
+
+    def search(self, query, limit=20):
+        raise NotImplementedError
+
+    def index_trip(self, trip):
+        pass
+
+    def remove_trip(self, trip_id):
+        pass
+
+    def rebuild(self):
+        pass
+
+
+class DatabaseSearchBackend(SearchBackend):
+    """Fallback for databases without a text index: every term must appear in some field."""
+
+    def search(self, query, limit=20):
+        terms = query_terms(query)
+        if not terms:
+            return []
+        queryset = Trip.objects.all()
+        for term in terms:
+            queryset = queryset.filter(
+                Q(title__icontains=term) | Q(destination__icontains=term)
+                | Q(description__icontains=term) | Q(tags__name__icontains=term)
+            )
+        return list(queryset.order_by('-id').values_list('id', flat=True).distinct()[:limit])
+
+
+class SQLiteFTSBackend(SearchBackend):
+    """
+    SQLite FTS5 index (see migration 0006) ranked with bm25, title matches
+    weighing most. Every term also matches as a prefix, and terms with no
+    match in the index vocabulary are widened to the indexed terms within
+    one or two edits, looked up in the term table of migration 0012.
+    """
+    table = 'core_trip_search'
+    vocab_table = 'core_trip_search_vocab'
+    term_table = 'core_trip_search_term'
+    # bm25 weights for title, destination, description, tags
+    weights = (10.0, 5.0, 1.0, 3.0)
+    max_fuzzy_terms = 5
+    # Terms compared per typo, whatever the size of the vocabulary
+    max_typo_candidates = 500
+
+    def search(self, query, limit=20):
+        terms = query_terms(query)
+        if not terms:
+            return []
+        with connection.cursor() as cursor:
+            groups = [self.expand_term(cursor, term) for term in terms]
+            match = ' AND '.join('(' + ' OR '.join(group) + ')' for group in groups)
+            cursor.execute(
+                f'SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s '
+                f'ORDER BY bm25({self.table}, {", ".join(map(str, self.weights))}) LIMIT %s',
+                [match, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def expand_term(self, cursor, term):
+        group = [f'"{term}"*']
+        if len(term) < 4 or self.has_prefix(cursor, term):
+            return group
+        limit = 1 if len(term) < 8 else 2
+        # Typos are looked up among terms of a close length sharing the first
+        # letter: one capped range scan of the (length, term) key per length
+        candidates = []
+        lengths = range(len(term) - limit, len(term) + limit + 1)
+        per_length = self.max_typo_candidates // len(lengths)
+        for length in lengths:
+            cursor.execute(
+                f'SELECT term FROM {self.term_table} WHERE length = %s AND term >= %s AND term < %s LIMIT %s',
+                [length, term[0], chr(ord(term[0]) + 1), per_length],
+            )
+            candidates += [candidate for (candidate,) in cursor.fetchall()]
+        close = sorted(
+            (distance, candidate) for candidate in candidates
+            if (distance := edit_distance(term, candidate, limit)) <= limit
+        )
+        return group + [f'"{candidate}"' for _, candidate in close[:self.max_fuzzy_terms]]
+
+    def has_prefix(self, cursor, term):
+        cursor.execute(
+            f'SELECT 1 FROM {self.vocab_table} WHERE term >= %s AND term < %s LIMIT 1',
+            [term, term + '\uffff'],
+        )
+        return cursor.fetchone() is not None
+
+    def index_trip(self, trip):
+        fields = [trip.title, trip.destination, trip.description, ' '.join(trip.tags.names())]
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [trip.pk])
+            cursor.execute(
+                f'INSERT INTO {self.table} (rowid, title, destination, description, tags) '
+                f'VALUES (%s, %s, %s, %s, %s)',
+                [trip.pk, *fields],
+            )
+            # Terms of deleted trips stay until a rebuild; as typo candidates they just match nothing
+            cursor.executemany(
+                f'INSERT OR IGNORE INTO {self.term_table} (length, term) VALUES (%s, %s)',
+                [(len(term), term) for term in index_terms(*fields)],
+            )
+
+    def remove_trip(self, trip_id):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table} WHERE rowid = %s', [trip_id])
+
+    def rebuild(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {self.table}')
+            cursor.execute(REBUILD_SQL)
+            cursor.execute(f'DELETE FROM {self.term_table}')
+            cursor.execute(
+                f'INSERT INTO {self.term_table} (length, term) SELECT length(term), term FROM {self.vocab_table}'
+            )
+
+
+REBUILD_SQL = """
+    INSERT INTO core_trip_search (rowid, title, destination, description, tags)
+    SELECT trip.id, trip.title, trip.destination, trip.description, (
+        SELECT group_concat(tag.name, ' ')
+        FROM taggit_taggeditem item
+        JOIN taggit_tag tag ON tag.id = item.tag_id
+        JOIN django_content_type ct ON ct.id = item.content_type_id
+        WHERE item.object_id = trip.id AND ct.app_label = 'core' AND ct.model = 'trip'
+    )
+    FROM core_trip trip
+"""
+
+_backend = None
+
+
+def get_search_backend():
+    """The backend named by TRIP_SEARCH_BACKEND, else FTS5 on SQLite and the ORM fallback elsewhere."""
+    global _backend
+    if _backend is None:
+        path = getattr(settings, 'TRIP_SEARCH_BACKEND', None)
+        if path is None:
+            path = 'core.search.SQLiteFTSBackend' if connection.vendor == 'sqlite' else 'core.search.DatabaseSearchBackend'
+        _backend = import_string(path)()
+    return _backend
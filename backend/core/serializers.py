@@ -1,26 +1,75 @@
 from rest_framework import serializers
-from .models import User, Trip, TripMember, Notification, Review
+from .models import User, Trip, TripMember, Notification, Review, Message
 from taggit.serializers import (TagListSerializerField, TaggitSerializer)
 from django.contrib.auth.password_validation import validate_password
+from .images import PROFILE_PHOTO_MAX_BYTES, schedule_profile_photo, variant_urls
+from .instrumentation import InstrumentedSerializerMixin
 
-class UserSerializer(serializers.ModelSerializer):
+def validate_photo_size(photo):
+    if photo is not None and photo.size > PROFILE_PHOTO_MAX_BYTES:
+        raise serializers.ValidationError(
+            f"Profile photos can be at most {PROFILE_PHOTO_MAX_BYTES // (1024 * 1024)} MB."
+        )
+    return photo
+
+
+class ProfilePhotoVariantsMixin(serializers.Serializer):
+    # Resized, metadata-free copies of profile_photo; {} until they are generated
+    profile_photo_variants = serializers.SerializerMethodField()
+
+    def get_profile_photo_variants(self, user):
+        return variant_urls(user, self.context.get('request'))
+
+
+class UserSerializer(InstrumentedSerializerMixin, ProfilePhotoVariantsMixin, serializers.ModelSerializer):
     interests = TagListSerializerField()
 
     class Meta:
         model = User
-        fields = ['id', 'username', 'email', 'bio', 'profile_photo', 'interests']
+        fields = ['id', 'username', 'email', 'bio', 'profile_photo', 'profile_photo_variants', 'interests']
+
+    def validate_profile_photo(self, photo):
+        return validate_photo_size(photo)
+
+    def update(self, instance, validated_data):
+        if 'profile_photo' in validated_data:
+            # The old variants belong to the old photo
+            validated_data['profile_photo_variants'] = {}
+        user = super().update(instance, validated_data)
+        if 'profile_photo' in validated_data:
+            schedule_profile_photo(user)
+        return user
+
+
+class UserListSerializer(InstrumentedSerializerMixin, ProfilePhotoVariantsMixin, serializers.ModelSerializer):
+    class Meta:
+        model = User
+        fields = ['id', 'username', 'profile_photo', 'profile_photo_variants']
 
 
-class TripSerializer(TaggitSerializer, serializers.ModelSerializer):
+class TripSerializer(InstrumentedSerializerMixin, TaggitSerializer, serializers.ModelSerializer):
     tags = TagListSerializerField()
     creator = serializers.StringRelatedField()
 
     class Meta:
         model = Trip
         fields = '__all__'
+        read_only_fields = ['rating_avg', 'rating_count']
 
 
-class TripMemberSerializer(serializers.ModelSerializer):
+class TripListSerializer(InstrumentedSerializerMixin, TaggitSerializer, serializers.ModelSerializer):
+    tags = TagListSerializerField(read_only=True)
+    creator = serializers.StringRelatedField()
+
+    class Meta:
+        model = Trip
+        fields = [
+            'id', 'title', 'destination', 'start_date', 'end_date', 'budget', 'tags', 'creator',
+            'rating_avg', 'rating_count', 'created_at',
+        ]
+
+
+class TripMemberSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     user = serializers.StringRelatedField(read_only=True)
     trip = serializers.StringRelatedField(read_only=True)
 
@@ -29,12 +78,36 @@ class TripMemberSerializer(serializers.ModelSerializer):
         fields = ['id', 'user', 'trip', 'role', 'status', 'joined_at']
         read_only_fields = ['user', 'trip', 'role', 'joined_at']
 
-class NotificationSerializer(serializers.ModelSerializer):
+class MessageSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
+    sender = serializers.StringRelatedField(read_only=True)
+
+    class Meta:
+        model = Message
+        fields = ['id', 'sender', 'content', 'timestamp']
+
+class NotificationSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     class Meta:
         model = Notification
         fields = ['id', 'content', 'is_read', 'created_at']
 
-class RegistrationSerializer(serializers.ModelSerializer):
+class NotificationBulkSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(), required=False, max_length=1000)
+    up_to_id = serializers.IntegerField(required=False)
+    before = serializers.DateTimeField(required=False)
+    # allow_null stops form posts from reading a missing is_read as False
+    is_read = serializers.BooleanField(required=False, allow_null=True)
+
+    def __init__(self, *args, require_criteria=False, **kwargs):
+        self.require_criteria = require_criteria
+        super().__init__(*args, **kwargs)
+
+    def validate(self, attrs):
+        attrs = {key: value for key, value in attrs.items() if value is not None}
+        if self.require_criteria and not attrs:
+            raise serializers.ValidationError("Give ids, up_to_id, before or is_read to select notifications.")
+        return attrs
+
+class RegistrationSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, required=True, validators=[validate_password])
     interests = TagListSerializerField(required=False)
     profile_photo = serializers.ImageField(required=False, allow_null=True)
@@ -43,6 +116,9 @@ class RegistrationSerializer(serializers.ModelSerializer):
         model = User
         fields = ['id', 'username', 'email', 'password', 'bio', 'profile_photo', 'interests']
 
+    def validate_profile_photo(self, photo):
+        return validate_photo_size(photo)
+
     def create(self, validated_data):
         interests = validated_data.pop('interests', [])
         user = User.objects.create(
@@ -55,9 +131,10 @@ class RegistrationSerializer(serializers.ModelSerializer):
         user.save()
         if interests:
             user.interests.set(interests)
+        schedule_profile_photo(user)
         return user
 
-class ReviewSerializer(serializers.ModelSerializer):
+class ReviewSerializer(InstrumentedSerializerMixin, serializers.ModelSerializer):
     reviewer = serializers.StringRelatedField(read_only=True)
 
     class Meta:
@@ -0,0 +1,88 @@
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.db import transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+from taggit.models import TaggedItem
+
+from .authentication import forget_cached_user
+from .availability import note_trip_duration
+from .membership import forget_trip_members
+from .models import Notification, Trip, TripMember, User
+from .notifications import push_notifications, reset_unread_count
+from .recommendations import recommendation_cache, trip_tag_index
+from .responsecache import invalidate, trip_tags
+from .search import get_search_backend
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def evict_cached_user(sender, instance, **kwargs):
+    # Covers profile edits, password changes (token revocation) and deactivation
+    forget_cached_user(instance.pk)
+    invalidate(f'user:{instance.pk}')
+
+
+@receiver(post_save, sender=TripMember)
+@receiver(post_delete, sender=TripMember)
+def membership_changed(sender, instance, created=False, **kwargs):
+    forget_trip_members(instance.trip_id)
+    # Joined trips are left out of recommendations
+    recommendation_cache.delete(instance.user_id)
+    if created or (kwargs['signal'] is post_save and instance.status == 'approved'):
+        return
+
+    # The member lost access: have their open chat sockets re-check it
+    def revoke():
+        channel_layer = get_channel_layer()
+        if channel_layer is not None:
+            async_to_sync(channel_layer.group_send)(f'trip_{instance.trip_id}', {
+                'type': 'membership_changed',
+                'user_id': instance.user_id,
+            })
+
+    transaction.on_commit(revoke)
+
+
+@receiver(post_save, sender=Trip)
+def index_trip(sender, instance, **kwargs):
+    get_search_backend().index_trip(instance)
+    invalidate(*trip_tags(instance.pk))
+    start_date = Trip._meta.get_field('start_date').to_python(instance.start_date)
+    end_date = Trip._meta.get_field('end_date').to_python(instance.end_date)
+    note_trip_duration(start_date, end_date)
+    trip_tag_index.update_trip(instance.pk, start_date)
+
+
+@receiver(post_delete, sender=Trip)
+def unindex_trip(sender, instance, **kwargs):
+    get_search_backend().remove_trip(instance.pk)
+    invalidate(*trip_tags(instance.pk))
+    trip_tag_index.remove_trip(instance.pk)
+
+
+@receiver(m2m_changed, sender=TaggedItem)
+def reindex_tags(sender, instance, action, pk_set=None, **kwargs):
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if isinstance(instance, User):
+        recommendation_cache.delete(instance.pk)
+        invalidate(f'user:{instance.pk}')
+    elif isinstance(instance, Trip):
+        get_search_backend().index_trip(instance)
+        invalidate(*trip_tags(instance.pk))
+        if action == 'post_add':
+            trip_tag_index.add_tags(instance.pk, pk_set)
+        else:
+            trip_tag_index.remove_tags(instance.pk, pk_set)
+
+
+# No post_delete receiver: it would stop Django from deleting notifications
+# in bulk with a single DELETE. Deleting views reset the counter themselves.
+@receiver(post_save, sender=Notification)
+def notification_saved(sender, instance, created, **kwargs):
+    if created:
+        push_notifications([instance])
+    else:
+        # Edits may flip is_read; recount on the next read
+        reset_unread_count(instance.user_id)
@@ -0,0 +1,47 @@
+from django.contrib.contenttypes.models import ContentType
+from django.db.models import Count
+from taggit.models import Tag, TaggedItem
+
+
+def parse_tags(value):
+    return list(dict.fromkeys(tag.strip() for tag in value.split(',') if tag.strip()))
+
+
+def resolve_tag_ids(names):
+    """Tag ids for ``names`` in one query; unknown names are left out."""
+    return list(Tag.objects.filter(name__in=names).values_list('id', flat=True))
+
+
+def tagged_object_ids(model, tag_ids, match_all=False):
+    """
+    Subquery of ``model`` ids tagged with any of ``tag_ids``, or with all of
+    them when ``match_all``: one GROUP BY ... HAVING COUNT = n over the tag
+    index instead of one TaggedItem join per tag.
+    """
+    items = TaggedItem.objects.filter(
+        content_type=ContentType.objects.get_for_model(model),
+        tag_id__in=tag_ids,
+    )
+    if match_all:
+        items = items.values('object_id').annotate(matched=Count('tag_id')).filter(matched=len(tag_ids))
+    return items.values('object_id')
+
+
+def filter_by_tags(queryset, all_tags=(), any_tags=(), exclude_tags=()):
+    """Apply AND (``all_tags``), OR (``any_tags``) and NOT (``exclude_tags``) tag filters by name."""
+    model = queryset.model
+    if all_tags:
+        tag_ids = resolve_tag_ids(all_tags)
+        if len(tag_ids) < len(all_tags):
+            return queryset.none()
+        queryset = queryset.filter(id__in=tagged_object_ids(model, tag_ids, match_all=True))
+    if any_tags:
+        tag_ids = resolve_tag_ids(any_tags)
+        if not tag_ids:
+            return queryset.none()
+        queryset = queryset.filter(id__in=tagged_object_ids(model, tag_ids))
+    if exclude_tags:
+        tag_ids = resolve_tag_ids(exclude_tags)
+        if tag_ids:
+            queryset = queryset.exclude(id__in=tagged_object_ids(model, tag_ids))
+    return queryset
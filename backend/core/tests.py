@@ -1,3 +1,1157 @@
-from django.test import TestCase
+import asyncio
+import base64
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+from datetime import date, datetime, timedelta
+from decimal import Decimal
+from io import BytesIO, StringIO
+from pathlib import Path
+from urllib.parse import parse_qs, urlsplit
+from unittest import skipIf
+from unittest.mock import patch
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+from channels.layers import channel_layers, get_channel_layer
+from channels.testing import WebsocketCommunicator
+from django.core.cache import cache
+from django.core.files.storage import default_storage
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from PIL import Image
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken
+
+try:
+    # A Redis-protocol server in a thread, for the channels_redis tests
+    from fakeredis import TcpFakeServer
+except ImportError:
+    TcpFakeServer = None
+
+from jaben_naki_backend.routing import application
+from .images import _process_in_background, process_profile_photo
+from .membership import is_approved_member, membership_key
+from .metrics import registry
+from .notifications import (
+    CHAT_NOTIFICATION_WINDOW, ChatNotificationBatcher, create_chat_notifications, get_unread_count,
+)
+from .renderers import FastJSONRenderer
+from .routers import pin_key
+from .presence import presence_index, typing_batcher
+from .ratelimit import CHAT_MAX_FRAME_BYTES, CHAT_RATE_LIMITS, chat_rate_limiter
+from .recommendations import recommendation_cache, trip_tag_index
+from .responsecache import invalidate, trip_tags
+from .views import TripViewSet
+from .writebehind import MessageWriteBuffer
+from .models import User, Trip, TripMember, Message, Notification, Review
+
+
+class ListQueryCountTests(TestCase):
+    """
+    Every list endpoint must run the same number of queries whatever the
+    number of rows it returns; a count that grows with the page is an N+1.
+    """
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='owner')
+        self.trip = self.make_trip(self.user)
+        TripMember.objects.create(user=self.user, trip=self.trip, role='admin', status='approved')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.seq = 0
+
+    def make_trip(self, creator):
+        ended = date.today() - timedelta(days=1)
+        trip = Trip.objects.create(
+            title='Trip', destination='Sylhet', description='Tea gardens',
+            start_date=ended - timedelta(days=3), end_date=ended, creator=creator,
+        )
+        trip.tags.add('hills', 'tea')
+        return trip
+
+    def make_rows(self, count):
+        for _ in range(count):
+            self.seq += 1
+            user = User.objects.create(username=f'user{self.seq}')
+            user.interests.add('hiking')
+            self.make_trip(user)
+            TripMember.objects.create(user=user, trip=self.trip, role='member', status='approved')
+            Review.objects.create(trip=self.trip, reviewer=user, rating=4)
+            Message.objects.create(trip=self.trip, sender=user, content='Hello')
+            Notification.objects.create(user=self.user, content='Hi')
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200, response.content)
+        return len(queries), len(response.data['results'])
+
+    def assertConstantQueries(self, url):
+        self.make_rows(2)
+        small, small_rows = self.count_queries(url)
+        # New rows retire cached responses when their transaction commits
+        with self.captureOnCommitCallbacks(execute=True):
+            self.make_rows(8)
+        large, large_rows = self.count_queries(url)
+        self.assertGreater(large_rows, small_rows)
+        self.assertEqual(small, large, f'{url} query count grew from {small} to {large}')
+
+    def test_trip_list(self):
+        self.assertConstantQueries('/api/trips/')
+
+    def test_user_list(self):
+        self.assertConstantQueries('/api/users/')
+
+    def test_member_list(self):
+        self.assertConstantQueries(f'/api/members/?trip={self.trip.id}')
+
+    def test_review_list(self):
+        self.assertConstantQueries(f'/api/trips/{self.trip.id}/reviews/')
+
+    def test_message_list(self):
+        self.assertConstantQueries(f'/api/trips/{self.trip.id}/messages/')
+
+    def test_notification_list(self):
+        self.assertConstantQueries('/api/notifications/')
+
+
+class ResponseCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create(username='alice')
+        self.trip = Trip.objects.create(
+            title='Trip', destination='Sajek', description='Clouds',
+            start_date=date.today(), end_date=date.today(), creator=self.alice,
+        )
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+        self.url = f'/api/trips/{self.trip.id}/'
+
+    def test_trip_page_is_served_from_cache(self):
+        first = self.client.get(self.url)
+        self.assertEqual(first['X-Cache'], 'MISS')
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual((second['X-Cache'], second.json()), ('HIT', first.json()))
+
+        revalidated = self.client.get(self.url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(revalidated.status_code, 304)
+
+    def test_writes_invalidate_precisely(self):
+        other = Trip.objects.create(
+            title='Other', destination='Sylhet', description='Tea',
+            start_date=date.today(), end_date=date.today(), creator=self.alice,
+        )
+        etag = self.client.get(self.url)['ETag']
+        self.client.get(f'/api/trips/{other.id}/')
+        self.client.get('/api/trips/')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.trip.tags.add('clouds')
+        response = self.client.get(self.url)
+        self.assertEqual((response['X-Cache'], response.json()['tags']), ('MISS', ['clouds']))
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertEqual(self.client.get(f'/api/trips/{other.id}/')['X-Cache'], 'HIT')
+        self.assertEqual(self.client.get('/api/trips/')['X-Cache'], 'MISS')
+
+        # Renaming the creator changes every trip that shows them
+        with self.captureOnCommitCallbacks(execute=True):
+            self.alice.username = 'alice2'
+            self.alice.save()
+        self.assertEqual(self.client.get(f'/api/trips/{other.id}/').json()['creator'], 'alice2')
+
+    def test_write_during_a_miss_is_not_cached_as_fresh(self):
+        get_object = TripViewSet.get_object
+
+        def get_object_then_rename(viewset):
+            trip = get_object(viewset)
+            # Another request saves while this one is still serializing the old row
+            with self.captureOnCommitCallbacks(execute=True):
+                Trip.objects.filter(pk=trip.pk).update(title='New title')
+                invalidate(*trip_tags(trip.pk))
+            return trip
+
+        with patch.object(TripViewSet, 'get_object', get_object_then_rename):
+            stale = self.client.get(self.url)
+        self.assertEqual((stale['X-Cache'], stale.json()['title']), ('MISS', 'Trip'))
+        fresh = self.client.get(self.url)
+        self.assertEqual((fresh['X-Cache'], fresh.json()['title']), ('MISS', 'New title'))
+        self.assertEqual(self.client.get(self.url)['X-Cache'], 'HIT')
+
+    def test_review_refreshes_rating(self):
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            Trip.objects.filter(pk=self.trip.pk).update(end_date=date.today() - timedelta(days=1))
+            TripMember.objects.create(user=self.alice, trip=self.trip, role='admin', status='approved')
+            self.client.post(f'/api/trips/{self.trip.id}/reviews/', {'trip': self.trip.id, 'rating': 5})
+        self.assertEqual(self.client.get(self.url).json()['rating_count'], 1)
+
+
+class ProfilePhotoTests(TestCase):
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        override = override_settings(MEDIA_ROOT=media.name)
+        override.enable()
+        self.addCleanup(override.disable)
+        self.user = User.objects.create(username='alice')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def make_photo(self):
+        image = Image.new('RGB', (1200, 800), 'teal')
+        exif = Image.Exif()
+        exif[0x010F] = 'Camera maker'
+        buffer = BytesIO()
+        image.save(buffer, 'JPEG', exif=exif)
+        return SimpleUploadedFile('photo.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_upload_gets_resized_variants(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.put('/api/users/profile/', {'profile_photo': self.make_photo()}, format='multipart')
+        self.assertEqual(response.status_code, 200, response.content)
+        self.assertEqual(response.json()['profile_photo_variants'], {})
+        # Processing is queued for after the commit, not run in the request
+        self.assertIn('schedule_profile_photo.<locals>.<lambda>', [callback.__qualname__ for callback in callbacks])
+
+        self.user.refresh_from_db()
+        process_profile_photo(self.user.pk, self.user.profile_photo.name)
+        variants = self.client.get(f'/api/users/{self.user.pk}/').json()['profile_photo_variants']
+        self.assertEqual(set(variants), {'webp', 'jpeg'})
+        self.assertTrue(variants['webp']['512'].startswith('http://testserver/media/profiles/variants/'))
+
+        self.user.refresh_from_db()
+        name = self.user.profile_photo_variants['jpeg']['128']
+        with default_storage.open(name) as stored, Image.open(stored) as variant:
+            self.assertEqual(max(variant.size), 128)
+            self.assertEqual(len(variant.getexif()), 0)
+        self.assertRegex(name, r'^profiles/variants/[0-9a-f]{20}-128\.jpeg$')
+
+    @patch('core.images.process_profile_photo', side_effect=OSError('connection lost'))
+    @patch('core.images.close_old_connections')
+    def test_pool_jobs_recycle_connections(self, close_old_connections, process):
+        with self.assertLogs('core.images', 'ERROR'):
+            _process_in_background(self.user.pk, 'profiles/photo.jpg')
+        self.assertEqual(close_old_connections.call_count, 2)
+
+
+class TripRatingStatsTests(TestCase):
+    def setUp(self):
+        self.creator = User.objects.create(username='creator')
+        ended = date.today() - timedelta(days=1)
+        self.trip = Trip.objects.create(
+            title='Trip', destination='Bandarban', description='Hills',
+            start_date=ended - timedelta(days=2), end_date=ended, creator=self.creator,
+        )
+        self.client = APIClient()
+
+    def review(self, username, rating):
+        user = User.objects.create(username=username)
+        TripMember.objects.create(user=user, trip=self.trip, role='member', status='approved')
+        self.client.force_authenticate(user)
+        response = self.client.post(f'/api/trips/{self.trip.id}/reviews/', {'trip': self.trip.id, 'rating': rating})
+        self.assertEqual(response.status_code, 201, response.content)
+        return response.data['id']
+
+    def assertStats(self, avg, count):
+        self.trip.refresh_from_db()
+        self.assertAlmostEqual(self.trip.rating_avg, avg)
+        self.assertEqual(self.trip.rating_count, count)
+
+    def test_stats_follow_review_writes(self):
+        self.review('a', 5)
+        review_id = self.review('b', 2)
+        self.assertStats(3.5, 2)
+        self.client.patch(f'/api/trips/{self.trip.id}/reviews/{review_id}/', {'rating': 4})
+        self.assertStats(4.5, 2)
+        self.client.delete(f'/api/trips/{self.trip.id}/reviews/{review_id}/')
+        self.assertStats(5, 1)
+
+    def test_rebuild_command(self):
+        self.review('a', 3)
+        self.review('b', 4)
+        Trip.objects.update(rating_avg=0, rating_count=0)
+        call_command('rebuild_rating_stats', batch_size=1, stdout=StringIO())
+        self.assertStats(3.5, 2)
+
+
+class TripChatConsumerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        chat_rate_limiter.buckets.clear()
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+        self.trip = Trip.objects.create(
+            title='Trip', destination='Cox\'s Bazar', description='Beach',
+            start_date=date.today(), end_date=date.today(), creator=self.alice,
+        )
+        for user in (self.alice, self.bob):
+            TripMember.objects.create(user=user, trip=self.trip, role='member', status='approved')
+
+    def communicator(self, user, query=''):
+        token = AccessToken.for_user(user)
+        return WebsocketCommunicator(application, f'/ws/trips/{self.trip.id}/?token={token}{query}')
+
+    async def test_message_is_broadcast_to_the_room(self):
+        alice, bob = self.communicator(self.alice), self.communicator(self.bob)
+        self.assertTrue((await alice.connect())[0])
+        self.assertTrue((await bob.connect())[0])
+
+        await alice.send_json_to({'message': 'Hello'})
+        for communicator in (alice, bob):
+            frame = await communicator.receive_json_from()
+            self.assertEqual((frame['message'], frame['sender']), ('Hello', 'alice'))
+        await alice.disconnect()
+        await bob.disconnect()
+
+        self.assertEqual(await sync_to_async(Message.objects.filter(trip=self.trip).count)(), 1)
+
+    async def test_history_is_replayed_oldest_first(self):
+        def write_history():
+            sent_at = timezone.now()
+            for index in range(3):
+                Message.objects.create(trip=self.trip, sender=self.bob, content=f'Old {index}', timestamp=sent_at)
+
+        await sync_to_async(write_history)()
+        alice = self.communicator(self.alice, '&history=2')
+        self.assertTrue((await alice.connect())[0])
+        frames = [await alice.receive_json_from() for _ in range(2)]
+        self.assertEqual([(f['message'], f['sender']) for f in frames], [('Old 1', 'bob'), ('Old 2', 'bob')])
+        self.assertTrue(await alice.receive_nothing())
+        await alice.disconnect()
+
+        bob = self.communicator(self.bob, '&history=abc')
+        self.assertTrue((await bob.connect())[0])
+        self.assertTrue(await bob.receive_nothing())
+        await bob.disconnect()
+
+    async def test_token_in_subprotocol(self):
+        token = AccessToken.for_user(self.bob)
+        communicator = WebsocketCommunicator(
+            application, f'/ws/trips/{self.trip.id}/', subprotocols=['access_token', str(token)],
+        )
+        connected, subprotocol = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual(subprotocol, 'access_token')
+        await communicator.disconnect()
+
+    async def test_removed_member_is_disconnected(self):
+        bob = self.communicator(self.bob)
+        self.assertTrue((await bob.connect())[0])
+
+        def remove_bob():
+            with self.captureOnCommitCallbacks(execute=True):
+                TripMember.objects.get(trip=self.trip, user=self.bob).delete()
+
+        await sync_to_async(remove_bob)()
+        self.assertEqual((await bob.receive_output())['type'], 'websocket.close')
+
+        # The eviction reached the shared cache, so no worker lets bob back in
+        self.assertNotIn(self.bob.id, await cache.aget(membership_key(self.trip.id)) or {})
+        self.assertFalse((await self.communicator(self.bob).connect())[0])
+
+    async def test_frames_beyond_the_burst_are_refused(self):
+        alice = self.communicator(self.alice)
+        self.assertTrue((await alice.connect())[0])
+        burst = CHAT_RATE_LIMITS['connection'][1]
+        for index in range(burst):
+            await alice.send_json_to({'message': f'Hello {index}'})
+            self.assertIn('sender', await alice.receive_json_from())
+
+        await alice.send_json_to({'message': 'One too many'})
+        frame = await alice.receive_json_from()
+        self.assertEqual((frame['error'], frame['scope']), ('rate_limited', 'connection'))
+        await alice.disconnect()
+
+    async def test_malformed_frames_get_an_error(self):
+        alice = self.communicator(self.alice)
+        self.assertTrue((await alice.connect())[0])
+        for frame in ('{"message": ', '["Hello"]', '{"message": {"text": "Hello"}}'):
+            await alice.send_to(text_data=frame)
+            self.assertEqual(await alice.receive_json_from(), {'error': 'invalid_frame'})
+        await alice.send_to(bytes_data=b'\x00')
+        self.assertEqual(await alice.receive_json_from(), {'error': 'invalid_frame'})
+        # The socket is still usable
+        await alice.send_json_to({'message': 'Hello'})
+        self.assertEqual((await alice.receive_json_from())['message'], 'Hello')
+        await alice.disconnect()
+
+    async def test_oversized_frame_closes_the_socket(self):
+        alice = self.communicator(self.alice)
+        self.assertTrue((await alice.connect())[0])
+        await alice.send_to(text_data=json.dumps({'message': 'x' * CHAT_MAX_FRAME_BYTES}))
+        self.assertEqual(await alice.receive_output(), {'type': 'websocket.close', 'code': 1009})
+
+    async def test_stale_broadcast_is_dropped(self):
+        bob = self.communicator(self.bob)
+        self.assertTrue((await bob.connect())[0])
+        await get_channel_layer().group_send(f'trip_{self.trip.id}', {
+            'type': 'chat_message', 'frame': '{"message": "Old news"}', 'sent_at': time.time() - 60,
+        })
+        self.assertTrue(await bob.receive_nothing())
+        await bob.disconnect()
+
+    async def test_non_member_is_rejected(self):
+        outsider = await sync_to_async(User.objects.create)(username='carol')
+        connected, _ = await self.communicator(outsider).connect()
+        self.assertFalse(connected)
+
+
+@skipIf(TcpFakeServer is None, 'fakeredis[lua] is needed for a local Redis stand-in')
+class RedisChannelLayerTests(SimpleTestCase):
+    def setUp(self):
+        hosts = []
+        for _ in range(2):
+            server = TcpFakeServer(('127.0.0.1', 0), server_type='redis')
+            threading.Thread(target=server.serve_forever, daemon=True).start()
+            self.addCleanup(server.server_close)
+            self.addCleanup(server.shutdown)
+            hosts.append('redis://%s:%d/0' % server.server_address)
+        override = override_settings(CHANNEL_LAYERS={'default': {
+            'BACKEND': 'channels_redis.core.RedisChannelLayer',
+            'CONFIG': {'hosts': hosts, 'capacity': 100, 'expiry': 60},
+        }})
+        override.enable()
+        self.addCleanup(override.disable)
+
+    async def test_group_send_reaches_every_worker(self):
+        # One layer per worker process, each with its own connections
+        workers = [channel_layers.make_backend('default') for _ in range(2)]
+        groups = [f'trip_{trip_id}' for trip_id in range(10)]
+        # Groups are sharded over both hosts
+        self.assertEqual({workers[0].consistent_hash(group) for group in groups}, {0, 1})
+
+        members = []
+        for group in groups:
+            for layer in workers:
+                channel = await layer.new_channel()
+                await layer.group_add(group, channel)
+                members.append((group, layer, channel))
+        for group in groups:
+            await workers[0].group_send(group, {'type': 'chat_message', 'frame': group})
+        for group, layer, channel in members:
+            event = await asyncio.wait_for(layer.receive(channel), 5)
+            self.assertEqual(event, {'type': 'chat_message', 'frame': group})
+        for layer in workers:
+            await layer.close_pools()
+
+
+class PresenceTests(TestCase):
+    def setUp(self):
+        chat_rate_limiter.buckets.clear()
+        presence_index.rooms.clear()
+        self.alice = User.objects.create(username='alice')
+        self.bob = User.objects.create(username='bob')
+        self.trip = Trip.objects.create(
+            title='Trip', destination='Bandarban', description='Hills',
+            start_date=date.today(), end_date=date.today(), creator=self.alice,
+        )
+        for user in (self.alice, self.bob):
+            TripMember.objects.create(user=user, trip=self.trip, role='member', status='approved')
+
+    def communicator(self, user):
+        token = AccessToken.for_user(user)
+        return WebsocketCommunicator(application, f'/ws/trips/{self.trip.id}/?token={token}&presence=1')
+
+    async def test_members_coming_and_going_are_announced(self):
+        alice = self.communicator(self.alice)
+        await alice.connect()
+        self.assertEqual(await alice.receive_json_from(), {'type': 'presence', 'online': ['alice']})
+        self.assertEqual(await alice.receive_json_from(), {'type': 'presence', 'user': 'alice', 'status': 'online'})
+
+        bob = self.communicator(self.bob)
+        await bob.connect()
+        self.assertEqual(await alice.receive_json_from(), {'type': 'presence', 'user': 'bob', 'status': 'online'})
+        response = await sync_to_async(self.online_as)(self.alice)
+        self.assertEqual([user['username'] for user in response.json()], ['alice', 'bob'])
+
+        await bob.disconnect()
+        self.assertEqual(await alice.receive_json_from(), {'type': 'presence', 'user': 'bob', 'status': 'offline'})
+        await alice.disconnect()
+        self.assertEqual(presence_index.online(self.trip.id), [])
+
+    async def test_typing_frames_are_coalesced(self):
+        alice, bob = self.communicator(self.alice), self.communicator(self.bob)
+        await alice.connect()
+        await bob.connect()
+        for _ in range(3):
+            await bob.send_json_to({'type': 'typing'})
+        await alice.send_json_to({'type': 'typing'})
+        await bob.receive_nothing()
+        await typing_batcher.flush()
+
+        frames = []
+        while not await alice.receive_nothing():
+            frames.append(await alice.receive_json_from())
+        self.assertEqual([f for f in frames if f['type'] == 'typing'], [{'type': 'typing', 'users': ['alice', 'bob']}])
+        await alice.disconnect()
+        await bob.disconnect()
+
+    async def test_reader_whose_socket_expired_comes_back_online(self):
+        alice, bob = self.communicator(self.alice), self.communicator(self.bob)
+        await alice.connect()
+        await bob.connect()
+        while not await alice.receive_nothing():
+            await alice.receive_json_from()
+        for channels in presence_index.rooms[self.trip.id].values():
+            for channel_name in channels:
+                channels[channel_name] -= presence_index.ttl + 1
+        # Silent sockets are not listed, even before anything has expired them
+        response = await sync_to_async(self.online_as)(self.alice)
+        self.assertEqual(response.json(), [])
+
+        await alice.send_json_to({'type': 'presence'})
+        frames = [await alice.receive_json_from() for _ in range(2)]
+        self.assertIn({'type': 'presence', 'online': ['alice']}, frames)
+        self.assertIn({'type': 'presence', 'user': 'bob', 'status': 'offline'}, frames)
+
+        # Bob was only reading; his next frame announces him again
+        await bob.send_json_to({'type': 'typing'})
+        self.assertEqual(await alice.receive_json_from(), {'type': 'presence', 'user': 'bob', 'status': 'online'})
+        self.assertEqual([user['username'] for user in presence_index.online(self.trip.id)], ['alice', 'bob'])
+        await bob.disconnect()
+        self.assertEqual(await alice.receive_json_from(), {'type': 'presence', 'user': 'bob', 'status': 'offline'})
+        await alice.disconnect()
+
+    def online_as(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.get(f'/api/trips/{self.trip.id}/online/')
+
+
+class MessageWriteBufferTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create(username='alice')
+        self.trip = Trip.objects.create(
+            title='Trip', destination='Sylhet', description='Tea gardens',
+            start_date=date.today(), end_date=date.today(), creator=self.alice,
+        )
+        spool = tempfile.TemporaryDirectory()
+        self.addCleanup(spool.cleanup)
+        self.spool_dir = Path(spool.name)
+        self.buffer = MessageWriteBuffer(self.spool_dir, batch_size=3, interval=60)
+
+    async def test_frames_are_written_in_batches(self):
+        sent_at = timezone.now() - timedelta(minutes=5)
+        for index in range(4):
+            self.buffer.add(self.trip.id, self.alice.id, f'Hello {index}', sent_at)
+        self.assertEqual(len(list(self.spool_dir.iterdir())), 1)
+
+        await self.buffer.flush()
+        messages = await sync_to_async(list)(Message.objects.filter(trip=self.trip).order_by('id'))
+        self.assertEqual([m.content for m in messages], ['Hello 0', 'Hello 1', 'Hello 2', 'Hello 3'])
+        # The frame's own time is kept, not the time of the batch insert
+        self.assertEqual(messages[0].timestamp, sent_at)
+        self.assertEqual(list(self.spool_dir.iterdir()), [])
+
+    def test_spool_of_dead_process_is_replayed(self):
+        entry = {'trip_id': self.trip.id, 'sender_id': self.alice.id, 'content': 'Lost',
+                 'timestamp': timezone.now().isoformat()}
+        segment = self.spool_dir / 'messages-999999999-0.jsonl'
+        segment.write_text(json.dumps(entry) + '\n{"trip_id": ', encoding='utf-8')
+
+        self.assertEqual(self.buffer.recover(), 1)
+        self.assertEqual(Message.objects.get(trip=self.trip).content, 'Lost')
+        self.assertFalse(segment.exists())
+
+    async def test_spool_of_restarted_process_with_same_pid_is_replayed(self):
+        entry = {'trip_id': self.trip.id, 'sender_id': self.alice.id, 'content': 'Before restart',
+                 'timestamp': timezone.now().isoformat()}
+        segment = self.spool_dir / f'messages-{os.getpid()}-{"0" * 32}-0.jsonl'
+        segment.write_text(json.dumps(entry) + '\n', encoding='utf-8')
+
+        self.buffer.add(self.trip.id, self.alice.id, 'After restart')
+        await self.buffer.flush()
+        messages = await sync_to_async(list)(Message.objects.filter(trip=self.trip).order_by('id'))
+        self.assertEqual([m.content for m in messages], ['Before restart', 'After restart'])
+        self.assertEqual(list(self.spool_dir.iterdir()), [])
+
+
+class FastJSONTests(TestCase):
+    def test_renderer_matches_drf_output(self):
+        data = {'price': Decimal('12.50'), 'when': date(2026, 1, 1), 'name': 'চা বাগান'}
+        self.assertEqual(
+            json.loads(FastJSONRenderer().render(data)), json.loads(JSONRenderer().render(data)),
+        )
+
+    def test_malformed_body_is_a_bad_request(self):
+        response = APIClient().post('/api/register/', '{"username": ', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('JSON parse error', response.json()['detail'])
+
+
+class InstrumentationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='alice')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_requests_are_exported_per_view(self):
+        Trip.objects.create(
+            title='Trip', destination='Sylhet', description='', creator=self.user,
+            start_date=date.today(), end_date=date.today(),
+        )
+        self.client.get('/api/trips/')
+        self.assertEqual(self.client.get('/metrics').status_code, 403)
+        staff = User.objects.create(username='ops', is_staff=True)
+        metrics = APIClient().get('/metrics', HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(staff)}')
+        self.assertEqual(metrics['Content-Type'], 'text/plain; version=0.0.4; charset=utf-8')
+        body = metrics.content.decode()
+        self.assertIn('# TYPE http_request_duration_seconds histogram', body)
+        self.assertIn('http_request_duration_seconds_count{view="trip-list",method="GET",status="200"}', body)
+        self.assertRegex(body, r'http_request_db_queries_sum\{view="trip-list",method="GET"\} [1-9]')
+        self.assertRegex(body, r'http_request_serializer_seconds_sum\{view="trip-list",method="GET"\} (?!0\.0\n)')
+        self.assertIn('http_request_auth_seconds_count{view="trip-list",method="GET"}', body)
+        self.assertIn('http_request_render_seconds_count{view="trip-list",method="GET"}', body)
+
+    @override_settings(METRICS_TOKEN='scrape-me')
+    def test_metrics_token(self):
+        self.assertEqual(APIClient().get('/metrics', HTTP_AUTHORIZATION='Bearer wrong').status_code, 403)
+        self.assertEqual(APIClient().get('/metrics', HTTP_AUTHORIZATION='Bearer scrape-me').status_code, 200)
+
+    def test_slow_requests_are_logged_with_their_sql(self):
+        with patch('core.instrumentation.SLOW_REQUEST_SECONDS', 0), \
+                self.assertLogs('core.slow_requests', 'WARNING') as logs:
+            self.client.get('/api/notifications/')
+        self.assertIn('(notification-list)', logs.output[0])
+        self.assertIn('core_notification', logs.output[0])
+
+    async def test_socket_events_are_exported(self):
+        trip = await sync_to_async(Trip.objects.create)(
+            title='Trip', destination='Sylhet', description='', creator=self.user,
+            start_date=date.today(), end_date=date.today(),
+        )
+        await sync_to_async(TripMember.objects.create)(user=self.user, trip=trip, role='admin', status='approved')
+        communicator = WebsocketCommunicator(application, f'/ws/trips/{trip.id}/?token={AccessToken.for_user(self.user)}')
+        await communicator.connect()
+        await communicator.disconnect()
+        body = registry.render()
+        self.assertIn('websocket_event_duration_seconds_count{consumer="TripChatConsumer",event="websocket.connect"}', body)
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='alice')
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def test_user_is_loaded_once(self):
+        self.client.get('/api/notifications/')
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/notifications/')
+        self.assertFalse([q for q in queries if 'FROM "core_user"' in q['sql']])
+
+    def test_deactivation_evicts_user(self):
+        self.assertEqual(self.client.get('/api/notifications/').status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.client.get('/api/notifications/').status_code, 401)
+
+
+class TripSearchTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='alice')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        self.sajek = self.make_trip('Sajek Valley', 'Rangamati', 'Clouds over the hills', ['camping'])
+        self.beach = self.make_trip('Beach weekend', 'Cox\'s Bazar', 'Sea and sunsets', ['beach'])
+
+    def make_trip(self, title, destination, description, tags):
+        trip = Trip.objects.create(
+            title=title, destination=destination, description=description,
+            start_date=date.today(), end_date=date.today(), creator=self.user,
+        )
+        trip.tags.add(*tags)
+        return trip
+
+    def search(self, query):
+        response = self.client.get('/api/trips/search/', {'q': query})
+        self.assertEqual(response.status_code, 200)
+        return [trip['id'] for trip in response.data]
+
+    def test_matches_every_field(self):
+        self.assertEqual(self.search('sajek'), [self.sajek.id])
+        self.assertEqual(self.search('rangamati'), [self.sajek.id])
+        self.assertEqual(self.search('sunsets'), [self.beach.id])
+        self.assertEqual(self.search('camping'), [self.sajek.id])
+
+    def test_prefix_and_typo(self):
+        self.assertEqual(self.search('val'), [self.sajek.id])
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.search('bech'), [self.beach.id])
+        # Typo candidates come from the term table; the vocabulary, which reads
+        # doclists, is only probed for one prefix row
+        vocab_reads = [q['sql'] for q in queries if 'core_trip_search_vocab' in q['sql']]
+        self.assertTrue(all(sql.endswith('LIMIT 1') for sql in vocab_reads), vocab_reads)
+        self.assertEqual(self.search('rangamti'), [self.sajek.id])
+
+    def test_index_follows_writes(self):
+        self.beach.title = 'Island hopping'
+        self.beach.save()
+        self.assertEqual(self.search('island'), [self.beach.id])
+        self.sajek.tags.remove('camping')
+        self.assertEqual(self.search('camping'), [])
+        self.beach.delete()
+        self.assertEqual(self.search('island'), [])
+
+
+class TripTagFilterTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create(username='alice')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        self.trips = {}
+        for title, tags in [('hills', ['hiking', 'camping']), ('coast', ['beach', 'camping']), ('city', ['food'])]:
+            trip = Trip.objects.create(
+                title=title, destination='Bangladesh', description='', start_date=date.today(),
+                end_date=date.today(), creator=user,
+            )
+            trip.tags.add(*tags)
+            self.trips[title] = trip
+
+    def titles(self, **params):
+        response = self.client.get('/api/trips/', params)
+        return sorted(trip['title'] for trip in response.data['results'])
+
+    def test_all_any_and_exclude(self):
+        self.assertEqual(self.titles(tags='camping,hiking'), ['hills'])
+        self.assertEqual(self.titles(tags='camping,unknown'), [])
+        self.assertEqual(self.titles(tags_any='hiking,food'), ['city', 'hills'])
+        self.assertEqual(self.titles(tags='camping', tags_exclude='beach'), ['hills'])
+
+
+class TripAvailabilityTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create(username='alice')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        self.day = date(2026, 3, 1)
+        for title, start, days, budget in [
+            ('before', -10, 3, 100), ('into', -2, 4, 200), ('inside', 1, 2, 300),
+            ('across', -5, 20, 400), ('out', 2, 5, 500), ('after', 9, 1, 600),
+        ]:
+            Trip.objects.create(
+                title=title, destination='Sylhet', description='', creator=user, budget=budget,
+                start_date=self.day + timedelta(days=start), end_date=self.day + timedelta(days=start + days),
+            )
+
+    def titles(self, **params):
+        response = self.client.get('/api/trips/', params)
+        self.assertEqual(response.status_code, 200, response.content)
+        return [trip['title'] for trip in response.json()['results']]
+
+    def test_window_matches_overlapping_trips(self):
+        window = {'available_from': self.day, 'available_to': self.day + timedelta(days=4)}
+        self.assertEqual(self.titles(**window, ordering='start_date'), ['across', 'into', 'inside', 'out'])
+        self.assertEqual(self.titles(available_from=self.day + timedelta(days=8)), ['after', 'across'])
+        self.assertEqual(self.titles(available_to=self.day - timedelta(days=5), ordering='end_date'), ['before', 'across'])
+
+    def test_budget_range(self):
+        self.assertEqual(self.titles(min_budget=200, max_budget=400, ordering='-budget'), ['across', 'inside', 'into'])
+
+    @patch('core.availability.bound_is_shared', return_value=True)
+    def test_longer_trip_widens_the_window_scan(self, bound_is_shared):
+        self.titles(available_from=self.day)
+        with self.captureOnCommitCallbacks(execute=True):
+            Trip.objects.create(
+                title='long', destination='Sylhet', description='', creator=Trip.objects.first().creator,
+                start_date=self.day - timedelta(days=100), end_date=self.day + timedelta(days=100),
+            )
+        self.assertIn('long', self.titles(available_from=self.day + timedelta(days=50)))
+
+
+class TripPaginationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        user = User.objects.create(username='alice')
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        # Every trip ties on its rating, and two have no budget
+        self.trips = [
+            Trip.objects.create(
+                title=f'Trip {index}', destination='Sylhet', description='', creator=user,
+                start_date=date.today(), end_date=date.today(), budget=[100, None, 100, None, 50][index],
+            )
+            for index in range(5)
+        ]
+
+    def walk(self, ordering):
+        ids, url = [], f'/api/trips/?ordering={ordering}&page_size=2'
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertFalse([q['sql'] for q in queries if 'OFFSET' in q['sql']])
+            ids += [trip['id'] for trip in response.json()['results']]
+            url = response.json()['next']
+        return ids
+
+    def test_ties_are_broken_by_id_without_offset(self):
+        ids = [trip.id for trip in self.trips]
+        self.assertEqual(self.walk('rating_avg'), ids)
+        self.assertEqual(self.walk('-rating_avg'), ids[::-1])
+
+    def test_null_values_sort_last(self):
+        ids = [trip.id for trip in self.trips]
+        self.assertEqual(self.walk('budget'), [ids[4], ids[0], ids[2], ids[1], ids[3]])
+        self.assertEqual(self.walk('-budget'), [ids[2], ids[0], ids[4], ids[3], ids[1]])
+
+
+class MessagePaginationTests(TestCase):
+    def setUp(self):
+        self.alice = User.objects.create(username='alice')
+        self.trip = Trip.objects.create(
+            title='Trip', destination='Sylhet', description='', start_date=date.today(),
+            end_date=date.today(), creator=self.alice,
+        )
+        TripMember.objects.create(user=self.alice, trip=self.trip, role='admin', status='approved')
+        self.client = APIClient()
+        self.client.force_authenticate(self.alice)
+        self.url = f'/api/trips/{self.trip.id}/messages/'
+        # Messages sent in the same instant must still page without repeats or gaps
+        sent_at = timezone.now()
+        self.messages = [
+            Message.objects.create(trip=self.trip, sender=self.alice, content=f'Hello {index}', timestamp=sent_at)
+            for index in range(5)
+        ]
+
+    def test_pages_walk_equal_timestamps_by_id(self):
+        ids, url = [], f'{self.url}?page_size=2'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [message['id'] for message in response.json()['results']]
+            url = response.json()['next']
+        self.assertEqual(ids, [message.id for message in reversed(self.messages)])
+
+    def test_cursor_holds_the_last_rows_position(self):
+        next_url = self.client.get(f'{self.url}?page_size=2').json()['next']
+        cursor = parse_qs(urlsplit(next_url).query)['cursor'][0]
+        timestamp, pk = json.loads(base64.urlsafe_b64decode(cursor))
+        self.assertEqual((datetime.fromisoformat(timestamp), int(pk)), (self.messages[3].timestamp, self.messages[3].id))
+
+    def test_invalid_cursor_is_not_found(self):
+        for cursor in ('garbage', base64.urlsafe_b64encode(b'[1]').decode(), base64.urlsafe_b64encode(b'{}').decode()):
+            self.assertEqual(self.client.get(self.url, {'cursor': cursor}).status_code, 404)
+
+    def test_non_numeric_trip_is_not_found(self):
+        self.assertEqual(self.client.get('/api/trips/abc/messages/').status_code, 404)
+        self.assertEqual(self.client.get('/api/trips/abc/online/').status_code, 404)
+
+
+class TripRecommendationTests(TestCase):
+    def setUp(self):
+        trip_tag_index.invalidate()
+        recommendation_cache.clear()
+        self.user = User.objects.create(username='alice')
+        self.user.interests.add('hiking', 'camping')
+        creator = User.objects.create(username='guide')
+        soon = date.today() + timedelta(days=7)
+        self.trips = {}
+        for title, tags, start in [
+            ('both', ['hiking', 'camping'], soon),
+            ('one', ['hiking', 'food'], soon),
+            ('none', ['food'], soon),
+            ('past', ['hiking', 'camping'], date.today() - timedelta(days=7)),
+        ]:
+            trip = Trip.objects.create(
+                title=title, destination='Bangladesh', description='', start_date=start,
+                end_date=start + timedelta(days=2), creator=creator,
+            )
+            trip.tags.add(*tags)
+            self.trips[title] = trip
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def titles(self):
+        response = self.client.get('/api/trips/recommended/')
+        self.assertEqual(response.status_code, 200)
+        return [trip['title'] for trip in response.data]
+
+    def test_ranks_upcoming_trips_by_interest_overlap(self):
+        self.assertEqual(self.titles(), ['both', 'one'])
+
+    def test_index_and_cache_follow_changes(self):
+        self.titles()
+        self.trips['none'].tags.add('camping', 'hiking')
+        self.assertEqual(self.titles()[-1], 'one')
+        TripMember.objects.create(user=self.user, trip=self.trips['both'], role='member')
+        self.assertNotIn('both', self.titles())
+        self.user.interests.set(['food'])
+        self.assertEqual(set(self.titles()), {'one', 'none'})
+
+
+class NotificationPushTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='alice')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def notify(self, content):
+        with self.captureOnCommitCallbacks(execute=True):
+            return Notification.objects.create(user=self.user, content=content)
+
+    async def test_new_notifications_and_counts_are_pushed(self):
+        token = AccessToken.for_user(self.user)
+        communicator = WebsocketCommunicator(application, f'/ws/notifications/?token={token}')
+        self.assertTrue((await communicator.connect())[0])
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'unread_count', 'unread_count': 0})
+
+        notification = await sync_to_async(self.notify)('Hello')
+        frame = await communicator.receive_json_from()
+        self.assertEqual((frame['type'], frame['notification']['content'], frame['unread_count']), ('notification', 'Hello', 1))
+
+        def mark_as_read():
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(f'/api/notifications/{notification.id}/mark_as_read/')
+
+        await sync_to_async(mark_as_read)()
+        self.assertEqual(await communicator.receive_json_from(), {'type': 'unread_count', 'unread_count': 0})
+        await communicator.disconnect()
+
+    def test_unread_count_is_served_from_cache(self):
+        self.notify('One')
+        self.notify('Two')
+        self.assertEqual(self.client.get('/api/notifications/unread_count/').data, {'unread_count': 2})
+        with self.assertNumQueries(0):
+            self.assertEqual(get_unread_count(self.user.id), 2)
+
+
+class ChatNotificationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.alice, self.bob, self.carol, self.dave = (
+            User.objects.create(username=name) for name in ('alice', 'bob', 'carol', 'dave')
+        )
+        # Two trips with the same title
+        self.trips = [
+            Trip.objects.create(
+                title='Sajek', destination='Rangamati', description='', start_date=date.today(),
+                end_date=date.today(), creator=self.alice,
+            )
+            for _ in range(2)
+        ]
+        for trip in self.trips:
+            for user in (self.alice, self.bob, self.carol):
+                TripMember.objects.create(user=user, trip=trip, role='member', status='approved')
+            TripMember.objects.create(user=self.dave, trip=trip, role='member', status='pending')
+
+    def notified(self):
+        return sorted(Notification.objects.values_list('user__username', 'trip_id'))
+
+    def test_members_but_the_sender_are_notified_in_bulk(self):
+        one, two = (trip.id for trip in self.trips)
+        # Pushing the unread counts afterwards recounts every cold counter in one query
+        with self.assertNumQueries(5), self.captureOnCommitCallbacks(execute=True):
+            create_chat_notifications({one: {self.alice.id}, two: {self.alice.id, self.bob.id}})
+        self.assertEqual(self.notified(), [
+            ('alice', two), ('bob', one), ('bob', two), ('carol', one), ('carol', two),
+        ])
+        with self.assertNumQueries(0):
+            self.assertEqual([get_unread_count(user.id) for user in (self.alice, self.bob)], [1, 2])
+        self.assertEqual(Notification.objects.first().content, '💬 New message in "Sajek"')
+
+    def test_unread_notifications_are_not_repeated_within_the_window(self):
+        one, two = (trip.id for trip in self.trips)
+        create_chat_notifications({one: {self.alice.id}})
+        self.assertEqual(create_chat_notifications({one: {self.alice.id}}), [])
+        # The other trip of that title is not covered by the first one's notification
+        self.assertEqual(len(create_chat_notifications({two: {self.alice.id}})), 2)
+
+        Notification.objects.filter(user=self.bob, trip_id=one).update(is_read=True)
+        Notification.objects.filter(user=self.carol, trip_id=one).update(
+            created_at=timezone.now() - timedelta(seconds=CHAT_NOTIFICATION_WINDOW + 1),
+        )
+        created = create_chat_notifications({one: {self.alice.id}})
+        self.assertEqual(sorted(n.user.username for n in created), ['bob', 'carol'])
+
+    async def test_frames_are_fanned_out_in_one_batch(self):
+        batcher = ChatNotificationBatcher(delay=60)
+        for sender in (self.alice, self.alice, self.bob):
+            batcher.queue(self.trips[0].id, sender.id)
+        await batcher.flush()
+        notified = await sync_to_async(self.notified)()
+        self.assertEqual([username for username, _ in notified], ['alice', 'bob', 'carol'])
+
+
+class NotificationBulkTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='alice')
+        other = User.objects.create(username='bob')
+        self.notifications = [Notification.objects.create(user=self.user, content=f'n{i}') for i in range(5)]
+        Notification.objects.create(user=other, content='not yours')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_mark_all_as_read_up_to_id(self):
+        response = self.client.post('/api/notifications/mark_all_as_read/', {'up_to_id': self.notifications[2].id})
+        self.assertEqual(response.data['updated'], 3)
+        self.assertEqual(get_unread_count(self.user.id), 2)
+        response = self.client.post('/api/notifications/mark_all_as_read/')
+        self.assertEqual(response.data['updated'], 2)
+        self.assertEqual(Notification.objects.filter(is_read=False).count(), 1)
+
+    def test_bulk_delete_is_one_statement(self):
+        self.client.post('/api/notifications/mark_all_as_read/', {'up_to_id': self.notifications[1].id})
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/notifications/bulk_delete/', {'is_read': True}, format='json')
+        self.assertEqual(response.data['deleted'], 2)
+        self.assertEqual(len([q for q in queries if q['sql'].startswith('DELETE')]), 1)
+        self.assertEqual(self.client.post('/api/notifications/bulk_delete/', {}).status_code, 400)
+        self.assertEqual(Notification.objects.count(), 4)
+
+
+class NotificationRetentionTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create(username='alice')
+        self.archive_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.archive_dir.cleanup)
+
+    def prune(self, **options):
+        call_command('prune_notifications', archive_dir=self.archive_dir.name, batch_size=2, stdout=StringIO(), **options)
+        return [
+            json.loads(line)
+            for path in Path(self.archive_dir.name).glob('*.jsonl.gz')
+            for line in gzip.open(path, 'rt', encoding='utf-8')
+        ]
+
+    def test_old_read_and_excess_rows_are_archived(self):
+        old = Notification.objects.create(user=self.user, content='old', is_read=True)
+        Notification.objects.filter(id=old.id).update(created_at=timezone.now() - timedelta(days=60))
+        for index in range(5):
+            Notification.objects.create(user=self.user, content=f'recent {index}')
+
+        archived = self.prune(keep=3, read_days=30)
+        self.assertEqual([row['content'] for row in archived], ['old', 'recent 0', 'recent 1'])
+        self.assertEqual(
+            list(Notification.objects.order_by('id').values_list('content', flat=True)),
+            ['recent 2', 'recent 3', 'recent 4'],
+        )
+
+    def test_chat_notifications_are_folded_per_trip(self):
+        trips = [
+            Trip.objects.create(
+                title='Sajek', destination='Rangamati', description='', start_date=date.today(),
+                end_date=date.today(), creator=self.user,
+            )
+            for _ in range(2)
+        ]
+        for trip in trips + trips[:1]:
+            Notification.objects.create(user=self.user, trip=trip, content='💬 New message in "Sajek"')
+
+        self.prune()
+        self.assertEqual(
+            sorted(Notification.objects.filter(trip__isnull=False).values_list('trip_id', 'content')),
+            [(trips[0].id, '💬 2 new messages in "Sajek"'), (trips[1].id, '💬 New message in "Sajek"')],
+        )
+
+    def test_chat_notifications_are_folded(self):
+        for _ in range(3):
+            Notification.objects.create(user=self.user, content='💬 New message in "Sajek"')
+        Notification.objects.create(user=self.user, content='💬 2 new messages in "Sajek"')
+        Notification.objects.create(user=self.user, content='💬 New message in "Sajek"', is_read=True)
+
+        self.prune()
+        self.assertEqual(
+            sorted(Notification.objects.values_list('content', 'is_read')),
+            [('💬 5 new messages in "Sajek"', False), ('💬 New message in "Sajek"', True)],
+        )
+
+
+class JoinTripTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create(username='admin')
+        self.trip = Trip.objects.create(
+            title='Srimangal', destination='Sylhet', description='', start_date=date.today(),
+            end_date=date.today(), creator=self.admin,
+        )
+        TripMember.objects.create(user=self.admin, trip=self.trip, role='admin', status='approved')
+        self.user = User.objects.create(username='bob')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_join_notifies_admins_once(self):
+        url = f'/api/trips/{self.trip.id}/join_trip/'
+        self.assertEqual(self.client.post(url).status_code, 201)
+        self.assertEqual(self.client.post(url).status_code, 400)
+        self.assertEqual(TripMember.objects.filter(trip=self.trip, user=self.user, status='pending').count(), 1)
+        self.assertEqual(
+            list(Notification.objects.values_list('user__username', 'content')),
+            [('admin', 'bob requested to join your trip: Srimangal')],
+        )
+
+
+@override_settings(DATABASE_REPLICA_ALIAS='replica')
+class ReplicaRoutingTests(TestCase):
+    databases = {'default', 'replica'}
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create(username='rina')
+        # The replica lags behind: it only knows this user so far
+        User.objects.using('replica').create(username='replicated')
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def usernames(self):
+        response = self.client.get('/api/users/')
+        self.assertEqual(response.status_code, 200)
+        return [row['username'] for row in response.json()['results']]
+
+    def test_list_reads_from_replica(self):
+        self.assertEqual(self.usernames(), ['replicated'])
+
+    def test_cached_retrieve_reads_from_primary(self):
+        response = self.client.get(f'/api/users/{self.user.pk}/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['username'], 'rina')
+
+    def test_writer_is_pinned_to_primary(self):
+        response = self.client.post('/api/notifications/mark_all_as_read/')
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(cache.get(pin_key(self.user.pk)))
+        self.assertEqual(sorted(self.usernames()), ['rina'])
+
+        cache.delete(pin_key(self.user.pk))
+        self.assertEqual(self.usernames(), ['replicated'])
+
+    def test_membership_is_checked_on_primary(self):
+        trip = Trip.objects.create(
+            title='Bandarban', destination='Chittagong', description='', start_date=date.today(),
+            end_date=date.today(), creator=self.user,
+        )
+        # The replica still has bob's membership, the primary already removed it
+        bob = User.objects.create(username='bob')
+        User.objects.using('replica').all().delete()
+        User.objects.using('replica').create(pk=self.user.pk, username='rina')
+        User.objects.using('replica').create(pk=bob.pk, username='bob')
+        replica_trip = Trip.objects.using('replica').create(
+            pk=trip.pk, title=trip.title, destination=trip.destination, description='',
+            start_date=trip.start_date, end_date=trip.end_date, creator_id=self.user.pk,
+        )
+        TripMember.objects.using('replica').create(trip=replica_trip, user_id=bob.pk, status='approved')
+
+        self.client.force_authenticate(bob)
+        self.assertEqual(self.client.get(f'/api/trips/{trip.pk}/messages/').status_code, 403)
+        self.assertFalse(is_approved_member(trip.pk, bob.pk))
+
+    def test_writes_go_to_primary(self):
+        response = self.client.patch(f'/api/users/{self.user.pk}/', {'bio': 'Hiker'}, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(User.objects.using('default').get(pk=self.user.pk).bio, 'Hiker')
+        self.assertFalse(User.objects.using('replica').filter(username='rina').exists())
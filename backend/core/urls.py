@@ -8,7 +8,9 @@ from .views import (
     UserViewSet,
     NotificationViewSet,
     RegisterAPIView,
-    ReviewViewSet
+    ReviewViewSet,
+    MessageViewSet,
+    ChatMetricsAPIView,
 )
 
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
@@ -20,13 +22,15 @@ router.register(r'trips', TripViewSet)
 router.register(r'members', TripMemberViewSet, basename='tripmember')
 router.register(r'notifications', NotificationViewSet, basename='notification')
 
-# Nested router: /trips/<trip_id>/reviews/
+# Nested router: /trips/<trip_id>/reviews/, /trips/<trip_id>/messages/
 trip_router = NestedDefaultRouter(router, r'trips', lookup='trip')
 trip_router.register(r'reviews', ReviewViewSet, basename='trip-reviews')
+trip_router.register(r'messages', MessageViewSet, basename='trip-messages')
 
 urlpatterns = [
     path('', include(router.urls)),
     path('', include(trip_router.urls)),
+    path('chat/metrics/', ChatMetricsAPIView.as_view(), name='chat-metrics'),
     path('register/', RegisterAPIView.as_view(), name='register'),
     path('token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
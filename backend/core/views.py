@@ -2,23 +2,52 @@ from rest_framework import viewsets, permissions, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
-from .models import Trip, TripMember, User, Review
-from .serializers import TripSerializer, TripMemberSerializer, UserSerializer, NotificationSerializer, Notification, ReviewSerializer
+from .models import Trip, TripMember, User, Review, Message
+from .serializers import TripSerializer, TripMemberSerializer, UserSerializer, NotificationSerializer, Notification, ReviewSerializer, MessageSerializer
+from .serializers import TripListSerializer, UserListSerializer, NotificationBulkSerializer
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from django_filters.rest_framework import DjangoFilterBackend
 from .filters import TripFilter
-from channels.db import database_sync_to_async
 from rest_framework.views import APIView
+from rest_framework.filters import OrderingFilter
+from django.db import transaction
 from rest_framework_simplejwt.tokens import RefreshToken
 from .serializers import RegistrationSerializer
 from rest_framework.exceptions import PermissionDenied
 from django.utils.timezone import now
-
-
-class UserViewSet(viewsets.ModelViewSet):
-    queryset = User.objects.all()
+from .pagination import MessageCursorPagination, NotificationCursorPagination, TripCursorPagination
+from . import ratings
+from .membership import get_admin_ids, is_approved_member, is_trip_admin
+from .search import get_search_backend
+from .recommendations import recommend_trips
+from .presence import presence_index
+from .responsecache import CachedResponseMixin
+from .routers import ReplicaReadMixin
+from .ratelimit import chat_limit_metrics
+from .notifications import adjust_unread_count, get_unread_count, push_notifications, push_unread_count, reset_unread_count
+
+
+class UserViewSet(ReplicaReadMixin, CachedResponseMixin, viewsets.ModelViewSet):
+    queryset = User.objects.prefetch_related('interests')
     serializer_class = UserSerializer
     permission_classes = [permissions.IsAuthenticated]
+    cached_actions = ('retrieve',)
+
+    def response_cache_tags(self, users):
+        return [f'user:{user.pk}' for user in users]
+
+    def response_cache_known_tags(self):
+        return [f'user:{self.kwargs[self.lookup_field]}']
+
+    def get_queryset(self):
+        if self.action == 'list':
+            return User.objects.all()
+        return super().get_queryset()
+
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return UserListSerializer
+        return UserSerializer
 
     @action(detail=False, methods=["GET", "PUT"], url_path="profile")
     def profile(self, request):
@@ -33,12 +62,75 @@ class UserViewSet(viewsets.ModelViewSet):
 
 
 
-class TripViewSet(viewsets.ModelViewSet):
-    queryset = Trip.objects.all()
+class TripViewSet(ReplicaReadMixin, CachedResponseMixin, viewsets.ModelViewSet):
+    queryset = Trip.objects.select_related('creator').prefetch_related('tags')
     serializer_class = TripSerializer
     permission_classes = [permissions.IsAuthenticated]
-    filter_backends = [DjangoFilterBackend]
+    filter_backends = [DjangoFilterBackend, OrderingFilter]
     filterset_class = TripFilter
+    ordering_fields = ['rating_avg', 'rating_count', 'start_date', 'end_date', 'budget']
+    pagination_class = TripCursorPagination
+    # Non-numeric ids are a 404 here and on the nested /trips/<id>/... routes
+    lookup_value_regex = r'\d+'
+
+    def response_cache_tags(self, trips):
+        # Lists go stale with any trip change, pages only with their own trip;
+        # both show the creator's username
+        tags = {'trips'} if self.action == 'list' else {f'trip:{trip.pk}' for trip in trips}
+        return tags | {f'user:{trip.creator_id}' for trip in trips}
+
+    def response_cache_known_tags(self):
+        return ['trips'] if self.action == 'list' else [f'trip:{self.kwargs[self.lookup_field]}']
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action in ('list', 'search', 'recommended'):
+            queryset = queryset.defer('description')
+        return queryset
+
+    def get_serializer_class(self):
+        if self.action in ('list', 'search', 'recommended'):
+            return TripListSerializer
+        return TripSerializer
+
+    def get_limit(self, default=20, maximum=100):
+        try:
+            return max(1, min(int(self.request.query_params.get('limit', default)), maximum))
+        except ValueError:
+            return default
+
+    @action(detail=False, methods=['GET'])
+    def search(self, request):
+        query = request.query_params.get('q', '').strip()
+        if not query:
+            return Response([])
+        # The index returns ids best match first; load them and keep that order
+        ids = get_search_backend().search(query, limit=self.get_limit())
+        trips = self.get_queryset().in_bulk(ids)
+        serializer = self.get_serializer([trips[pk] for pk in ids if pk in trips], many=True)
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['GET'])
+    def recommended(self, request):
+        ranking = recommend_trips(request.user, limit=self.get_limit())
+        trips = self.get_queryset().in_bulk([trip_id for trip_id, _ in ranking])
+        data = []
+        for trip_id, score in ranking:
+            if trip_id in trips:
+                data.append({**self.get_serializer(trips[trip_id]).data, 'score': score})
+        return Response(data)
+
+    @action(detail=True, methods=['GET'])
+    def online(self, request, pk=None):
+        """
+        Members with a live chat socket, answered from the presence index and
+        the membership cache, not the trips table. The index is per process:
+        with several ASGI workers this only lists the sockets of the worker
+        that answers the request.
+        """
+        if not is_approved_member(pk, request.user.id):
+            raise PermissionDenied("You are not an approved member of this trip.")
+        return Response(presence_index.online(pk))
 
     def perform_create(self, serializer):
         trip = serializer.save(creator=self.request.user)
@@ -54,44 +146,46 @@ class TripViewSet(viewsets.ModelViewSet):
         trip = self.get_object()
         user = request.user
 
-        existing_member = TripMember.objects.filter(trip=trip, user=user).first()
-        if existing_member:
+        # get_or_create leans on the unique (user, trip) constraint, so
+        # concurrent requests create one membership and one set of notifications
+        with transaction.atomic():
+            _, created = TripMember.objects.get_or_create(
+                user=user,
+                trip=trip,
+                defaults={'role': 'member', 'status': 'pending'}
+            )
+            if created:
+                # ⬇️ Send notification to trip admin
+                self.send_notification_to_admin(trip, user)
+
+        if not created:
             return Response(
                 {"error": "You have already requested to join or are already a member of this trip."},
                 status=status.HTTP_400_BAD_REQUEST
             )
 
-        TripMember.objects.create(
-            user=user,
-            trip=trip,
-            role='member',
-            status='pending'
-        )
-
-        # ⬇️ Send notification to trip admin
-        self.send_notification_to_admin(trip, user)
-
         return Response(
             {"message": "Join request sent successfully."},
             status=status.HTTP_201_CREATED
         )
 
-    @database_sync_to_async
     def send_notification_to_admin(self, trip, requesting_user):
-        from .models import Notification  # avoid circular import
-        admins = TripMember.objects.filter(trip=trip, role='admin', status='approved')
-        for admin in admins:
-            Notification.objects.create(
-                user=admin.user,
+        created = Notification.objects.bulk_create([
+            Notification(
+                user_id=admin_id,
                 content=f"{requesting_user.username} requested to join your trip: {trip.title}"
             )
+            for admin_id in get_admin_ids(trip.id)
+        ])
+        # bulk_create sends no post_save
+        push_notifications(created)
 
-class TripMemberViewSet(viewsets.ModelViewSet):
+class TripMemberViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     serializer_class = TripMemberSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
-        queryset = TripMember.objects.all()
+        queryset = TripMember.objects.select_related('user', 'trip')
         trip_id = self.request.query_params.get('trip', None)
         if trip_id is not None:
             queryset = queryset.filter(trip_id=trip_id)
@@ -101,13 +195,7 @@ class TripMemberViewSet(viewsets.ModelViewSet):
         trip_member = self.get_object()
 
         # Ensure the user is an admin of the trip
-        admin_member = TripMember.objects.filter(
-            trip=trip_member.trip,
-            user=request.user,
-            role='admin'
-        ).first()
-
-        if not admin_member:
+        if not is_trip_admin(trip_member.trip_id, request.user.id):
             return Response(
                 {"error": "Only trip admins can approve or reject join requests."},
                 status=status.HTTP_403_FORBIDDEN
@@ -159,20 +247,81 @@ class TripMemberViewSet(viewsets.ModelViewSet):
         return Response({'error': 'Cannot leave this trip.'}, status=status.HTTP_400_BAD_REQUEST)
 
 
-class NotificationViewSet(viewsets.ModelViewSet):
+class NotificationViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     serializer_class = NotificationSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = NotificationCursorPagination
+
+    filterset_fields = ['is_read']
 
     def get_queryset(self):
         return Notification.objects.filter(user=self.request.user).order_by('-created_at')
 
+    def get_bulk_queryset(self, criteria):
+        # Ordering is dropped so the UPDATE/DELETE stays a single plain statement
+        queryset = Notification.objects.filter(user=self.request.user)
+        if 'ids' in criteria:
+            queryset = queryset.filter(id__in=criteria['ids'])
+        if 'up_to_id' in criteria:
+            queryset = queryset.filter(id__lte=criteria['up_to_id'])
+        if 'before' in criteria:
+            queryset = queryset.filter(created_at__lte=criteria['before'])
+        if 'is_read' in criteria:
+            queryset = queryset.filter(is_read=criteria['is_read'])
+        return queryset
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        reset_unread_count(instance.user_id)
+        push_unread_count(instance.user_id)
+
     @action(detail=True, methods=['POST'])
     def mark_as_read(self, request, pk=None):
         notification = self.get_object()
-        notification.is_read = True
-        notification.save()
+        # Only the transition from unread moves the counter
+        if Notification.objects.filter(pk=notification.pk, is_read=False).update(is_read=True):
+            adjust_unread_count(request.user.id, -1)
+            push_unread_count(request.user.id)
         return Response({"status": "marked as read"})
 
+    @action(detail=False, methods=['POST'])
+    def mark_all_as_read(self, request):
+        # Optional up_to_id / before limit the batch, e.g. to what the client has seen
+        serializer = NotificationBulkSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        criteria = {**serializer.validated_data, 'is_read': False}
+        updated = self.get_bulk_queryset(criteria).update(is_read=True)
+        if updated:
+            adjust_unread_count(request.user.id, -updated)
+            push_unread_count(request.user.id)
+        return Response({"status": "marked as read", "updated": updated})
+
+    @action(detail=False, methods=['POST'])
+    def bulk_delete(self, request):
+        serializer = NotificationBulkSerializer(data=request.data, require_criteria=True)
+        serializer.is_valid(raise_exception=True)
+        deleted, _ = self.get_bulk_queryset(serializer.validated_data).delete()
+        if deleted:
+            reset_unread_count(request.user.id)
+            push_unread_count(request.user.id)
+        return Response({"status": "deleted", "deleted": deleted})
+
+    @action(detail=False, methods=['GET'])
+    def unread_count(self, request):
+        return Response({"unread_count": get_unread_count(request.user.id)})
+
+
+class MessageViewSet(ReplicaReadMixin, viewsets.ReadOnlyModelViewSet):
+    serializer_class = MessageSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = MessageCursorPagination
+
+    def get_queryset(self):
+        trip_id = self.kwargs['trip_pk']
+        if not is_approved_member(trip_id, self.request.user.id):
+            raise PermissionDenied("You are not an approved member of this trip.")
+        return Message.objects.filter(trip_id=trip_id).select_related('sender')
+
 
 class RegisterAPIView(APIView):
     permission_classes = [permissions.AllowAny]
@@ -190,35 +339,50 @@ class RegisterAPIView(APIView):
         }, status=status.HTTP_201_CREATED)
 
 
-class ReviewViewSet(viewsets.ModelViewSet):
+class ChatMetricsAPIView(APIView):
+    """Chat rate limits and size caps of this worker, with what they refused."""
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return Response(chat_limit_metrics())
+
+
+class ReviewViewSet(ReplicaReadMixin, viewsets.ModelViewSet):
     serializer_class = ReviewSerializer
     permission_classes = [permissions.IsAuthenticated]
 
     def get_queryset(self):
         trip_id = self.kwargs.get('trip_pk')
+        queryset = Review.objects.select_related('reviewer')
         if trip_id:
-            return Review.objects.filter(trip__id=trip_id)
-        return Review.objects.filter(reviewer=self.request.user)
+            return queryset.filter(trip__id=trip_id)
+        return queryset.filter(reviewer=self.request.user)
 
     def perform_create(self, serializer):
         trip = serializer.validated_data['trip']
         user = self.request.user
         if trip.end_date > now().date():
             raise PermissionDenied("Trip has not ended yet.")
-        from .models import TripMember
-        is_approved = TripMember.objects.filter(trip=trip, user=user, status='approved').exists()
-        if not is_approved:
+        if not is_approved_member(trip.id, user.id):
             raise PermissionDenied("You are not an approved member of this trip.")
         if Review.objects.filter(trip=trip, reviewer=user).exists():
             raise PermissionDenied("You have already reviewed this trip.")
-        serializer.save(reviewer=user)
+        with transaction.atomic():
+            review = serializer.save(reviewer=user)
+            ratings.review_added(review)
 
     def perform_update(self, serializer):
-        if self.get_object().reviewer != self.request.user:
+        review = serializer.instance
+        if review.reviewer != self.request.user:
             raise PermissionDenied("You can only edit your own review.")
-        serializer.save()
+        old_trip_id, old_rating = review.trip_id, review.rating
+        with transaction.atomic():
+            review = serializer.save()
+            ratings.review_changed(old_trip_id, old_rating, review)
 
     def perform_destroy(self, instance):
         if instance.reviewer != self.request.user:
             raise PermissionDenied("You can only delete your own review.")
-        instance.delete()
\ No newline at end of file
+        with transaction.atomic():
+            instance.delete()
+            ratings.review_removed(instance)
\ No newline at end of file
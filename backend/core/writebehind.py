@@ -0,0 +1,211 @@
+import asyncio
+import atexit
+import itertools
+import json
+import logging
+import os
+import re
+import threading
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+from django.utils import timezone
+
+from .models import Message
+
+logger = logging.getLogger(__name__)
+
+# Names a process's spool segments together with its pid; a restarted worker
+# that is handed the same pid (common in containers) still gets new files
+PROCESS_ID = uuid.uuid4().hex
+# Segment numbers are process-wide, so buffers sharing a spool directory never collide
+SEGMENT_NUMBERS = itertools.count()
+# The process id is missing from segments written before it was introduced
+SEGMENT_RE = re.compile(r'^messages-(?P<pid>\d+)(?:-(?P<process>[0-9a-f]{32}))?-(?P<segment>c?\d+)\.jsonl$')
+
+
+class MessageWriteBuffer:
+    """
+    Write-behind store for chat messages. Frames are appended to a local
+    spool file and kept in memory; every ``batch_size`` messages or
+    ``interval`` seconds they are written with one bulk_create and their
+    spool segment is removed. Segments left behind by a crashed process are
+    claimed by renaming them and then replayed by ``recover``, so delivery
+    is at-least-once: a crash between the insert and the unlink replays
+    that segment.
+    """
+
+    def __init__(self, spool_dir, batch_size=100, interval=0.5, fsync=False):
+        self.spool_dir = Path(spool_dir)
+        self.batch_size = batch_size
+        self.interval = interval
+        self.fsync = fsync
+        self.pending = []
+        self.failed = []
+        self.stats = {'buffered': 0, 'written': 0, 'batches': 0, 'recovered': 0, 'write_seconds': 0.0}
+        self._file = None
+        self._path = None
+        self._task = None
+        self._flushes = set()
+        self._recovered = False
+        self._lock = threading.Lock()
+
+    def segment_path(self, segment):
+        return self.spool_dir / f'messages-{os.getpid()}-{PROCESS_ID}-{segment}.jsonl'
+
+    def add(self, trip_id, sender_id, content, timestamp=None):
+        entry = {
+            'trip_id': int(trip_id),
+            'sender_id': sender_id,
+            'content': content,
+            'timestamp': (timestamp or timezone.now()).isoformat(),
+        }
+        with self._lock:
+            if self._file is None:
+                self.spool_dir.mkdir(parents=True, exist_ok=True)
+                self._path = self.segment_path(next(SEGMENT_NUMBERS))
+                self._file = open(self._path, 'x', encoding='utf-8')
+            self._file.write(json.dumps(entry) + '\n')
+            self._file.flush()
+            if self.fsync:
+                os.fsync(self._file.fileno())
+            self.pending.append(entry)
+            self.stats['buffered'] += 1
+            full = len(self.pending) >= self.batch_size
+        self.schedule(full)
+
+    def schedule(self, full):
+        loop = asyncio.get_running_loop()
+        if full:
+            task = loop.create_task(self.flush())
+            self._flushes.add(task)
+            task.add_done_callback(self._flushes.discard)
+        elif self._task is None or self._task.done() or self._task.get_loop() is not loop:
+            self._task = loop.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        await asyncio.sleep(self.interval)
+        await self.flush()
+
+    def rotate(self):
+        """Detach the pending batch and its spool segment; new frames go to a fresh segment."""
+        with self._lock:
+            batch, self.pending = self.pending, []
+            path = self._path
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+            batches, self.failed = self.failed, []
+        if batch:
+            batches.append((batch, path))
+        return batches
+
+    async def flush(self):
+        batches = self.rotate()
+        if batches or not self._recovered:
+            await database_sync_to_async(self.write_batches)(batches)
+
+    def flush_sync(self):
+        self.write_batches(self.rotate())
+
+    def write_batches(self, batches):
+        if not self._recovered:
+            self._recovered = True
+            try:
+                self.recover()
+            except Exception:
+                logger.exception('Replaying the chat message spool failed')
+        for batch, path in batches:
+            started = time.perf_counter()
+            try:
+                Message.objects.bulk_create([message_from_entry(entry) for entry in batch])
+            except Exception:
+                logger.exception('Writing %d buffered chat messages failed; will retry', len(batch))
+                with self._lock:
+                    self.failed.append((batch, path))
+                continue
+            path.unlink(missing_ok=True)
+            self.stats['written'] += len(batch)
+            self.stats['batches'] += 1
+            self.stats['write_seconds'] += time.perf_counter() - started
+
+    def recover(self):
+        """Replay spool segments left by processes that are no longer running."""
+        if not self.spool_dir.exists():
+            return 0
+        recovered = 0
+        for path in sorted(self.spool_dir.iterdir()):
+            match = SEGMENT_RE.match(path.name)
+            if match is None or segment_owner_alive(int(match['pid']), match['process']):
+                continue
+            # The rename is atomic: of several recovering processes only one
+            # wins a segment, and this process never writes to a claimed name
+            claimed = self.segment_path(f'c{next(SEGMENT_NUMBERS)}')
+            try:
+                path.rename(claimed)
+            except FileNotFoundError:
+                continue
+            path = claimed
+            entries = []
+            with open(path, encoding='utf-8') as spool:
+                for line in spool:
+                    try:
+                        entries.append(json.loads(line))
+                    except ValueError:
+                        # A line cut short by the crash was never acknowledged
+                        break
+            Message.objects.bulk_create([message_from_entry(entry) for entry in entries])
+            path.unlink()
+            recovered += len(entries)
+        self.stats['recovered'] += recovered
+        return recovered
+
+
+def message_from_entry(entry):
+    return Message(
+        trip_id=entry['trip_id'],
+        sender_id=entry['sender_id'],
+        content=entry['content'],
+        timestamp=datetime.fromisoformat(entry['timestamp']),
+    )
+
+
+def segment_owner_alive(pid, process):
+    if pid == os.getpid():
+        # Same pid, other process id: an earlier process that held this pid
+        return process == PROCESS_ID
+    return process_alive(pid)
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+CHAT_WRITE_BEHIND = getattr(settings, 'CHAT_WRITE_BEHIND', False)
+
+message_buffer = MessageWriteBuffer(
+    spool_dir=getattr(settings, 'CHAT_WRITE_BEHIND_SPOOL_DIR', settings.BASE_DIR / 'spool'),
+    batch_size=getattr(settings, 'CHAT_WRITE_BEHIND_BATCH_SIZE', 100),
+    interval=getattr(settings, 'CHAT_WRITE_BEHIND_INTERVAL', 0.5),
+    fsync=getattr(settings, 'CHAT_WRITE_BEHIND_FSYNC', False),
+)
+
+
+@atexit.register
+def flush_on_exit():
+    if message_buffer.pending or message_buffer.failed:
+        try:
+            message_buffer.flush_sync()
+        except Exception:
+            # The spool still holds them; the next process replays it
+            logger.exception('Flushing buffered chat messages at exit failed')
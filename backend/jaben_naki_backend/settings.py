@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import os
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -46,6 +47,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    # First, so it measures everything below it; scraped at /metrics
+    'core.instrumentation.InstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -78,13 +81,69 @@ WSGI_APPLICATION = 'jaben_naki_backend.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Configured from the environment. Without DB_ENGINE it is the local SQLite
+# file, with a busy timeout and IMMEDIATE transactions so concurrent chat
+# writes from worker threads wait for the lock instead of failing with
+# "database is locked". DB_SQLITE_WAL=1 also switches the file to WAL mode so
+# readers don't block the writer; that rewrites the file header for good, so
+# it is left off for the development database checked into the repository.
+# For PostgreSQL set DB_ENGINE=django.db.backends.postgresql plus DB_NAME,
+# DB_USER, DB_PASSWORD, DB_HOST and DB_PORT; DB_POOL=1 uses psycopg's
+# connection pool instead of persistent connections.
+DB_ENGINE = os.environ.get('DB_ENGINE', 'django.db.backends.sqlite3')
+
+
+def database(prefix, default_name):
+    if DB_ENGINE == 'django.db.backends.sqlite3':
+        wal = os.environ.get('DB_SQLITE_WAL') == '1'
+        return {
+            'ENGINE': DB_ENGINE,
+            'NAME': os.environ.get(f'{prefix}_NAME', default_name),
+            'CONN_MAX_AGE': int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+            'CONN_HEALTH_CHECKS': True,
+            'OPTIONS': {
+                'timeout': float(os.environ.get('DB_BUSY_TIMEOUT', 20)),
+                'transaction_mode': 'IMMEDIATE',
+                **({'init_command': 'PRAGMA journal_mode=WAL; PRAGMA synchronous=NORMAL;'} if wal else {}),
+            },
+        }
+    pool = os.environ.get('DB_POOL') == '1'
+    return {
+        'ENGINE': DB_ENGINE,
+        'NAME': os.environ.get(f'{prefix}_NAME', default_name),
+        'USER': os.environ.get(f'{prefix}_USER', os.environ.get('DB_USER', '')),
+        'PASSWORD': os.environ.get(f'{prefix}_PASSWORD', os.environ.get('DB_PASSWORD', '')),
+        'HOST': os.environ.get(f'{prefix}_HOST', os.environ.get('DB_HOST', '')),
+        'PORT': os.environ.get(f'{prefix}_PORT', os.environ.get('DB_PORT', '')),
+        # A pool and persistent connections are mutually exclusive
+        'CONN_MAX_AGE': 0 if pool else int(os.environ.get('DB_CONN_MAX_AGE', 60)),
+        'CONN_HEALTH_CHECKS': True,
+        'OPTIONS': {'pool': True} if pool else {},
     }
+
+
+DATABASES = {
+    'default': database('DB', BASE_DIR / 'db.sqlite3'),
 }
 
+# Read replica: set DB_REPLICA_NAME (SQLite) or DB_REPLICA_HOST. List and
+# retrieve requests of the API ViewSets then read from it (core/routers.py).
+DATABASE_REPLICA_ALIAS = None
+if os.environ.get('DB_REPLICA_NAME') or os.environ.get('DB_REPLICA_HOST'):
+    DATABASES['replica'] = database('DB_REPLICA', os.environ.get('DB_NAME', BASE_DIR / 'db.sqlite3'))
+    DATABASE_REPLICA_ALIAS = 'replica'
+else:
+    # Without a replica the alias is the primary and routing stays off. Test
+    # runs still give it a database of its own (in memory for SQLite) for the
+    # routing tests, which switch routing on themselves.
+    replica_test_name = None
+    if DB_ENGINE != 'django.db.backends.sqlite3':
+        replica_test_name = f"test_{DATABASES['default']['NAME']}_replica"
+    DATABASES['replica'] = {**DATABASES['default'], 'TEST': {'NAME': replica_test_name}}
+DATABASE_ROUTERS = ['core.routers.ReplicaRouter']
+# After a write, the user's reads stay on the primary this long, so they see their own changes
+DATABASE_REPLICA_PIN_SECONDS = int(os.environ.get('DB_REPLICA_PIN_SECONDS', 5))
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -129,11 +188,60 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 AUTH_USER_MODEL = 'core.User'
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'core.authentication.CachedJWTAuthentication',
     ),
     'DEFAULT_FILTER_BACKENDS': ['django_filters.rest_framework.DjangoFilterBackend'],
+    # orjson-backed JSON when installed, the stdlib otherwise
+    'DEFAULT_RENDERER_CLASSES': [
+        'core.renderers.FastJSONRenderer',
+        'rest_framework.renderers.BrowsableAPIRenderer',
+    ],
+    'DEFAULT_PARSER_CLASSES': [
+        'core.renderers.FastJSONParser',
+        'rest_framework.parsers.FormParser',
+        'rest_framework.parsers.MultiPartParser',
+    ],
+    'DEFAULT_PAGINATION_CLASS': 'core.pagination.DefaultCursorPagination',
+    'PAGE_SIZE': 20,
 }
 REST_FRAMEWORK['DEFAULT_FILTER_BACKENDS'] = ['django_filters.rest_framework.DjangoFilterBackend']
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
-ASGI_APPLICATION = 'jaben_naki_backend.routing.application'
\ No newline at end of file
+# Stream every upload to a temporary file as it arrives instead of holding
+# small ones in memory; profile photos are resized from there in the background
+FILE_UPLOAD_HANDLERS = ['django.core.files.uploadhandler.TemporaryFileUploadHandler']
+ASGI_APPLICATION = 'jaben_naki_backend.routing.application'
+
+# Caches
+# Unread counters, trip memberships, users resolved from tokens and cached
+# API responses live here. The default in-process cache only serves one
+# worker; point CACHE_BACKEND and CACHE_LOCATION at a shared backend (e.g.
+# django.core.cache.backends.redis.RedisCache) in production.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', ''),
+    },
+}
+
+# Channel layers
+# Set CHANNEL_REDIS_HOSTS (comma-separated redis:// URLs, any Redis-protocol
+# server) to share chat groups between workers. channels_redis shards each
+# trip_<id> group onto one of the hosts by consistent hashing of its name.
+# Without it the in-process layer stands in, which only reaches one worker.
+CHANNEL_REDIS_HOSTS = [host for host in os.environ.get('CHANNEL_REDIS_HOSTS', '').split(',') if host]
+CHANNEL_LAYER_BACKEND = os.environ.get(
+    'CHANNEL_LAYER_BACKEND',
+    'channels_redis.core.RedisChannelLayer' if CHANNEL_REDIS_HOSTS else 'channels.layers.InMemoryChannelLayer',
+)
+CHANNEL_LAYERS = {
+    'default': {
+        'BACKEND': CHANNEL_LAYER_BACKEND,
+        'CONFIG': {
+            'capacity': int(os.environ.get('CHANNEL_LAYER_CAPACITY', 1000)),
+            'expiry': int(os.environ.get('CHANNEL_LAYER_EXPIRY', 60)),
+        },
+    },
+}
+if CHANNEL_REDIS_HOSTS:
+    CHANNEL_LAYERS['default']['CONFIG']['hosts'] = CHANNEL_REDIS_HOSTS
\ No newline at end of file